@@ -0,0 +1,157 @@
+# alert_pipeline.py
+# Sits between detection and the dashboards. A flooding flow raises the same
+# alert on every record it sends; instead of one Socket.IO message per alert,
+# alerts are deduplicated by (type, flow_key) within a window, repeats are
+# coalesced into a count, and a flush thread sends each connected client one
+# batch per interval, capped by that client's token bucket.
+#
+# Under eventlet the flush thread is a green thread, like the ingest consumers.
+import threading
+import time
+from collections import OrderedDict
+
+SEVERITY_ORDER = {'Critical': 0, 'High': 1, 'Medium': 2, 'Low': 3}
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def take(self, wanted, now):
+        """Takes up to wanted tokens and returns how many it got."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        granted = min(int(self.tokens), wanted)
+        self.tokens -= granted
+        return granted
+
+class AlertPipeline:
+    def __init__(self, emit, window=10.0, flush_interval=1.0, client_rate=5.0, client_burst=20, max_entries=10000):
+        """
+        :param emit: Sends one batch to one client, as emit(event, payload, to=client_id) (socketio.emit).
+        :param window: Seconds repeats of an alert are folded into its first occurrence.
+        :param flush_interval: Seconds between batches sent to the clients.
+        :param client_rate: Alerts per second each client is sent on average.
+        :param client_burst: Alerts a client can be sent at once after a quiet period.
+        :param max_entries: Distinct alerts tracked per window; further new ones are dropped and counted.
+        """
+        self.emit = emit
+        self.window = window
+        self.flush_interval = flush_interval
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.max_entries = max_entries
+        # (type, flow_key) -> alert summary, oldest first; summaries stay until their window ends
+        self._entries = OrderedDict()
+        self._changed = {} # summaries that are new or repeated since the last flush, by key
+        self._clients = {} # client id -> TokenBucket
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self.counters = {'received': 0, 'coalesced': 0, 'overflow': 0, 'flushes': 0, 'sent': 0, 'suppressed': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Sends a last batch and stops the flush thread."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def add_client(self, client_id, now=None):
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._clients[client_id] = TokenBucket(self.client_rate, self.client_burst, now)
+
+    def remove_client(self, client_id):
+        with self._lock:
+            self._clients.pop(client_id, None)
+
+    def add(self, record, alerts, now=None):
+        """Takes the alerts raised for one record (the ingest pipeline's on_alerts)."""
+        now = time.monotonic() if now is None else now
+        flow_key = record.get('flow_key')
+        with self._lock:
+            self._expire(now)
+            for alert in alerts:
+                self.counters['received'] += 1
+                # Alerts without a flow (host alerts) are told apart by their description
+                key = (alert.get('type'), flow_key or alert.get('description'))
+                summary = self._entries.get(key)
+                if summary is not None:
+                    self.counters['coalesced'] += 1
+                    summary['count'] += 1
+                    summary['details'] = alert.get('details', summary['details'])
+                    summary['last_seen'] = time.time()
+                elif len(self._entries) >= self.max_entries:
+                    self.counters['overflow'] += 1
+                    continue
+                else:
+                    self._next_id += 1
+                    summary = dict(alert, id=self._next_id, flow_key=flow_key, count=1, first_seen=time.time())
+                    summary['last_seen'] = summary['first_seen']
+                    summary['_opened'] = now
+                    summary['_sent_count'] = 0
+                    self._entries[key] = summary
+                self._changed[key] = summary
+
+    def _expire(self, now):
+        """Closes the summaries whose window has ended, so the next repeat is reported as a new alert."""
+        entries = self._entries
+        while entries:
+            key, summary = next(iter(entries.items()))
+            if now - summary['_opened'] < self.window:
+                break
+            del entries[key]
+
+    def flush(self, now=None):
+        """Sends every client the alerts that are new or repeated since the last flush, most severe first."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._expire(now)
+            changed, self._changed = list(self._changed.values()), {}
+            batch = []
+            for summary in changed:
+                item = {k: v for k, v in summary.items() if not k.startswith('_')}
+                # How many occurrences the clients haven't been told about yet
+                item['new'] = summary['count'] - summary['_sent_count']
+                summary['_sent_count'] = summary['count']
+                batch.append(item)
+            clients = [(client_id, bucket.take(len(batch), now)) for client_id, bucket in self._clients.items()]
+            self.counters['flushes'] += 1
+        if not batch:
+            return
+        batch.sort(key=lambda item: (SEVERITY_ORDER.get(item.get('severity'), len(SEVERITY_ORDER)), -item['new']))
+        for client_id, granted in clients:
+            payload = {'alerts': batch[:granted], 'suppressed': len(batch) - granted}
+            try:
+                self.emit('alert_batch', payload, to=client_id)
+            except Exception as e:
+                print(f"Error sending alerts to {client_id}: {e}")
+                continue
+            with self._lock:
+                self.counters['sent'] += granted
+                self.counters['suppressed'] += len(batch) - granted
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error flushing alerts: {e}")
+
+    def stats(self):
+        """Counters for alerts received, coalesced, sent and suppressed, plus open summaries and clients."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['open'] = len(self._entries)
+            stats['clients'] = len(self._clients)
+        return stats
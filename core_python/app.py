@@ -113,114 +113,362 @@
 # app.py
 import eventlet
 eventlet.monkey_patch()
+from eventlet import tpool
 
 from flask import Flask, render_template, request, jsonify
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, join_room, leave_room
 from detection_engine import DetectionEngine
+from detection_pool import DetectionPool
+from detection_cascade import DetectionCascade, load_allowlist
+from score_cache import ScoreCache
+from stream_aggregates import StreamAggregates
+from ingest import IngestPipeline
+from alert_pipeline import AlertPipeline
+from broadcast import BroadcastScheduler, ALL_ROOM, host_room
+from host_state import HostRegistry, DEFAULT_HOST
+from timeseries_store import TimeSeriesStore, RESOLUTIONS
+import gzip
+import json
+import os
 import time
-from threading import Lock
+
+# msgpack is optional; without it the batch endpoint only accepts JSON bodies
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # Create Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'a_very_secret_key'  
 socketio = SocketIO(app, async_mode='eventlet')
 
-# Global variables to track network traffic rate
-last_check_time = time.time()
-bytes_sent_since_last = 0
-# FIX 1: Add a global variable to track received bytes
-bytes_received_since_last = 0
-data_lock = Lock()
-
 # Initialize detection engine (ML models)
 try:
     detection_engine = DetectionEngine(
         iso_forest_path='isolation_forest_model.joblib',
         rf_path='random_forest_model.joblib',
-        label_encoder_path='label_encoder.joblib'
+        label_encoder_path='label_encoder.joblib',
+        mmap_mode='r'
     )
 except FileNotFoundError:
     print("CRITICAL: Model files not found. Detection engine disabled.")
     detection_engine = None
 
+# Detection runs in worker processes, one per core, forked here before any green thread
+# exists. They share the loaded models copy-on-write.
+detection_pool = DetectionPool(detection_engine) if detection_engine else None
+
+# Cheap stages run here first: allowlisted hosts, the flood rule, the scan and flood rules
+# over one-minute aggregates of all flows, and cached verdicts for flows whose features
+# barely changed since they were last scored. Only what is left goes to the workers'
+# model stages.
+detection_cascade = DetectionCascade(
+    rules=detection_engine.simple_rules,
+    score_models=detection_pool.score_models_batch,
+    allowlist=load_allowlist('allowlist.txt'),
+    aggregates=StreamAggregates(window=60.0, scan_threshold=100, syn_flood_threshold=1000,
+                                source_flow_threshold=2000),
+    cache=ScoreCache(max_entries=100000, ttl=300.0, tolerance=0.1),
+    features=detection_engine.iso_forest_features
+) if detection_engine else None
+
+# Alerts are deduplicated per (type, flow) over 10s and sent to each dashboard once a
+# second, at most 5 per second on average per client
+alert_pipeline = AlertPipeline(
+    emit=socketio.emit,
+    window=10.0,
+    flush_interval=1.0,
+    client_rate=5.0,
+    client_burst=20
+)
+
+# Dashboard state (host metrics, traffic rates) is published here as it arrives and sent
+# as one delta frame per room, 4 times a second
+broadcast = BroadcastScheduler(emit=socketio.emit, rate=4.0, use_msgpack=False)
+
+# Per-agent state, spread over independently locked shards. Once a second each host's
+# byte counters become rates, published per host and as a total.
+# Expired hosts are dropped from the dashboard state too; one that comes back is sent in full
+hosts = HostRegistry(shards=16, rate_interval=1.0, on_rates=lambda rates, total: publish_rates(rates, total),
+                     on_expire=broadcast.forget_hosts)
+
+# History of metrics, traffic, flows and alerts in SQLite (WAL). Records are written in one
+# transaction a second on a native thread, so commits never stall the hub.
+history = TimeSeriesStore(os.path.join('data', 'history.db'), flush_interval=1.0, max_queue=100000,
+                          compact_interval=300.0, offload=tpool.execute)
+
+def record_alerts(record, alerts):
+    alert_pipeline.add(record, alerts)
+    history.add_alerts(record, alerts)
+
+# Request handlers only validate and enqueue. Consumer green threads update the dashboard
+# and hand detection batches to the pool; waiting for a worker yields to the hub.
+# One consumer more than there are workers keeps every worker busy.
+ingest = IngestPipeline(
+    on_record=lambda data: handle_record(data),
+    detect_batch=detection_cascade.detect_threats_batch if detection_cascade else None,
+    on_alerts=record_alerts,
+    workers=detection_pool.workers + 1 if detection_pool else 1,
+    max_queue=100000,
+    max_batch_size=1024,
+    max_delay=0.005
+)
+ingest.start()
+alert_pipeline.start()
+broadcast.start()
+hosts.start()
+history.start()
+
 @app.route('/')
 def index():
     """Serve the main dashboard page."""
-    return render_template('index.html')
+    return render_template('index.html', broadcast_msgpack=broadcast.use_msgpack)
+
+# Set by agents on batches replayed from their spool (transport.REPLAYED_HEADER)
+REPLAYED_HEADER = 'X-SmartSec-Replayed'
+
+def decode_batch(req):
+    """
+    Decodes the body of a batch upload into a list of records.
+    The body is a JSON or msgpack array, optionally gzip-compressed (Content-Encoding: gzip).
+    """
+    body = req.get_data()
+    if req.headers.get('Content-Encoding', '').lower() == 'gzip':
+        try:
+            body = gzip.decompress(body)
+        except OSError:
+            raise ValueError("Invalid gzip body")
+
+    if req.mimetype in ('application/msgpack', 'application/x-msgpack'):
+        if msgpack is None:
+            raise ValueError("msgpack payloads are not supported on this server")
+        try:
+            records = msgpack.unpackb(body, raw=False)
+        except Exception:
+            raise ValueError("Invalid msgpack body")
+    else:
+        try:
+            records = json.loads(body)
+        except ValueError:
+            raise ValueError("Invalid JSON body")
+
+    if not isinstance(records, list):
+        raise ValueError("Batch body must be an array of records")
+    return records
 
 @app.route('/api/data', methods=['POST'])  
 def receive_data():
     """API endpoint for agents to post their data."""
-    # Use global variables for rate calculation
-    global last_check_time, bytes_sent_since_last, bytes_received_since_last
-    
-    data = request.get_json()
-    if not data:
+    data = request.get_json(silent=True)
+    if not data or not isinstance(data, dict):
         return jsonify({"status": "error", "message": "Invalid data"}), 400
 
+    if not ingest.submit([data]):
+        return jsonify({"status": "error", "message": "Server busy, retry later"}), 503
+    return jsonify({"status": "success"}), 200
+
+@app.route('/api/data/batch', methods=['POST'])
+def receive_data_batch():
+    """Bulk API endpoint: agents post many records in one (optionally compressed) request."""
+    try:
+        records = decode_batch(request)
+    except ValueError as e:
+        # 415 tells agents to resend the batch as JSON
+        unsupported = msgpack is None and request.mimetype in ('application/msgpack', 'application/x-msgpack')
+        return jsonify({"status": "error", "message": str(e)}), 415 if unsupported else 400
+
+    records = [data for data in records if isinstance(data, dict) and data]
+    if request.headers.get(REPLAYED_HEADER):
+        # Spooled while the server was unreachable: archived at the records' own timestamps only.
+        # Fed to detection and the host rates, old traffic would count as happening now.
+        for data in records:
+            history.add_record(data)
+        return jsonify({"status": "success", "received": len(records), "archived": len(records)}), 200
+    if not ingest.submit(records):
+        # The agents retry or spool the batch, so nothing is lost by refusing it
+        return jsonify({"status": "error", "message": "Server busy, retry later"}), 503
+    return jsonify({"status": "success", "received": len(records)}), 200
+
+@app.route('/api/ingest/stats')
+def ingest_stats():
+    """Ingest queue depth and counters, for monitoring and the load test."""
+    return jsonify(ingest.stats())
+
+@app.route('/api/detection/stats')
+def detection_stats():
+    """Hits and pass-through rates of each detection stage."""
+    if detection_cascade is None:
+        return jsonify({"status": "error", "message": "Detection engine disabled"}), 503
+    return jsonify(detection_cascade.stats())
+
+@app.route('/api/alerts/stats')
+def alert_stats():
+    """Alerts received, coalesced, sent and suppressed by the alert pipeline."""
+    return jsonify(alert_pipeline.stats())
+
+@app.route('/api/hosts')
+def list_hosts():
+    """Every host the agents reported from, with its traffic rates and latest CPU and memory usage."""
+    return jsonify(hosts.hosts())
+
+@app.route('/api/hosts/<host_id>/metrics')
+def host_metrics(host_id):
+    """One host's latest system metrics, traffic rates and totals."""
+    snapshot = hosts.host(host_id)
+    if snapshot is None:
+        return jsonify({"status": "error", "message": f"Unknown host {host_id}"}), 404
+    return jsonify(snapshot)
+
+def history_query(req, default_span):
+    """
+    Reads host, from and to (epoch seconds) from the query string; to defaults to now and
+    from to default_span seconds earlier. Raises ValueError on a malformed or empty range.
+    """
+    try:
+        end = float(req.args.get('to', time.time()))
+        start = float(req.args.get('from', end - default_span))
+    except ValueError:
+        raise ValueError("from and to must be epoch seconds")
+    if start >= end:
+        raise ValueError("from must be before to")
+    return req.args.get('host'), start, end
+
+@app.route('/api/history/metrics')
+def history_metrics():
+    """One host's CPU and memory history; resolution is 1, 60 or 3600 seconds (default 60, last day)."""
+    try:
+        host_id, start, end = history_query(request, 86400)
+        resolution = int(request.args.get('resolution', 60))
+        if host_id is None:
+            raise ValueError("host is required")
+        if resolution not in RESOLUTIONS:
+            raise ValueError(f"resolution must be one of {RESOLUTIONS}")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(tpool.execute(history.metrics, host_id, start, end, resolution))
+
+@app.route('/api/hosts/<host_id>/processes')
+def host_processes(host_id):
+    """A host's full process table, rebuilt from the deltas its agent sends; stale after a missed delta."""
+    table = hosts.processes(host_id)
+    if table is None:
+        return jsonify({"status": "error", "message": f"No process table for host {host_id}"}), 404
+    return jsonify(table)
+
+@app.route('/api/traffic')
+def traffic_history():
+    """
+    Sent and received rates for the traffic chart, from the history rollups: ?host=&from=&to=&step=
+    (default: all hosts, the last hour). At most points points (default 500), picked by LTTB or,
+    with method=minmax, the lowest and highest point per bucket.
+    """
+    try:
+        host_id, start, end = history_query(request, 3600)
+        step = float(request.args['step']) if 'step' in request.args else None
+        points = min(int(request.args.get('points', 500)), 5000)
+        method = request.args.get('method', 'lttb')
+        if method not in ('lttb', 'minmax'):
+            raise ValueError("method must be lttb or minmax")
+        if (step is not None and step <= 0) or points < 3:
+            raise ValueError("step must be positive and points at least 3")
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    series = tpool.execute(history.traffic_series, host_id, start, end, step, points, method)
+    return jsonify(dict(series, host=host_id, method=method))
+
+@app.route('/api/history/flows')
+def history_flows():
+    """Stored flow records, newest first (default: the last hour, all hosts, at most 1000)."""
+    try:
+        host_id, start, end = history_query(request, 3600)
+        limit = min(int(request.args.get('limit', 1000)), 10000)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(tpool.execute(history.flows, host_id, start, end, limit))
+
+@app.route('/api/history/alerts')
+def history_alerts():
+    """Stored alerts, newest first (default: the last day, all hosts, at most 1000)."""
+    try:
+        host_id, start, end = history_query(request, 86400)
+        limit = min(int(request.args.get('limit', 1000)), 10000)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(tpool.execute(history.alerts, host_id, start, end, limit))
+
+@app.route('/api/history/stats')
+def history_stats():
+    """Records queued, written and dropped by the history store, and its size on disk."""
+    return jsonify(history.stats())
+
+@app.route('/api/broadcast/stats')
+def broadcast_stats():
+    """Dashboard frames and bytes sent, in total and per second."""
+    return jsonify(broadcast.stats())
+
+def handle_record(data):
+    """Routes one agent record to its host's state and the dashboard (runs on an ingest consumer, not in the request)."""
     data_type = data.get('type')
+    host_id = str(data.get('host_id', DEFAULT_HOST))
+
+    history.add_record(data)
 
     # Handle system metrics and top processes
     if data_type == 'system_metrics':
-        # Emit system data on a specific channel
-        socketio.emit('system_metrics_update', data.get('metrics', {}))
-
-    # Handle network data for alerts AND traffic rate calculation
+        # Process deltas are applied to the host's process table; the dashboard gets its top processes
+        metrics = hosts.update_metrics(host_id, data.get('metrics', {}), timestamp=data.get('timestamp'))
+        # Latest metrics per host; the broadcast scheduler sends what changed on its next tick.
+        # None: older than the snapshot already held, e.g. delivered late.
+        if metrics is not None:
+            broadcast.publish('system_metrics', host_id, metrics, host_id=host_id)
+
+    # Handle network data for traffic rate calculation
     elif data_type == 'network_flow':
-        # 1. Accumulate bytes for rate calculation
-        with data_lock:
-            # FIX 2: Use src_bytes and dst_bytes from the agent's payload
-            # The agent sends src_bytes and dst_bytes for each flow.
-            # We can use these to calculate sent and received traffic.
-            sent_bytes = data.get('src_bytes', 0)
-            received_bytes = data.get('dst_bytes', 0)
-
-            # Accumulate bytes based on the flow direction
-            # For each flow, the agent's perspective is 'src' is always local.
-            # However, your app logic needs to correctly categorize them.
-            # Your agent sorts the flow_key, so we need to know which side is local.
-            # A simpler way is to use the `dst_bytes` for received traffic.
-            bytes_sent_since_last += sent_bytes
-            bytes_received_since_last += received_bytes
-
-        # 2. Check if it's time to calculate and emit the rate (e.g., every 1 second)
-        current_time = time.time()
-        if current_time - last_check_time >= 1.0:
-            with data_lock:
-                elapsed_time = current_time - last_check_time
-                # Calculate rate in Bytes/sec
-                sent_rate = bytes_sent_since_last / elapsed_time
-                received_rate = bytes_received_since_last / elapsed_time # FIX 3: Calculate received rate
-
-                # Emit the calculated rate on a new, specific channel for the graph
-                socketio.emit('network_traffic_update', {
-                    'sent': sent_rate,
-                    'received': received_rate 
-                })
-
-                # Reset counters for the next interval
-                bytes_sent_since_last = 0
-                bytes_received_since_last = 0 # FIX 4: Reset the received counter
-                last_check_time = current_time
-
-        # 3. Run threat detection on the packet data
-        if detection_engine:
-            alerts = detection_engine.detect_threats(data)
-            if alerts:
-                for alert in alerts:
-                    socketio.emit('new_alert', alert)
-
-    return jsonify({"status": "success"}), 200
+        # Flow-level records carry the bytes seen since the flow was last reported;
+        # the cumulative counters are the fallback for older agents.
+        sent_bytes = data.get('src_bytes_delta', data.get('src_bytes', 0))
+        received_bytes = data.get('dst_bytes_delta', data.get('dst_bytes', 0))
+        # Counted per host; the rates thread turns the counts into rates once a second
+        hosts.add_traffic(host_id, sent_bytes, received_bytes)
+
+def publish_rates(rates, total):
+    """Publishes the per-host and total traffic rates for the graph; 'time' makes every new point a change."""
+    now = time.time()
+    for host_id, rate in rates.items():
+        broadcast.publish('host_traffic', host_id, dict(rate, time=now), host_id=host_id)
+    broadcast.publish('network_traffic', 'all', dict(total, time=now))
 
 # Handle client connections
 @socketio.on('connect')
 def handle_connect():
     print('✅ Client connected')
+    alert_pipeline.add_client(request.sid)
+    # New clients follow every host until they subscribe to some
+    join_room(ALL_ROOM)
+    broadcast.keyframe(request.sid)
+
+@socketio.on('subscribe')
+def handle_subscribe(message):
+    """Follow only the hosts in message['hosts'], or every host if the list is empty."""
+    host_ids = [str(host) for host in (message or {}).get('hosts') or []]
+    for room in socketio.server.rooms(request.sid):
+        if room == ALL_ROOM or room.startswith(host_room('')):
+            leave_room(room)
+    for room in [host_room(host_id) for host_id in host_ids] or [ALL_ROOM]:
+        join_room(room)
+    broadcast.subscribe(request.sid, host_ids)
+    broadcast.keyframe(request.sid, host_ids)
 
 @socketio.on('disconnect')
 def handle_disconnect():
     print('❌ Client disconnected')
+    alert_pipeline.remove_client(request.sid)
+    broadcast.unsubscribe(request.sid)
 
 if __name__ == '__main__':
     print("🚀 Starting server at http://127.0.0.1:5000")
-    socketio.run(app, host='127.0.0.1', port=5000, debug=True)
\ No newline at end of file
+    # The reloader would import this module twice: two detection pools, every background
+    # thread twice and two writers on the history database. Debug mode is opt-in.
+    debug = os.environ.get('SMARTSEC_DEBUG', '') not in ('', '0')
+    socketio.run(app, host='127.0.0.1', port=5000, debug=debug, use_reloader=False)
\ No newline at end of file
@@ -0,0 +1,883 @@
+# benchmark.py
+# Throughput benchmarks for the SMARTSEC pipeline.
+# Usage: python benchmark.py <benchmark> [options]   (python benchmark.py -h lists them)
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+
+def synthetic_flow(i):
+    """A network_flow record shaped like the ones network_agent.py sends."""
+    duration = random.uniform(0.001, 30.0)
+    packets = random.randint(1, 5000)
+    src_bytes = packets * random.randint(40, 900)
+    dst_bytes = packets * random.randint(40, 1400)
+    src_ip, src_port = f"10.0.{i % 250}.{i % 200 + 1}", 1024 + i % 50000
+    return {
+        "timestamp": time.time(),
+        "type": "network_flow",
+        "flow_key": f"{src_ip}:{src_port}-192.168.1.10:443",
+        "len": random.randint(40, 1500),
+        "flow_duration": duration,
+        "packet_count": packets,
+        "byte_count": src_bytes + dst_bytes,
+        "packet_rate": packets / duration,
+        "byte_rate": (src_bytes + dst_bytes) / duration,
+        "src_bytes": src_bytes,
+        "dst_bytes": dst_bytes,
+        "syn_flag_count": 1,
+        "fin_flag_count": 0,
+        "rst_flag_count": 0,
+        "ack_flag_count": packets - 1,
+        "src_ip": src_ip,
+        "src_port": src_port,
+        "dst_ip": "192.168.1.10",
+        "dst_port": 443,
+        "new_flow": True,
+        "emit_reason": "packets",
+        "src_bytes_delta": src_bytes,
+        "dst_bytes_delta": dst_bytes,
+    }
+
+def report(name, count, elapsed):
+    print(f"{name:<32} {count:>9} records in {elapsed:7.2f}s  -> {count / elapsed:12,.0f} records/s")
+
+def bench_transport(args):
+    """Per-record POST to /api/data versus BatchSender to /api/data/batch (needs a running app.py)."""
+    import requests
+    from transport import BatchSender
+
+    records = [synthetic_flow(i) for i in range(args.records)]
+
+    # Baseline: what the agents did before, one blocking POST per record and no session
+    baseline = records[:args.baseline_records]
+    start = time.perf_counter()
+    for record in baseline:
+        requests.post(args.url, json=record).raise_for_status()
+    report("per-record requests.post", len(baseline), time.perf_counter() - start)
+
+    for use_msgpack in (False, True):
+        sender = BatchSender(args.url, batch_size=args.batch_size, flush_interval=1.0, use_msgpack=use_msgpack)
+        label = f"BatchSender ({'msgpack' if sender.use_msgpack else 'json'}+gzip)"
+        start = time.perf_counter()
+        for record in records:
+            sender.send(record)
+        sender.close()
+        report(label, len(records), time.perf_counter() - start)
+
+def legacy_flow_stats():
+    """The per-flow dict TrafficAnalyzer used before FlowRecord."""
+    return {
+        'packet_count': 0, 'byte_count': 0, 'start_time': 0, 'last_time': 0,
+        'src_bytes': 0, 'dst_bytes': 0, 'flags': defaultdict(int)
+    }
+
+def legacy_update(flow_stats, src, sport, dst, dport, length, flag_string, timestamp):
+    """The dict-based flow update, fed the same pre-parsed fields as TrafficAnalyzer.update."""
+    flow_key = tuple(sorted(((src, sport), (dst, dport))))
+    stats = flow_stats[flow_key]
+    if stats['packet_count'] == 0:
+        stats['start_time'] = timestamp
+    stats['last_time'] = timestamp
+    stats['packet_count'] += 1
+    stats['byte_count'] += length
+    if (src, sport) == flow_key[0]:
+        stats['src_bytes'] += length
+    else:
+        stats['dst_bytes'] += length
+    for flag in flag_string:
+        stats['flags'][flag] += 1
+
+def synthetic_packets(count, flows):
+    """Pre-parsed TCP packets spread over a number of concurrent flows."""
+    packets = []
+    for i in range(count):
+        f = random.randrange(flows)
+        outbound = random.random() < 0.5
+        a, b = (f"10.{f >> 16 & 255}.{f >> 8 & 255}.{f & 255}", 1024 + f % 60000), ("192.168.1.10", 443)
+        (src, sport), (dst, dport) = (a, b) if outbound else (b, a)
+        packets.append((src, sport, dst, dport, random.randint(40, 1500), 0x10, 'A', 1000.0 + i * 1e-4))
+    return packets
+
+def bench_flows(args):
+    """Bytes per flow and packets/s of the legacy dict flow state versus FlowRecord."""
+    from flow_table import FlowRecord
+    from network_agent import TrafficAnalyzer
+
+    # Memory: state for args.flows flows, each having seen SYN and ACK packets
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    legacy = []
+    for _ in range(args.flows):
+        stats = legacy_flow_stats()
+        stats['flags']['S'] += 1
+        stats['flags']['A'] += 1
+        legacy.append(stats)
+    legacy_bytes = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    del legacy
+    before = tracemalloc.take_snapshot()
+    compact = [FlowRecord() for _ in range(args.flows)]
+    compact_bytes = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, 'filename'))
+    del compact
+    tracemalloc.stop()
+    print(f"{'dict + defaultdict flags':<32} {legacy_bytes / args.flows:8.0f} bytes/flow")
+    print(f"{'FlowRecord (__slots__)':<32} {compact_bytes / args.flows:8.0f} bytes/flow")
+
+    # Speed: the flow update path alone, without packet capture or dissection
+    packets = synthetic_packets(args.packets, args.flows)
+    flow_stats = defaultdict(legacy_flow_stats)
+    start = time.perf_counter()
+    for src, sport, dst, dport, length, _, flag_string, ts in packets:
+        legacy_update(flow_stats, src, sport, dst, dport, length, flag_string, ts)
+    elapsed = time.perf_counter() - start
+    print(f"{'dict + defaultdict flags':<32} {len(packets) / elapsed:12,.0f} packets/s")
+
+    analyzer = TrafficAnalyzer(max_flows=args.flows * 2)
+    start = time.perf_counter()
+    for src, sport, dst, dport, length, flags, _, ts in packets:
+        analyzer.update(src, sport, dst, dport, length, flags, ts)
+    elapsed = time.perf_counter() - start
+    # Includes the LRU bookkeeping and emission checks the legacy path never had
+    print(f"{'TrafficAnalyzer.update':<32} {len(packets) / elapsed:12,.0f} packets/s")
+
+def write_synthetic_pcap(path, count, flows):
+    """Writes a pcap of TCP traffic spread over a number of flows, ending each flow with a FIN."""
+    import scapy.all as scapy
+    writer = scapy.PcapWriter(path, linktype=1, sync=False)
+    for i, (src, sport, dst, dport, length, _, _, ts) in enumerate(synthetic_packets(count, flows)):
+        flags = 'FA' if i >= count - flows else 'PA'
+        packet = scapy.Ether() / scapy.IP(src=src, dst=dst) / scapy.TCP(sport=sport, dport=dport, flags=flags) / (b'x' * max(0, length - 54))
+        packet.time = ts
+        writer.write(packet)
+    writer.close()
+
+def bench_capture(args):
+    """Scapy dissection versus the struct header parser, replaying the same pcap through TrafficAnalyzer."""
+    import scapy.all as scapy
+    from network_agent import TrafficAnalyzer
+    from packet_capture import read_pcap
+
+    path = args.pcap
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'synthetic.pcap')
+        print(f"Writing {args.packets} synthetic packets to {path}...")
+        write_synthetic_pcap(path, args.packets, args.flows)
+
+    records = []
+    analyzer = TrafficAnalyzer(on_expire=records.append)
+    start = time.perf_counter()
+    count = 0
+    with scapy.PcapReader(path) as reader:
+        for packet in reader:
+            features = analyzer.analyze_packet(packet)
+            if features:
+                records.append(features)
+            count += 1
+    elapsed = time.perf_counter() - start
+    analyzer.expire_flows(now=float('inf'))
+    print(f"{'scapy PcapReader + dissection':<32} {count / elapsed:12,.0f} packets/s  ({len(records)} flow records)")
+
+    records = []
+    analyzer = TrafficAnalyzer(on_expire=records.append)
+    start = time.perf_counter()
+    count = 0
+    for timestamp, frame, linktype in read_pcap(path):
+        features = analyzer.analyze_frame(frame, timestamp, linktype)
+        if features:
+            records.append(features)
+        count += 1
+    elapsed = time.perf_counter() - start
+    analyzer.expire_flows(now=float('inf'))
+    print(f"{'read_pcap + parse_frame':<32} {count / elapsed:12,.0f} packets/s  ({len(records)} flow records)")
+
+def bench_pipeline(args):
+    """Single-process replay versus CapturePipeline with an increasing number of shard workers."""
+    from capture_pipeline import CapturePipeline
+    from network_agent import TrafficAnalyzer
+    from packet_capture import read_pcap
+
+    path = args.pcap
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'synthetic.pcap')
+        print(f"Writing {args.packets} synthetic packets to {path}...")
+        write_synthetic_pcap(path, args.packets, args.flows)
+
+    records = []
+    analyzer = TrafficAnalyzer(on_expire=records.append)
+    start = time.perf_counter()
+    count = 0
+    for timestamp, frame, linktype in read_pcap(path):
+        features = analyzer.analyze_frame(frame, timestamp, linktype)
+        if features:
+            records.append(features)
+        count += 1
+    analyzer.expire_flows(now=float('inf'))
+    elapsed = time.perf_counter() - start
+    print(f"{'single process':<32} {count / elapsed:12,.0f} packets/s  ({len(records)} flow records)")
+
+    for workers in args.workers:
+        records = []
+        pipeline = CapturePipeline(on_record=records.append, workers=workers)
+        elapsed = pipeline.run(read_pcap(path))
+        label = f"CapturePipeline, {workers} worker{'s' if workers > 1 else ''}"
+        print(f"{label:<32} {pipeline.captured / elapsed:12,.0f} packets/s  ({len(records)} flow records)")
+
+def percentile(values, q):
+    """q-th percentile (0-100) of a list of numbers, by nearest rank."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+def bench_ingest(args):
+    """Load test: concurrent agents posting batches to /api/data/batch (needs a running app.py)."""
+    import gzip
+    import json
+    import threading
+    import requests
+
+    batch_url = args.url.rstrip('/') + '/batch'
+    stats_url = args.url.rsplit('/api/', 1)[0] + '/api/ingest/stats'
+    # Every client reposts the same pre-encoded batch, so the clients measure the server and not their own encoding
+    body = gzip.compress(json.dumps([synthetic_flow(i) for i in range(args.batch_size)]).encode('utf-8'), compresslevel=1)
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'}
+
+    latencies = []
+    rejected = [0]
+    def server_stats():
+        # Servers without the ingest pipeline have no stats endpoint
+        response = requests.get(stats_url)
+        return response.json() if response.ok else None
+
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def client():
+        session = requests.Session()
+        mine = []
+        refused = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            response = session.post(batch_url, data=body, headers=headers, timeout=30)
+            if response.status_code == 503:
+                # Back off like an agent would instead of hammering a full queue
+                refused += 1
+                time.sleep(args.backoff)
+                continue
+            response.raise_for_status()
+            mine.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(mine)
+            rejected[0] += refused
+
+    before = server_stats()
+    start = time.perf_counter()
+    clients = [threading.Thread(target=client) for _ in range(args.clients)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    posted = time.perf_counter() - start
+
+    print(f"{args.clients} clients x {args.batch_size}-record batches for {args.duration:.0f}s")
+    print(f"{'ingest latency p50 / p99':<32} {percentile(latencies, 50) * 1000:8.1f} ms / {percentile(latencies, 99) * 1000:.1f} ms"
+          f"  ({len(latencies)} accepted requests, {rejected[0]} refused with 503)")
+    report("accepted by the handlers", len(latencies) * args.batch_size, posted)
+    if before is None:
+        return
+
+    # Sustained rate: wait for the server to work through what it accepted
+    while True:
+        after = server_stats()
+        if after['processed'] >= after['received'] or time.perf_counter() - start > args.duration * 10:
+            break
+        time.sleep(0.05)
+    report("processed by the ingest pipeline", after['processed'] - before['processed'], time.perf_counter() - start)
+
+def private_memory(pid):
+    """Memory only this process holds (Private_Clean + Private_Dirty, Linux), in bytes."""
+    total = 0
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            if line.startswith(('Private_Clean:', 'Private_Dirty:')):
+                total += int(line.split()[1]) * 1024
+    return total
+
+def bench_detect(args):
+    """Scoring throughput of DetectionEngine in-process versus DetectionPool with an increasing number of workers."""
+    import threading
+    from detection_engine import DetectionEngine
+    from detection_pool import DetectionPool
+
+    engine = DetectionEngine('isolation_forest_model.joblib', 'random_forest_model.joblib', 'label_encoder.joblib',
+                             mmap_mode='r')
+    # Fork the workers before the test data exists, as app.py does, so they don't inherit it
+    pools = {workers: DetectionPool(engine, workers=workers) for workers in args.workers}
+    batches = [[synthetic_flow(i * args.batch_size + j) for j in range(args.batch_size)] for i in range(args.batches)]
+    total = args.batches * args.batch_size
+
+    start = time.perf_counter()
+    for batch in batches:
+        engine.detect_threats_batch(batch)
+    elapsed = time.perf_counter() - start
+    print(f"{'in-process engine':<32} {total / elapsed:12,.0f} records/s")
+
+    for workers, pool in pools.items():
+        # One submitting thread per worker keeps every worker busy
+        chunks = [batches[i::workers] for i in range(workers)]
+        submitters = [threading.Thread(target=lambda chunk: [pool.detect_threats_batch(b) for b in chunk], args=(chunk,))
+                      for chunk in chunks]
+        start = time.perf_counter()
+        for thread in submitters:
+            thread.start()
+        for thread in submitters:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        private = sum(private_memory(pid) for pid in pool.pids()) / workers
+        pool.close()
+        label = f"DetectionPool, {workers} worker{'s' if workers > 1 else ''}"
+        # Private memory is each worker's own working set; the models themselves stay shared with the parent
+        print(f"{label:<32} {total / elapsed:12,.0f} records/s  ({total / elapsed / workers:,.0f} per worker, "
+              f"{private / 2**20:.1f} MiB private per worker)")
+
+def bench_cascade(args):
+    """Engine on every record versus the detection cascade, for long-lived flows that report repeatedly."""
+    from detection_cascade import DetectionCascade
+    from detection_engine import DetectionEngine
+    from score_cache import ScoreCache
+    from stream_aggregates import StreamAggregates
+
+    engine = DetectionEngine('isolation_forest_model.joblib', 'random_forest_model.joblib', 'label_encoder.joblib')
+    flows = [synthetic_flow(i) for i in range(args.flows)]
+    # Every flow reports args.reports times, like network_agent's periodic records: counters grow with
+    # each report while the rates stay put, and the last report is the final one
+    counters = ('flow_duration', 'packet_count', 'byte_count', 'src_bytes', 'dst_bytes', 'ack_flag_count')
+    records = []
+    for report_no in range(1, args.reports + 1):
+        for flow in flows:
+            record = dict(flow, emit_reason='fin' if report_no == args.reports else 'packets')
+            for field in counters:
+                record[field] = flow[field] * report_no
+            # Byte deltas cover only this report, so only the first report counts as a new flow
+            records.append(record)
+    batches = [records[i:i + args.batch_size] for i in range(0, len(records), args.batch_size)]
+
+    start = time.perf_counter()
+    engine_alerts = sum(len(alerts) for batch in batches for alerts in engine.detect_threats_batch(batch))
+    elapsed = time.perf_counter() - start
+    print(f"{'engine, every record':<32} {len(records) / elapsed:12,.0f} records/s  ({engine_alerts} alerts)")
+
+    cascade = DetectionCascade(engine.simple_rules, engine.score_models_batch,
+                               aggregates=StreamAggregates(), cache=ScoreCache(tolerance=args.tolerance),
+                               features=engine.iso_forest_features)
+    start = time.perf_counter()
+    cascade_alerts = sum(len(alerts) for batch in batches for alerts in cascade.detect_threats_batch(batch))
+    elapsed = time.perf_counter() - start
+    print(f"{'detection cascade':<32} {len(records) / elapsed:12,.0f} records/s  ({cascade_alerts} alerts)")
+    stats = cascade.stats()
+    for stage in ('allowlist', 'rules', 'aggregates', 'cache', 'models'):
+        print(f"  {stage:<10} seen {stats[stage]['seen']:>8}  hit rate {stats[stage]['hit_rate']:6.1%}  "
+              f"pass rate {stats[stage]['pass_rate']:6.1%}")
+    cache = stats['score_cache']
+    print(f"  score cache hit ratio {cache['hit_ratio']:.1%}  (misses: {cache['new']} new, {cache['bucket']} bucket, "
+          f"{cache['changed']} changed, {cache['expired']} expired; {cache['evicted_closed']} closed)")
+
+def bench_aggregates(args):
+    """Cost per record and memory of the scan/flood aggregates with many sources and one port scan mixed in."""
+    from stream_aggregates import StreamAggregates
+
+    records = []
+    for i in range(args.records):
+        record = synthetic_flow(i)
+        # Spread the new flows over args.sources sources
+        record['src_ip'] = f"10.{i % args.sources // 65536}.{i % args.sources // 256 % 256}.{i % args.sources % 256}"
+        records.append(record)
+    # One source probing ports 1-1000 of a host, interleaved with the rest
+    for port in range(1, 1001):
+        records.insert(port * (len(records) // 1001), dict(synthetic_flow(port), src_ip="172.16.6.6", dst_ip="192.168.1.20",
+                                                         dst_port=port, packet_count=2, syn_flag_count=1, rst_flag_count=1))
+
+    aggregates = StreamAggregates(window=args.window, max_sources=args.max_sources)
+    start = time.perf_counter()
+    alerts = [alert for record in records for alert in aggregates.observe(record)]
+    elapsed = time.perf_counter() - start
+    report("StreamAggregates.observe", len(records), elapsed)
+
+    # Memory on a second run, since tracing allocations slows them down
+    aggregates = StreamAggregates(window=args.window, max_sources=args.max_sources)
+    tracemalloc.start()
+    for record in records:
+        aggregates.observe(record)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'peak memory':<32} {peak / 2**20:9.1f} MiB  ({aggregates.stats()['tracked_sources']} sources tracked)")
+    for alert in alerts:
+        print(f"  {alert['description']}: {alert['details']}")
+
+def bench_alerts(args):
+    """Socket.IO messages and bytes per dashboard: one emit per alert versus the alert pipeline."""
+    import json
+    from alert_pipeline import AlertPipeline
+
+    sent = {'messages': 0, 'bytes': 0}
+    def emit(event, payload, to=None):
+        sent['messages'] += 1
+        sent['bytes'] += len(json.dumps(payload))
+
+    # A few flooding flows raise an alert on every record; other flows now and then
+    flood_keys = [synthetic_flow(i)['flow_key'] for i in range(args.flooding_flows)]
+    alert = {"type": "Rule-Based Alert", "severity": "Critical",
+             "description": "High Packet Rate Detected (Potential Flood Attack)", "details": "Packet rate is 50000.00 pps"}
+    seconds = []
+    for second in range(args.seconds):
+        keys = [random.choice(flood_keys) for _ in range(args.alerts_per_second)]
+        keys[::100] = [synthetic_flow(second * 1000 + i)['flow_key'] for i in range(len(keys[::100]))]
+        seconds.append(keys)
+    total = args.seconds * args.alerts_per_second
+
+    for keys in seconds:
+        for key in keys:
+            emit('new_alert', dict(alert, details=f"{alert['details']} for flow {key}"))
+    print(f"{'emit per alert':<32} {sent['messages']:>9} messages  {sent['bytes'] / 2**20:8.2f} MiB  per client")
+
+    sent['messages'] = sent['bytes'] = 0
+    pipeline = AlertPipeline(emit)
+    pipeline.add_client('dashboard', now=0.0)
+    start = time.perf_counter()
+    # Simulated clock: the alerts of each second, then that second's flush
+    for second, keys in enumerate(seconds):
+        for key in keys:
+            pipeline.add({'flow_key': key}, [dict(alert, details=f"{alert['details']} for flow {key}")], now=second + 0.5)
+        pipeline.flush(now=second + 1.0)
+    elapsed = time.perf_counter() - start
+    print(f"{'alert pipeline':<32} {sent['messages']:>9} messages  {sent['bytes'] / 2**20:8.2f} MiB  per client")
+    report("AlertPipeline.add + flush", total, elapsed)
+    print(pipeline.stats())
+
+def synthetic_metrics(host, tick):
+    """A host agent's system_metrics payload, with a few values that change from tick to tick."""
+    return {
+        "cpu_usage": round(random.uniform(5, 60), 1),
+        "memory_usage": 40.0 + host % 20,
+        "cpu_load": round(0.5 + (tick // 30) * 0.1, 2),
+        "top_processes": [
+            {"pid": 1000 + i, "name": f"proc-{i}", "cpu_percent": round(random.uniform(0, 20), 1) if i < 3 else 0.0,
+             "memory_percent": 1.5} for i in range(15)
+        ],
+    }
+
+def bench_broadcast(args):
+    """Socket.IO messages and bytes delivered to dashboards: an emit per record versus 4 Hz delta frames."""
+    import json
+    from broadcast import BroadcastScheduler
+
+    delivered = {'messages': 0, 'bytes': 0}
+    def emit(event, payload, to=None):
+        # Every frame here goes to the 'all' room, which every client is in
+        encoded = payload if isinstance(payload, (str, bytes)) else json.dumps(payload)
+        delivered['messages'] += args.clients
+        delivered['bytes'] += len(encoded) * args.clients
+
+    # Each host agent reports every 2 seconds, staggered; the traffic rate is updated every second
+    ticks_per_second = 4
+    events = []
+    for tick in range(args.seconds * ticks_per_second):
+        updates = [('system_metrics', f"host-{h}", synthetic_metrics(h, tick)) for h in range(args.hosts)
+                   if (tick + h) % (2 * ticks_per_second) == 0]
+        if tick % ticks_per_second == 0:
+            updates.append(('network_traffic', 'all', {'sent': random.uniform(0, 1e6), 'received': random.uniform(0, 1e6),
+                                                       'time': tick / ticks_per_second}))
+        events.append(updates)
+
+    for updates in events:
+        for channel, key, state in updates:
+            emit(f"{channel}_update", state)
+    print(f"{'emit per record':<32} {delivered['messages'] / args.seconds:10,.0f} messages/s  "
+          f"{delivered['bytes'] / args.seconds / 2**10:10,.1f} KiB/s  (to {args.clients} clients)")
+
+    for use_msgpack in (False, True):
+        delivered['messages'] = delivered['bytes'] = 0
+        scheduler = BroadcastScheduler(emit, rate=ticks_per_second, use_msgpack=use_msgpack)
+        for updates in events:
+            for channel, key, state in updates:
+                scheduler.publish(channel, key, state, host_id=key if channel == 'system_metrics' else None)
+            scheduler.tick()
+        label = f"BroadcastScheduler, {'msgpack' if use_msgpack else 'JSON'}"
+        print(f"{label:<32} {delivered['messages'] / args.seconds:10,.0f} messages/s  "
+              f"{delivered['bytes'] / args.seconds / 2**10:10,.1f} KiB/s  (to {args.clients} clients)")
+
+def bench_hosts(args):
+    """Flow records per second counted into per-host state by many threads: one global lock versus HostRegistry shards."""
+    import threading
+    from host_state import HostRegistry
+
+    def run(registry, label):
+        per_thread = args.records // args.threads
+        hosts = [f"host-{h}" for h in range(args.hosts)]
+        def worker(offset):
+            for i in range(per_thread):
+                registry.add_traffic(hosts[(offset + i) % len(hosts)], 1500, 60)
+        threads = [threading.Thread(target=worker, args=(t,)) for t in range(args.threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        # The rates thread walks every host once an interval
+        rates_start = time.perf_counter()
+        registry.compute_rates()
+        report(label, per_thread * args.threads, elapsed)
+        print(f"{'':<32} rates for {len(registry)} hosts in {(time.perf_counter() - rates_start) * 1000:.1f} ms")
+
+    # A registry with one shard is the single global lock the app used to have
+    run(HostRegistry(shards=1), 'global lock')
+    run(HostRegistry(shards=args.shards), f"HostRegistry, {args.shards} shards")
+
+def bench_history(args):
+    """Flow records per second written to the history store: a commit per record versus batched WAL flushes; then range queries."""
+    import json
+    import sqlite3
+    from timeseries_store import TimeSeriesStore
+
+    records = []
+    for i in range(args.records):
+        record = synthetic_flow(i)
+        record.update(type='network_flow', host_id=f"host-{i % args.hosts}")
+        records.append(record)
+
+    with tempfile.TemporaryDirectory() as directory:
+        # What a straightforward logger would do: insert and commit each record as it arrives
+        db = sqlite3.connect(os.path.join(directory, 'naive.db'))
+        db.execute("CREATE TABLE flows (time REAL, host_id TEXT, flow_key TEXT, src_bytes INTEGER, dst_bytes INTEGER)")
+        naive = records[:args.naive_records]
+        start = time.perf_counter()
+        for record in naive:
+            db.execute("INSERT INTO flows VALUES (?, ?, ?, ?, ?)",
+                       (time.time(), record['host_id'], record['flow_key'], record['src_bytes'], record['dst_bytes']))
+            db.commit()
+        report('commit per record', len(naive), time.perf_counter() - start)
+        db.close()
+
+        # Records spread over args.seconds of simulated time, flushed once per simulated second
+        store = TimeSeriesStore(os.path.join(directory, 'history.db'), max_queue=len(records))
+        base = time.time() - args.seconds
+        per_second = max(len(records) // args.seconds, 1)
+        start = time.perf_counter()
+        for i, record in enumerate(records):
+            store.add_record(record, now=base + i // per_second)
+            if (i + 1) % per_second == 0:
+                store.flush()
+        store.flush()
+        report('TimeSeriesStore, batched', len(records), time.perf_counter() - start)
+
+        queries = [
+            ('traffic, all hosts, 1s', lambda: store.traffic(None, base, base + args.seconds, 1)),
+            ('traffic, one host, 1s', lambda: store.traffic('host-0', base, base + args.seconds, 1)),
+            ('traffic, all hosts, 1m', lambda: store.traffic(None, base, base + args.seconds, 60)),
+            ('flows, one host, newest 1000', lambda: store.flows('host-0', base, base + args.seconds, 1000)),
+            ('chart series, LTTB 300', lambda: store.traffic_series(None, base, base + args.seconds, points=300)),
+            ('chart series, min/max 300', lambda: store.traffic_series(None, base, base + args.seconds, points=300,
+                                                                       method='minmax')),
+        ]
+        for label, query in queries:
+            start = time.perf_counter()
+            rows = query()
+            elapsed = (time.perf_counter() - start) * 1000
+            count = len(rows['time']) if isinstance(rows, dict) else len(rows)
+            print(f"{label:<32} {count:>9} rows in {elapsed:7.1f} ms  ({len(json.dumps(rows)) / 2**10:,.1f} KiB as JSON)")
+        print(f"{'database size':<32} {store.stats()['db_bytes'] / 2**20:9.1f} MiB")
+        store.close()
+
+def bench_binlog(args):
+    """Process snapshots written and scanned: the old text log versus binary log segments."""
+    import re
+    from binlog import BinaryLogWriter, BinaryLogReader, EVENT_SNAPSHOT
+
+    names = ['svchost.exe', 'chrome.exe', 'python.exe', 'explorer.exe', 'msedgewebview2.exe']
+    snapshots = []
+    for s in range(args.snapshots):
+        snapshots.append([(1.7e9 + s * 10, pid, random.choice([0.0, 0.0, 0.0, random.uniform(0, 50)]),
+                           random.uniform(0, 2), random.choice(names), 'LAPTOP\\user') for pid in range(args.processes)])
+    total = args.snapshots * args.processes
+    threshold = 40.0
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'process_log.txt')
+        start = time.perf_counter()
+        with open(path, 'w') as log_file:
+            for snapshot in snapshots:
+                log_file.write("---- Process Snapshot ----\n")
+                for t, pid, cpu, memory, name, user in snapshot:
+                    log_file.write(f"PID: {pid} | Name: {name} | User: {user} | CPU: {cpu}% | Memory: {memory:.2f}%\n")
+                log_file.flush()
+        report('text log, write', total, time.perf_counter() - start)
+        text_bytes = os.path.getsize(path)
+
+        # Finding busy processes in the text means parsing every line
+        line = re.compile(r"PID: (\d+) \| Name: (.*?) \| User: .*? \| CPU: ([\d.]+)%")
+        start = time.perf_counter()
+        with open(path) as log_file:
+            busy = sum(1 for text in log_file if (m := line.match(text)) and float(m.group(3)) > threshold)
+        report(f"text log, scan ({busy} busy)", total, time.perf_counter() - start)
+
+        log_dir = os.path.join(directory, 'process')
+        writer = BinaryLogWriter(log_dir, 'process', flush_records=len(snapshots[0]), flush_interval=0)
+        start = time.perf_counter()
+        for snapshot in snapshots:
+            writer.extend((t, EVENT_SNAPSHOT, pid, cpu, memory, name.encode(), user.encode()) for t, pid, cpu, memory, name, user in snapshot)
+        writer.close()
+        report('binary log, write', total, time.perf_counter() - start)
+        binary_bytes = sum(os.path.getsize(path) for path in BinaryLogReader(log_dir).segments())
+
+        start = time.perf_counter()
+        busy = sum(int((records['cpu_percent'] > threshold).sum()) for records in BinaryLogReader(log_dir).scan())
+        report(f"binary log, scan ({busy} busy)", total, time.perf_counter() - start)
+
+        # The last minute only: binary search on the time column instead of reading everything
+        last = 1.7e9 + (args.snapshots - 6) * 10
+        start = time.perf_counter()
+        recent = sum(len(records) for records in BinaryLogReader(log_dir).scan(start=last))
+        print(f"{'binary log, last minute':<32} {recent:>9} records in {(time.perf_counter() - start) * 1000:7.2f} ms")
+        print(f"{'size':<32} text {text_bytes / 2**20:.1f} MiB, binary {binary_bytes / 2**20:.1f} MiB")
+
+def legacy_top_processes():
+    """The host agent's old per-tick collection: a 10 ms CPU sample per process, then a sort."""
+    import psutil
+    processes = []
+    for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
+        try:
+            proc.cpu_percent(interval=0.01)
+            processes.append(proc.as_dict(attrs=['pid', 'name', 'cpu_percent', 'memory_percent']))
+        except Exception:
+            pass
+    return sorted(processes, key=lambda p: p['cpu_percent'], reverse=True)[:15]
+
+def bench_collector(args):
+    """Time per host-agent tick to find the top 15 processes: 10 ms samples per process versus ProcessCollector."""
+    import subprocess
+    import sys
+    from process_collector import ProcessCollector
+
+    # Idle child processes, to see how each approach grows with the process count
+    children = [subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(600)']) for _ in range(args.spawn)]
+    try:
+        time.sleep(1.0)
+        import psutil
+        print(f"{len(psutil.pids())} processes")
+        start = time.perf_counter()
+        for _ in range(args.ticks):
+            legacy_top_processes()
+        print(f"{'per-process 10 ms samples':<32} {(time.perf_counter() - start) / args.ticks * 1000:9.1f} ms/tick "
+              "(plus the 1 s system CPU sample)")
+
+        collector = ProcessCollector(top_k=15)
+        start = time.perf_counter()
+        for _ in range(args.ticks):
+            collector.collect()
+        print(f"{'ProcessCollector':<32} {(time.perf_counter() - start) / args.ticks * 1000:9.1f} ms/tick")
+    finally:
+        for child in children:
+            child.kill()
+            child.wait()
+
+def bench_process_deltas(args):
+    """Bytes per host-agent tick and server cost to rebuild process tables: full tables versus deltas with keyframes."""
+    import json
+    from process_table import ProcessDeltaEncoder, ProcessTable
+
+    # A mostly idle host: a few busy processes, small CPU jitter, occasional starts and exits
+    processes = {pid: {'pid': pid, 'name': f"proc-{pid % 50}.exe", 'cpu_percent': 0.0,
+                       'memory_percent': random.uniform(0, 2)} for pid in range(args.processes)}
+    next_pid = args.processes
+    ticks = []
+    for tick in range(args.ticks):
+        for process in processes.values():
+            busy = process['pid'] % 40 == 0
+            process['cpu_percent'] = random.uniform(5, 60) if busy else random.choice([0.0, 0.0, 0.0, random.uniform(0, 0.8)])
+            process['memory_percent'] = max(process['memory_percent'] + random.uniform(-0.02, 0.02), 0.0)
+        for _ in range(args.churn):
+            del processes[random.choice(list(processes))]
+            processes[next_pid] = {'pid': next_pid, 'name': 'short-lived.exe', 'cpu_percent': 1.0, 'memory_percent': 0.1}
+            next_pid += 1
+        ticks.append([dict(process) for process in processes.values()])
+
+    full = [json.dumps({'type': 'system_metrics', 'metrics': {'processes': table}}) for table in ticks]
+    top = [json.dumps({'type': 'system_metrics', 'metrics': {'top_processes': sorted(
+        table, key=lambda p: p['cpu_percent'], reverse=True)[:15]}}) for table in ticks]
+    encoder = ProcessDeltaEncoder(keyframe_every=args.keyframe_every)
+    deltas = [json.dumps({'type': 'system_metrics', 'metrics': {'processes': encoder.encode(table)}}) for table in ticks]
+
+    def per_tick(payloads):
+        return sum(len(payload) for payload in payloads) / len(payloads)
+
+    start = time.perf_counter()
+    for payload in full:
+        table = {p['pid']: p for p in json.loads(payload)['metrics']['processes']}
+    full_cost = (time.perf_counter() - start) / len(full) * 1e6
+    server = ProcessTable()
+    start = time.perf_counter()
+    for payload in deltas:
+        server.apply(json.loads(payload)['metrics']['processes'])
+        server.top(15)
+    delta_cost = (time.perf_counter() - start) / len(deltas) * 1e6
+
+    print(f"{args.processes} processes, {args.churn} starts/exits per tick, keyframe every {args.keyframe_every} ticks")
+    print(f"{'top 15 only (before)':<32} {per_tick(top):10,.0f} bytes/tick")
+    print(f"{'full table every tick':<32} {per_tick(full):10,.0f} bytes/tick  {full_cost:8.0f} us/tick to parse")
+    print(f"{'deltas + keyframes':<32} {per_tick(deltas):10,.0f} bytes/tick  {delta_cost:8.0f} us/tick to parse and apply")
+    # The rebuilt table matches the agent's, up to the thresholds
+    final = {p['pid']: p for p in ticks[-1]}
+    drift = max(abs(final[pid]['cpu_percent'] - entry[2]) for pid, entry in server.processes.items())
+    print(f"{'rebuilt table':<32} {len(server.processes)} processes (agent has {len(final)}), "
+          f"largest CPU difference {drift:.2f}%, stale: {server.stale}")
+
+def bench_forest(args):
+    """Latency per row and batch throughput of sklearn's IsolationForest versus the compiled forest."""
+    import warnings
+    import joblib
+    import numpy as np
+    from forest_compiler import compile_forest
+
+    model = joblib.load(args.model)
+    compiled = compile_forest(model)
+    features = list(model.feature_names_in_)
+    X = np.array([[flow[f] for f in features] for flow in (synthetic_flow(i) for i in range(args.rows))])
+    # The model was fitted on a DataFrame; plain matrices in the same column order are equivalent
+    warnings.simplefilter("ignore", UserWarning)
+
+    expected = model.decision_function(X)
+    print(f"Scores identical to sklearn: {np.array_equal(expected, compiled.decision_function(X))}")
+
+    for name, scorer in (('sklearn decision_function', model.decision_function),
+                         ('compiled decision_function', compiled.decision_function)):
+        rows = X[:args.single_rows]
+        start = time.perf_counter()
+        for i in range(len(rows)):
+            scorer(rows[i:i + 1])
+        elapsed = time.perf_counter() - start
+        print(f"{name:<32} {elapsed / len(rows) * 1e6:10.1f} us/row  (one row per call)")
+        for batch_size in args.batch_sizes:
+            start = time.perf_counter()
+            for i in range(0, len(X), batch_size):
+                scorer(X[i:i + batch_size])
+            elapsed = time.perf_counter() - start
+            print(f"{name:<32} {len(X) / elapsed:12,.0f} rows/s  (batches of {batch_size})")
+
+BENCHMARKS = {
+    'transport': bench_transport,
+    'flows': bench_flows,
+    'capture': bench_capture,
+    'pipeline': bench_pipeline,
+    'ingest': bench_ingest,
+    'detect': bench_detect,
+    'cascade': bench_cascade,
+    'aggregates': bench_aggregates,
+    'alerts': bench_alerts,
+    'broadcast': bench_broadcast,
+    'hosts': bench_hosts,
+    'history': bench_history,
+    'binlog': bench_binlog,
+    'collector': bench_collector,
+    'process-deltas': bench_process_deltas,
+    'forest': bench_forest,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="SMARTSEC throughput benchmarks")
+    sub = parser.add_subparsers(dest='benchmark', required=True)
+
+    p = sub.add_parser('transport', help=bench_transport.__doc__)
+    p.add_argument('--url', default="http://127.0.0.1:5000/api/data")
+    p.add_argument('--records', type=int, default=20000)
+    p.add_argument('--baseline-records', type=int, default=2000)
+    p.add_argument('--batch-size', type=int, default=500)
+
+    p = sub.add_parser('flows', help=bench_flows.__doc__)
+    p.add_argument('--flows', type=int, default=100000)
+    p.add_argument('--packets', type=int, default=500000)
+
+    p = sub.add_parser('capture', help=bench_capture.__doc__)
+    p.add_argument('--pcap', default=None, help="Capture to replay (default: write a synthetic one)")
+    p.add_argument('--packets', type=int, default=100000)
+    p.add_argument('--flows', type=int, default=2000)
+
+    p = sub.add_parser('pipeline', help=bench_pipeline.__doc__)
+    p.add_argument('--pcap', default=None, help="Capture to replay (default: write a synthetic one)")
+    p.add_argument('--packets', type=int, default=100000)
+    p.add_argument('--flows', type=int, default=2000)
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+
+    p = sub.add_parser('ingest', help=bench_ingest.__doc__)
+    p.add_argument('--url', default="http://127.0.0.1:5000/api/data")
+    p.add_argument('--clients', type=int, default=8)
+    p.add_argument('--batch-size', type=int, default=500)
+    p.add_argument('--duration', type=float, default=10.0)
+    p.add_argument('--backoff', type=float, default=0.1, help="Client pause after a 503 (seconds)")
+
+    p = sub.add_parser('detect', help=bench_detect.__doc__)
+    p.add_argument('--batches', type=int, default=200)
+    p.add_argument('--batch-size', type=int, default=1024)
+    p.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+
+    p = sub.add_parser('cascade', help=bench_cascade.__doc__)
+    p.add_argument('--flows', type=int, default=2000)
+    p.add_argument('--reports', type=int, default=20, help="Records per flow")
+    p.add_argument('--tolerance', type=float, default=0.1, help="Score cache feature tolerance")
+    p.add_argument('--batch-size', type=int, default=1024)
+
+    p = sub.add_parser('aggregates', help=bench_aggregates.__doc__)
+    p.add_argument('--records', type=int, default=200000)
+    p.add_argument('--sources', type=int, default=100000)
+    p.add_argument('--max-sources', type=int, default=10000)
+    p.add_argument('--window', type=float, default=60.0)
+
+    p = sub.add_parser('alerts', help=bench_alerts.__doc__)
+    p.add_argument('--seconds', type=int, default=30)
+    p.add_argument('--alerts-per-second', type=int, default=5000)
+    p.add_argument('--flooding-flows', type=int, default=5)
+
+    p = sub.add_parser('broadcast', help=bench_broadcast.__doc__)
+    p.add_argument('--hosts', type=int, default=50)
+    p.add_argument('--clients', type=int, default=20)
+    p.add_argument('--seconds', type=int, default=60)
+
+    p = sub.add_parser('hosts', help=bench_hosts.__doc__)
+    p.add_argument('--hosts', type=int, default=500)
+    p.add_argument('--threads', type=int, default=8)
+    p.add_argument('--records', type=int, default=400000)
+    p.add_argument('--shards', type=int, default=16)
+
+    p = sub.add_parser('history', help=bench_history.__doc__)
+    p.add_argument('--records', type=int, default=200000)
+    p.add_argument('--naive-records', type=int, default=5000)
+    p.add_argument('--hosts', type=int, default=50)
+    p.add_argument('--seconds', type=int, default=600)
+
+    p = sub.add_parser('binlog', help=bench_binlog.__doc__)
+    p.add_argument('--snapshots', type=int, default=360)
+    p.add_argument('--processes', type=int, default=300)
+
+    p = sub.add_parser('collector', help=bench_collector.__doc__)
+    p.add_argument('--spawn', type=int, default=200)
+    p.add_argument('--ticks', type=int, default=3)
+
+    p = sub.add_parser('process-deltas', help=bench_process_deltas.__doc__)
+    p.add_argument('--processes', type=int, default=1500)
+    p.add_argument('--ticks', type=int, default=300)
+    p.add_argument('--churn', type=int, default=2)
+    p.add_argument('--keyframe-every', type=int, default=30)
+
+    p = sub.add_parser('forest', help=bench_forest.__doc__)
+    p.add_argument('--model', default='isolation_forest_model.joblib')
+    p.add_argument('--rows', type=int, default=100000)
+    p.add_argument('--single-rows', type=int, default=1000)
+    p.add_argument('--batch-sizes', type=int, nargs='+', default=[64, 1024, 16384])
+
+    args = parser.parse_args()
+    random.seed(42)
+    BENCHMARKS[args.benchmark](args)
+
+if __name__ == '__main__':
+    main()
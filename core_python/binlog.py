@@ -0,0 +1,341 @@
+# binlog.py
+# Fixed-schema binary logs for the standalone monitors. Each log is a
+# directory of segment files; a segment is a short header (magic, header
+# length, JSON with the schema name and NumPy dtype) followed by packed
+# records of that dtype. Writers buffer rows and append them in one write,
+# rotate to a new segment every segment_records rows and delete the oldest
+# segments beyond max_segments. Readers memory-map the segments, so a scan
+# touches only the pages it reads and a time range is found by binary search.
+#
+# Usage:
+#   python binlog.py convert logs                  # logs/*.txt -> logs/system, logs/process, logs/network
+#   python binlog.py dump logs/system --last 20    # print records
+#   python binlog.py summary logs/process          # segments, records and time range
+#   python binlog.py table logs/process --at T     # the process table as it was at epoch second T
+import argparse
+import json
+import os
+import re
+import struct
+import time
+
+import numpy as np
+
+MAGIC = b'SSBLOG01'
+HEADER_PREFIX = struct.Struct('<8sI') # magic, header length including this prefix
+HEADER_ALIGN = 64
+SEGMENT_SUFFIX = '.seg'
+
+# Process records are events: a full table (every process, EVENT_SNAPSHOT) now and
+# then, and in between only processes that started, changed or exited.
+EVENT_SNAPSHOT, EVENT_STARTED, EVENT_CHANGED, EVENT_EXITED = 0, 1, 2, 3
+
+# One record per reading. Text fields are UTF-8, truncated to their width.
+SCHEMAS = {
+    'system': np.dtype([('time', '<f8'), ('cpu_usage', '<f4'), ('memory_usage', '<f4'), ('disk_usage', '<f4'),
+                        ('swap_usage', '<f4')]),
+    'network': np.dtype([('time', '<f8'), ('bytes_sent', '<u8'), ('bytes_recv', '<u8'), ('packets_sent', '<u8'),
+                         ('packets_recv', '<u8')]),
+    'process': np.dtype([('time', '<f8'), ('event', 'u1'), ('pid', '<u4'), ('cpu_percent', '<f4'),
+                         ('memory_percent', '<f4'), ('name', 'S32'), ('username', 'S32')]),
+}
+
+def encode_header(schema_name, dtype):
+    meta = json.dumps({'schema': schema_name, 'dtype': dtype.descr, 'created': time.time()}).encode()
+    length = HEADER_PREFIX.size + len(meta) + 1
+    padded = -(-length // HEADER_ALIGN) * HEADER_ALIGN
+    return HEADER_PREFIX.pack(MAGIC, padded) + meta + b' ' * (padded - length) + b'\n'
+
+def read_header(path):
+    """Returns (schema name, dtype, offset of the first record) of a segment."""
+    with open(path, 'rb') as f:
+        magic, length = HEADER_PREFIX.unpack(f.read(HEADER_PREFIX.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a binary log segment")
+        meta = json.loads(f.read(length - HEADER_PREFIX.size))
+    return meta['schema'], np.dtype([tuple(field) for field in meta['dtype']]), length
+
+def list_segments(directory):
+    if not os.path.isdir(directory):
+        return []
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+def open_segment(path):
+    """The segment's records as a read-only memory-mapped structured array (a partly written last record is left out)."""
+    _, dtype, offset = read_header(path)
+    count = (os.path.getsize(path) - offset) // dtype.itemsize
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+class BinaryLogWriter:
+    def __init__(self, directory, schema, segment_records=65536, max_segments=64, flush_records=1024,
+                 flush_interval=5.0):
+        """
+        :param directory: Directory of the log's segments; created if missing.
+        :param schema: A name in SCHEMAS.
+        :param segment_records: Records per segment before a new one is started.
+        :param max_segments: Segments kept; the oldest are deleted first.
+        :param flush_records: Buffered records that trigger a write.
+        :param flush_interval: Seconds a buffered record waits at most before it is written.
+        """
+        self.directory = directory
+        self.schema = schema
+        self.dtype = SCHEMAS[schema]
+        self.segment_records = segment_records
+        self.max_segments = max_segments
+        self.flush_records = flush_records
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+        self.segments = list_segments(directory)
+        # A restarted writer starts a new segment rather than appending to one it did not write
+        self.next_sequence = int(os.path.basename(self.segments[-1])[:-len(SEGMENT_SUFFIX)]) + 1 if self.segments else 1
+        self.active = None
+        self.active_records = 0
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.records_written = 0
+
+    def append(self, row):
+        """Buffers one record, a tuple in the schema's field order."""
+        self.buffer.append(row)
+        if len(self.buffer) >= self.flush_records or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def extend(self, rows):
+        self.buffer.extend(rows)
+        if len(self.buffer) >= self.flush_records or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Writes the buffered records, continuing in a new segment whenever the active one is full."""
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        records = np.array(self.buffer, dtype=self.dtype)
+        self.buffer = []
+        start = 0
+        while start < len(records):
+            if self.active is None or self.active_records >= self.segment_records:
+                self._rotate()
+            end = min(len(records), start + self.segment_records - self.active_records)
+            self.active.write(records[start:end].tobytes())
+            self.active_records += end - start
+            start = end
+        self.active.flush()
+        self.records_written += len(records)
+
+    def _rotate(self):
+        if self.active is not None:
+            self.active.close()
+        path = os.path.join(self.directory, f"{self.next_sequence:08d}{SEGMENT_SUFFIX}")
+        self.next_sequence += 1
+        self.active = open(path, 'wb')
+        self.active.write(encode_header(self.schema, self.dtype))
+        self.active_records = 0
+        self.segments.append(path)
+        while len(self.segments) > self.max_segments:
+            os.remove(self.segments.pop(0))
+
+    def close(self):
+        self.flush()
+        if self.active is not None:
+            self.active.close()
+            self.active = None
+
+class BinaryLogReader:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def segments(self):
+        return list_segments(self.directory)
+
+    def scan(self, start=None, end=None):
+        """
+        Yields each segment's records with start <= time < end as memory-mapped slices.
+        Records are appended in time order, so the range is found by binary search.
+        """
+        for path in self.segments():
+            records = open_segment(path)
+            if len(records) == 0:
+                continue
+            if (start is not None and records['time'][-1] < start) or (end is not None and records['time'][0] >= end):
+                continue
+            times = records['time']
+            first = np.searchsorted(times, start, 'left') if start is not None else 0
+            last = np.searchsorted(times, end, 'left') if end is not None else len(records)
+            if first < last:
+                yield records[first:last]
+
+    def read(self, start=None, end=None):
+        """All records with start <= time < end, copied into one array."""
+        parts = list(self.scan(start, end))
+        if not parts:
+            schema = read_header(self.segments()[0])[1] if self.segments() else None
+            return np.empty(0, dtype=schema) if schema is not None else np.empty(0)
+        return np.concatenate(parts)
+
+# --- Converter for the old text logs ---
+# The text logs have no timestamps. Converted records are spaced by the interval the
+# monitor slept between readings, ending at the file's modification time.
+
+SYSTEM_LINE = re.compile(r"CPU Usage: ([\d.]+)% \| Memory Usage: ([\d.]+)% \| Disk Usage: ([\d.]+)%")
+NETWORK_LINE = re.compile(r"Bytes Sent: (\d+) \| Bytes Received: (\d+) \| Packets Sent: (\d+) \| Packets Received: (\d+)")
+PROCESS_LINE = re.compile(r"PID: (\d+) \| Name: ([^|]*?)\s*(?:\| User: ([^|]*?) \| CPU: ([\d.]+)% \| Memory: ([\d.]+)%)?$")
+
+def _timestamps(path, count, interval):
+    end = os.path.getmtime(path)
+    return [end - (count - 1 - i) * interval for i in range(count)]
+
+def convert_system_log(path, writer, interval=5.0):
+    readings = []
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = SYSTEM_LINE.search(line)
+            if match:
+                readings.append(tuple(float(value) for value in match.groups()))
+    times = _timestamps(path, len(readings), interval)
+    writer.extend((t, cpu, memory, disk, 0.0) for t, (cpu, memory, disk) in zip(times, readings))
+    return len(readings)
+
+def convert_network_log(path, writer, interval=5.0):
+    readings = []
+    with open(path, errors='replace') as f:
+        for line in f:
+            match = NETWORK_LINE.search(line)
+            if match:
+                readings.append(tuple(int(value) for value in match.groups()))
+    times = _timestamps(path, len(readings), interval)
+    writer.extend((t,) + reading for t, reading in zip(times, readings))
+    return len(readings)
+
+def convert_process_log(path, writer, interval=10.0):
+    # Snapshots are separated by lines of dashes; every process line of a snapshot gets its time
+    snapshots = [[]]
+    with open(path, errors='replace') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('----'):
+                if snapshots[-1]:
+                    snapshots.append([])
+                continue
+            match = PROCESS_LINE.match(line)
+            if match:
+                pid, name, user, cpu, memory = match.groups()
+                snapshots[-1].append((int(pid), float(cpu or 0.0), float(memory or 0.0),
+                                      name.encode()[:32], (user or '').encode()[:32]))
+    snapshots = [snapshot for snapshot in snapshots if snapshot]
+    count = 0
+    for t, snapshot in zip(_timestamps(path, len(snapshots), interval), snapshots):
+        writer.extend((t, EVENT_SNAPSHOT) + process for process in snapshot)
+        count += len(snapshot)
+    return count
+
+CONVERTERS = {
+    'system': ('system_log.txt', convert_system_log),
+    'network': ('network_log.txt', convert_network_log),
+    'process': ('process_log.txt', convert_process_log),
+}
+
+def convert_text_logs(log_dir='logs', out_dir=None):
+    """Converts log_dir/*_log.txt into binary logs under out_dir (default log_dir); returns records per schema."""
+    out_dir = out_dir or log_dir
+    converted = {}
+    for schema, (filename, convert) in CONVERTERS.items():
+        path = os.path.join(log_dir, filename)
+        if not os.path.exists(path):
+            continue
+        writer = BinaryLogWriter(os.path.join(out_dir, schema), schema)
+        converted[schema] = convert(path, writer)
+        writer.close()
+    return converted
+
+def last_snapshot_time(reader, at):
+    """
+    Time of the last snapshot record at or before epoch second at, or None. Segments are
+    searched newest first, so only the segments after that snapshot are opened.
+    """
+    for path in reversed(reader.segments()):
+        records = open_segment(path)
+        if len(records) == 0 or records['time'][0] > at:
+            continue
+        last = np.searchsorted(records['time'], at, 'right')
+        snapshots = np.flatnonzero(records['event'][:last] == EVENT_SNAPSHOT)
+        if len(snapshots):
+            return records['time'][snapshots[-1]]
+    return None
+
+def process_table_at(directory, at):
+    """
+    Rebuilds the process table at epoch second at from a process log: the last full table at or
+    before it, plus the events after that. Returns {pid: record}.
+    """
+    reader = BinaryLogReader(directory)
+    snapshot_time = last_snapshot_time(reader, at)
+    if snapshot_time is None:
+        return {}
+    # A full table is all the snapshot records sharing the last snapshot time; they may
+    # start in an earlier segment, which read() finds by time
+    records = reader.read(start=snapshot_time, end=np.nextafter(at, np.inf))
+    table = {}
+    for record in records:
+        if record['event'] == EVENT_EXITED:
+            table.pop(int(record['pid']), None)
+        else:
+            table[int(record['pid'])] = record
+    return table
+
+def format_record(record):
+    parts = []
+    for name in record.dtype.names:
+        value = record[name]
+        if name == 'time':
+            value = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(value))
+        elif isinstance(value, bytes):
+            value = value.decode(errors='replace')
+        elif isinstance(value, np.floating):
+            value = f"{value:.2f}"
+        parts.append(f"{name}: {value}")
+    return " | ".join(parts)
+
+def main():
+    parser = argparse.ArgumentParser(description="SMARTSEC binary monitor logs")
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('convert', help="Convert the old text logs")
+    p.add_argument('log_dir', nargs='?', default='logs')
+    p.add_argument('--out-dir')
+    p = sub.add_parser('dump', help="Print the records of a binary log")
+    p.add_argument('directory')
+    p.add_argument('--from', dest='start', type=float, help="Epoch seconds")
+    p.add_argument('--to', dest='end', type=float, help="Epoch seconds")
+    p.add_argument('--last', type=int, help="Only the last N records")
+    p = sub.add_parser('summary', help="Segments, records and time range of a binary log")
+    p.add_argument('directory')
+    p = sub.add_parser('table', help="The process table at a point in time, from a process log")
+    p.add_argument('directory')
+    p.add_argument('--at', type=float, default=None, help="Epoch seconds (default: now)")
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        for schema, count in convert_text_logs(args.log_dir, args.out_dir).items():
+            print(f"{schema}: {count} records")
+    elif args.command == 'dump':
+        records = BinaryLogReader(args.directory).read(args.start, args.end)
+        for record in records[-args.last:] if args.last else records:
+            print(format_record(record))
+    elif args.command == 'table':
+        table = process_table_at(args.directory, time.time() if args.at is None else args.at)
+        for record in sorted(table.values(), key=lambda record: record['cpu_percent'], reverse=True):
+            print(format_record(record))
+    else:
+        reader = BinaryLogReader(args.directory)
+        segments = reader.segments()
+        total = sum(len(open_segment(path)) for path in segments)
+        print(f"{len(segments)} segments, {total} records, "
+              f"{sum(os.path.getsize(path) for path in segments) / 2**10:,.1f} KiB")
+        if total:
+            times = np.concatenate([open_segment(path)['time'] for path in segments])
+            print(f"from {time.ctime(times.min())} to {time.ctime(times.max())}")
+
+if __name__ == '__main__':
+    main()
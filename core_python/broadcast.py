@@ -0,0 +1,207 @@
+# broadcast.py
+# Coalesces dashboard pushes. Producers publish the latest state of a channel
+# (a host's system metrics, the traffic rates) as often as data arrives; a
+# tick thread sends each room one frame per tick with only the fields that
+# changed since the previous frame. Emits per second no longer grow with the
+# number of agents, just with the rooms that have something new.
+#
+# Clients in the 'all' room get every update. A client can instead subscribe
+# to some hosts and get only those hosts' updates, plus the channels that
+# belong to no host. On connect or subscribe a client gets a keyframe (the
+# full current state) so later deltas apply to something. Items with nothing
+# sent before (a new host, or one that expired and came back) go out in a
+# keyframe too, so they replace whatever a client still holds for them.
+#
+# Frames look like {"seq": 12, "time": ..., "updates": {channel: {key: fields}}},
+# encoded as compact JSON text or, with use_msgpack, as msgpack bytes.
+import json
+import threading
+import time
+
+# msgpack is optional; without it frames are sent as JSON text
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+ALL_ROOM = 'all'
+
+def host_room(host_id):
+    return f"host:{host_id}"
+
+def diff(old, new):
+    """Fields of new that differ from old; fields old had and new lacks come out as None."""
+    if old is None:
+        return dict(new)
+    delta = {field: value for field, value in new.items() if old.get(field) != value or field not in old}
+    for field in old:
+        if field not in new:
+            delta[field] = None
+    return delta
+
+class BroadcastScheduler:
+    def __init__(self, emit, rate=4.0, use_msgpack=False, event='frame'):
+        """
+        :param emit: Sends a frame, as emit(event, payload, to=room_or_client) (socketio.emit).
+        :param rate: Ticks per second.
+        :param use_msgpack: Encode frames as msgpack bytes instead of JSON text.
+        :param event: Socket.IO event the frames are sent on.
+        """
+        if use_msgpack and msgpack is None:
+            raise ValueError("use_msgpack needs the msgpack package")
+        self.emit = emit
+        self.interval = 1.0 / rate
+        self.use_msgpack = use_msgpack
+        self.event = event
+        self._state = {}   # (channel, key) -> (last sent state, host_id)
+        self._pending = {} # (channel, key) -> (latest state, host_id), not sent yet
+        self._subscriptions = {} # client id -> hosts it subscribed to
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._started = time.monotonic()
+        self.counters = {'published': 0, 'merged': 0, 'ticks': 0, 'frames': 0, 'bytes': 0, 'keyframes': 0}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.tick()
+
+    def publish(self, channel, key, state, host_id=None):
+        """
+        Sets the latest state (a dict) of one item of a channel. Only the last state
+        published before a tick is sent. host_id scopes the item to that host's room.
+        """
+        with self._lock:
+            self.counters['published'] += 1
+            if (channel, key) in self._pending:
+                self.counters['merged'] += 1
+            self._pending[(channel, key)] = (state, host_id)
+
+    def subscribe(self, client_id, hosts):
+        """Records that a client now follows only these hosts (an empty list means all of them)."""
+        with self._lock:
+            if hosts:
+                self._subscriptions[client_id] = set(hosts)
+            else:
+                self._subscriptions.pop(client_id, None)
+
+    def unsubscribe(self, client_id):
+        self.subscribe(client_id, None)
+
+    def forget_hosts(self, host_ids):
+        """Drops the last sent state of hosts that expired; if one comes back, its items are sent in full."""
+        host_ids = set(host_ids)
+        with self._lock:
+            for item, (_, host_id) in list(self._state.items()):
+                if host_id in host_ids:
+                    del self._state[item]
+
+    def encode(self, frame):
+        if self.use_msgpack:
+            return msgpack.packb(frame, use_bin_type=True)
+        return json.dumps(frame, separators=(',', ':'))
+
+    def keyframe(self, client_id, hosts=None):
+        """Sends one client the full current state (of the given hosts, or of everything)."""
+        with self._lock:
+            items = dict(self._state)
+            items.update(self._pending)
+            self._seq += 1
+            seq = self._seq
+        updates = {}
+        for (channel, key), (state, host_id) in items.items():
+            if hosts and host_id is not None and host_id not in hosts:
+                continue
+            updates.setdefault(channel, {})[key] = state
+        payload = self.encode({'seq': seq, 'time': time.time(), 'keyframe': True, 'updates': updates})
+        self.emit(self.event, payload, to=client_id)
+        with self._lock:
+            self.counters['keyframes'] += 1
+            self.counters['bytes'] += len(payload)
+
+    def tick(self):
+        """Sends every room the fields that changed since the last tick."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            subscribed = set().union(*self._subscriptions.values()) if self._subscriptions else set()
+            self.counters['ticks'] += 1
+            if not pending:
+                return
+            # Changed fields of items sent before, and the full state of items sent for the first time
+            deltas = ({}, {})
+            fresh = ({}, {})
+            for (channel, key), (state, host_id) in pending.items():
+                previous = self._state.get((channel, key))
+                delta = diff(previous[0] if previous else None, state)
+                self._state[(channel, key)] = (state, host_id)
+                if not delta:
+                    continue
+                shared, by_host = deltas if previous else fresh
+                target = shared if host_id is None else by_host.setdefault(host_id, {})
+                target.setdefault(channel, {})[key] = delta
+            self._seq += 1
+            seq = self._seq
+
+        now = time.time()
+        frames = [(room, {'seq': seq, 'time': now, 'keyframe': True, 'updates': updates})
+                  for room, updates in self._room_updates(*fresh, subscribed)]
+        frames += [(room, {'seq': seq, 'time': now, 'updates': updates})
+                   for room, updates in self._room_updates(*deltas, subscribed)]
+        if not frames:
+            return
+
+        sent_bytes = 0
+        for room, frame in frames:
+            payload = self.encode(frame)
+            self.emit(self.event, payload, to=room)
+            sent_bytes += len(payload)
+        with self._lock:
+            self.counters['frames'] += len(frames)
+            self.counters['bytes'] += sent_bytes
+
+    @staticmethod
+    def _room_updates(shared, by_host, subscribed):
+        """
+        Splits updates into (room, updates) pairs: everything for the 'all' room, and for each
+        subscribed host its own updates plus the shared ones. shared maps channel -> key -> fields
+        for items of no host, by_host maps host_id to the same for that host's items.
+        """
+        if not shared and not by_host:
+            return []
+        everything = {channel: dict(items) for channel, items in shared.items()}
+        for updates in by_host.values():
+            for channel, items in updates.items():
+                everything.setdefault(channel, {}).update(items)
+        rooms = [(ALL_ROOM, everything)]
+        # Host rooms only get built for hosts someone subscribed to
+        for host_id in subscribed:
+            updates = {channel: dict(items) for channel, items in shared.items()}
+            for channel, items in by_host.get(host_id, {}).items():
+                updates.setdefault(channel, {}).update(items)
+            if updates:
+                rooms.append((host_room(host_id), updates))
+        return rooms
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.tick()
+            except Exception as e:
+                print(f"Error sending dashboard frame: {e}")
+
+    def stats(self):
+        """Counters plus frames and bytes sent per second since the scheduler was created."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['subscribed_clients'] = len(self._subscriptions)
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        stats['frames_per_second'] = stats['frames'] / elapsed
+        stats['bytes_per_second'] = stats['bytes'] / elapsed
+        return stats
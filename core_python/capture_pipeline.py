@@ -0,0 +1,205 @@
+# capture_pipeline.py
+# Multi-core network processing. One capture stage reads raw frames, hashes
+# each frame's 4-tuple and hands it to one of N worker processes, so every
+# worker owns a disjoint shard of the flow table. Workers run the usual
+# TrafficAnalyzer on their shard, and a sender stage in the parent process
+# collects the flow records they emit.
+import multiprocessing as mp
+import queue
+import signal
+import threading
+import time
+from packet_capture import flow_hash
+
+def shard_worker(shard_id, frames_in, records_out, analyzer_options, live, expire_interval, batch_size, flush_interval):
+    """Worker process: owns one shard of the flow table and emits its flow records in batches."""
+    # Ctrl+C reaches the whole process group; the parent stops the capture and sends the
+    # end-of-stream marker, so the worker must live on to flush its flow table
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Imported here so a spawned worker only pays for it once, in its own process
+    from network_agent import TrafficAnalyzer
+
+    out = []
+    last_flush = time.monotonic()
+    def flush():
+        nonlocal last_flush
+        if out:
+            records_out.put(out[:])
+            out.clear()
+        last_flush = time.monotonic()
+
+    def emit(features):
+        out.append(features)
+        if len(out) >= batch_size:
+            flush()
+
+    analyzer = TrafficAnalyzer(on_expire=emit, **analyzer_options)
+    packets = 0
+    last_expiry = None
+    while True:
+        try:
+            batch = frames_in.get(timeout=min(expire_interval, flush_interval))
+        except queue.Empty:
+            # Quiet link: live captures still need their idle flows expired
+            if live:
+                analyzer.expire_flows()
+            flush()
+            continue
+        if batch is None:
+            break
+
+        for timestamp, frame, linktype in batch:
+            features = analyzer.analyze_frame(frame, timestamp, linktype)
+            if features:
+                emit(features)
+        packets += len(batch)
+
+        # Expire on the packets' own clock, which also works for pcap replays
+        timestamp = batch[-1][0]
+        if last_expiry is None:
+            last_expiry = timestamp
+        elif timestamp - last_expiry >= expire_interval:
+            analyzer.expire_flows(now=timestamp)
+            last_expiry = timestamp
+
+        # A trickle of records on a busy link must not wait for a full batch either
+        if out and time.monotonic() - last_flush >= flush_interval:
+            flush()
+
+    analyzer.expire_flows(now=float('inf'))
+    if out:
+        records_out.put(out)
+    # Tell the sender stage this shard is done, along with its counters
+    metrics = analyzer.metrics()
+    metrics.update({'shard': shard_id, 'packets': packets})
+    records_out.put(('done', metrics))
+
+class CapturePipeline:
+    def __init__(self, on_record, workers=None, batch_size=256, max_delay=0.1, queue_batches=64, expire_interval=1.0,
+                 analyzer_options=None, flush_interval=1.0):
+        """
+        :param on_record: Called in the parent process with every flow record the workers emit.
+        :param workers: Number of worker processes (default: one per CPU core).
+        :param batch_size: Frames handed to a worker per queue operation.
+        :param max_delay: Partial batches are handed over after this many seconds.
+        :param queue_batches: Bound on batches waiting per worker; a full queue blocks the capture stage.
+        :param analyzer_options: Keyword arguments for each worker's TrafficAnalyzer.
+        :param flush_interval: Workers hand over their pending flow records at least this often.
+        """
+        self.on_record = on_record
+        self.workers = workers or mp.cpu_count()
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.queue_batches = queue_batches
+        self.expire_interval = expire_interval
+        self.analyzer_options = analyzer_options or {}
+        self.flush_interval = flush_interval
+        self.shard_metrics = []
+        self.failed = [] # (shard, exit code) of workers that died
+        self.captured = 0
+        self.skipped = 0
+
+    def run(self, frames, live=False):
+        """
+        Distributes (timestamp, frame, linktype) tuples from frames over the workers
+        until the iterable ends, then waits for every shard to flush. frames may also
+        yield None while no traffic arrives (RawSocketCapture.frames with idle_ticks),
+        so partial batches are handed over after max_delay on a quiet link too.
+        Raises RuntimeError after the healthy shards have flushed if a worker died.
+        """
+        frame_queues = [mp.Queue(maxsize=self.queue_batches) for _ in range(self.workers)]
+        records = mp.Queue()
+        processes = [
+            mp.Process(
+                target=shard_worker,
+                args=(i, frame_queues[i], records, self.analyzer_options, live, self.expire_interval, self.batch_size,
+                      self.flush_interval),
+                daemon=True
+            )
+            for i in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+        self.failed = []
+        sender = threading.Thread(target=self.sender_stage, args=(records, processes), daemon=True)
+        sender.start()
+
+        # Capture stage: only the 4-tuple hash is computed here, everything else happens in the shards
+        pending = [[] for _ in range(self.workers)]
+        workers = self.workers
+        batch_size = self.batch_size
+        started = last_flush = time.perf_counter()
+        for item in frames:
+            if item is not None:
+                h = flow_hash(item[1], item[2])
+                if h is None:
+                    self.skipped += 1
+                    continue
+                i = h % workers
+                pending[i].append(item)
+                if len(pending[i]) >= batch_size:
+                    if not self._put(frame_queues[i], pending[i]):
+                        break
+                    pending[i] = []
+                self.captured += 1
+
+            # On a slow link, don't let a partial batch wait for more traffic
+            if live:
+                now = time.perf_counter()
+                if now - last_flush >= self.max_delay:
+                    for i in range(workers):
+                        if pending[i]:
+                            self._put(frame_queues[i], pending[i])
+                            pending[i] = []
+                    last_flush = now
+                    if self.failed:
+                        break
+
+        for i in range(workers):
+            if processes[i].is_alive():
+                if pending[i]:
+                    self._put(frame_queues[i], pending[i])
+                self._put(frame_queues[i], None)
+        sender.join()
+        for shard, _ in self.failed:
+            # Nobody reads the dead shard's queue; don't wait at exit for its buffered batches
+            frame_queues[shard].cancel_join_thread()
+        for process in processes:
+            process.join()
+        if self.failed:
+            raise RuntimeError("shard worker " + ", ".join(f"{i} exited with code {code}" for i, code in self.failed))
+        return time.perf_counter() - started
+
+    def _put(self, frame_queue, batch):
+        """Hands a batch to a worker; gives up (returning False) once a worker has died, rather than block on its full queue."""
+        while True:
+            try:
+                frame_queue.put(batch, timeout=1.0)
+                return True
+            except queue.Full:
+                if self.failed:
+                    return False
+
+    def sender_stage(self, records, processes):
+        """
+        Aggregates the shards' flow records until every worker has reported done
+        or died; a dead worker is recorded in self.failed.
+        """
+        done = set()
+        while len(done) < self.workers:
+            try:
+                batch = records.get(timeout=1.0)
+            except queue.Empty:
+                # A worker that exits normally reports done first; any other exit means it crashed
+                for i, process in enumerate(processes):
+                    if i not in done and not process.is_alive() and process.exitcode != 0:
+                        print(f"Capture shard worker {i} exited with code {process.exitcode}; its flows are lost.")
+                        self.failed.append((i, process.exitcode))
+                        done.add(i)
+                continue
+            if isinstance(batch, tuple) and batch[0] == 'done':
+                self.shard_metrics.append(batch[1])
+                done.add(batch[1]['shard'])
+                continue
+            for features in batch:
+                self.on_record(features)
@@ -1,18 +1,18 @@
 import scapy.all as scapy
-from collections import defaultdict
 import time
 import csv
 import os
 import threading
+import argparse
+from flow_table import FlowTable, FlowRecord
+from packet_capture import parse_frame, replay_pcap, LINKTYPE_ETHERNET
 
 # --- This is the same traffic analyzer from before ---
 class TrafficAnalyzer:
-    def __init__(self):
-        self.flow_stats = defaultdict(lambda: {
-            'packet_count': 0, 'byte_count': 0, 'start_time': 0,
-            'last_time': 0, 'src_bytes': 0, 'dst_bytes': 0,
-            'flags': defaultdict(int)
-        })
+    def __init__(self, idle_timeout=15.0, max_flows=100000):
+        # Bounded like the network agent's table; flows idle for idle_timeout are dropped
+        self.flow_stats = FlowTable(new_flow=FlowRecord, max_flows=max_flows, idle_timeout=idle_timeout)
+        self.last_expiry = 0
 
     def analyze_packet(self, packet):
         if not (packet.haslayer(scapy.IP) and packet.haslayer(scapy.TCP)):
@@ -20,50 +20,59 @@ class TrafficAnalyzer:
 
         ip_layer = packet[scapy.IP]
         tcp_layer = packet[scapy.TCP]
+        return self.update(ip_layer.src, tcp_layer.sport, ip_layer.dst, tcp_layer.dport,
+                           len(packet), int(tcp_layer.flags), float(packet.time))
 
-        flow_key_part1 = (ip_layer.src, tcp_layer.sport)
-        flow_key_part2 = (ip_layer.dst, tcp_layer.dport)
-        flow_key = tuple(sorted((flow_key_part1, flow_key_part2)))
-        
-        stats = self.flow_stats[flow_key]
-
-        if stats['packet_count'] == 0:
-            stats['start_time'] = packet.time
-        stats['last_time'] = packet.time
-        stats['packet_count'] += 1
-        stats['byte_count'] += len(packet)
+    def analyze_frame(self, frame, timestamp, linktype=LINKTYPE_ETHERNET):
+        """Same as analyze_packet for a raw frame from a pcap file."""
+        fields = parse_frame(frame, linktype)
+        if fields is None:
+            return None
+        src, sport, dst, dport, length, flags, _, _ = fields
+        return self.update(src, sport, dst, dport, length, flags, timestamp)
 
-        if (ip_layer.src, tcp_layer.sport) == flow_key_part1:
-            stats['src_bytes'] += len(packet)
+    def update(self, src, sport, dst, dport, length, flags, timestamp):
+        """Flow update for one already-parsed TCP/IPv4 packet; returns the flow's feature row."""
+        if src < dst or (src == dst and sport <= dport):
+            flow_key = (src, sport, dst, dport)
         else:
-            stats['dst_bytes'] += len(packet)
-            
-        for flag in tcp_layer.flags.flagrepr():
-            stats['flags'][flag] += 1
+            flow_key = (dst, dport, src, sport)
+
+        stats = self.flow_stats.touch(flow_key)
+        # Every byte is counted as src_bytes here, as in the rows the Isolation Forest was trained on
+        stats.add_packet(length, flags, timestamp, True)
+
+        # Every row is written as it is produced, so idle flows can simply be dropped
+        if timestamp - self.last_expiry >= 1.0:
+            self.flow_stats.expire_idle(timestamp)
+            self.last_expiry = timestamp
             
         return self.extract_features(stats)
 
     def extract_features(self, stats):
-        flow_duration = stats['last_time'] - stats['start_time']
+        flow_duration = stats.last_time - stats.start_time
         if flow_duration == 0:
             flow_duration = 0.000001
 
         features = {
             "flow_duration": flow_duration,
-            "packet_count": stats['packet_count'],
-            "byte_count": stats['byte_count'],
-            "packet_rate": stats['packet_count'] / flow_duration,
-            "byte_rate": stats['byte_count'] / flow_duration,
-            "src_bytes": stats['src_bytes'],
-            "dst_bytes": stats['dst_bytes'],
+            "packet_count": stats.packet_count,
+            "byte_count": stats.byte_count,
+            "packet_rate": stats.packet_count / flow_duration,
+            "byte_rate": stats.byte_count / flow_duration,
+            "src_bytes": stats.src_bytes,
+            "dst_bytes": stats.dst_bytes,
         }
         return features
 
 # --- This new class handles writing the data to a CSV file ---
 class DataCollectorAgent:
-    def __init__(self, output_file, interface=None):
+    def __init__(self, output_file, interface=None, pcap_path=None, replay_speed=0.0):
         self.output_file = output_file
         self.interface = interface
+        # Rebuild the training data from an archived capture instead of a live interface
+        self.pcap_path = pcap_path
+        self.replay_speed = replay_speed
         self.analyzer = TrafficAnalyzer()
         self.stop_sniffing = threading.Event()
         self.written_flows = set() # Keep track of flows we've already written
@@ -91,10 +100,20 @@ class DataCollectorAgent:
             # --- END NEW ---
     
     def start(self):
-        print(f"Starting data collection on interface {self.interface or 'default'}.")
+        if self.pcap_path:
+            print(f"Starting data collection from '{self.pcap_path}'.")
+        else:
+            print(f"Starting data collection on interface {self.interface or 'default'}.")
         print(f"Saving data to '{self.output_file}'. Press Ctrl+C to stop.")
         try:
-            scapy.sniff(iface=self.interface, prn=self.packet_callback, store=False, stop_filter=lambda p: self.stop_sniffing.is_set())
+            if self.pcap_path:
+                # Streams the file one frame at a time, so captures larger than memory are fine
+                for timestamp, frame, linktype in replay_pcap(self.pcap_path, self.replay_speed, self.stop_sniffing):
+                    features = self.analyzer.analyze_frame(frame, timestamp, linktype)
+                    if features:
+                        self.writer.writerow(features)
+            else:
+                scapy.sniff(iface=self.interface, prn=self.packet_callback, store=False, stop_filter=lambda p: self.stop_sniffing.is_set())
         except Exception as e:
             print(f"An error occurred during sniffing: {e}")
         finally:
@@ -108,8 +127,15 @@ class DataCollectorAgent:
             print("File closed. Collection stopped.")
 
 if __name__ == '__main__':
-    OUTPUT_CSV_FILE = "normal_network_features.csv"
-    agent = DataCollectorAgent(output_file=OUTPUT_CSV_FILE)
+    parser = argparse.ArgumentParser(description="Collect flow features for training the anomaly detector")
+    parser.add_argument('--output', default="normal_network_features.csv", help="CSV file to append rows to")
+    parser.add_argument('--iface', default=None, help="Interface to sniff (default: scapy's default)")
+    parser.add_argument('--pcap', default=None, help="Build the rows from a pcap file instead of a live interface")
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help="Replay speed: 0 = as fast as possible (default), 1.0 = original timing")
+    args = parser.parse_args()
+
+    agent = DataCollectorAgent(output_file=args.output, interface=args.iface, pcap_path=args.pcap, replay_speed=args.speed)
     
     agent_thread = threading.Thread(target=agent.start)
     agent_thread.start()
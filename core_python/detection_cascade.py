@@ -0,0 +1,180 @@
+# detection_cascade.py
+# Runs network flows through detection stages in order of cost. The cheap
+# per-record checks (allowlist, rate rules, sliding-window aggregates, the
+# cache of recent model verdicts) run first in the server process; only records that survive them
+# go to the model stages, which usually run in the DetectionPool workers.
+#
+# Long-lived connections report every few hundred packets, so most records
+# belong to a flow the models scored a moment ago with nearly the same
+# features. The score cache (score_cache.py) reuses that verdict until the
+# flow has changed enough; a flow's final record is always scored, as is any
+# record a rule flagged. Entries are keyed by (host_id, flow_key), since two
+# hosts behind NAT can report the same 4-tuple.
+#
+# If the model stage fails (a worker died mid-batch, a model raised), the
+# batch still gets the cheap stages' alerts.
+import threading
+import time
+from operator import itemgetter
+from host_state import DEFAULT_HOST
+
+STAGES = ('allowlist', 'rules', 'aggregates', 'cache', 'models')
+
+# Emit reasons of a flow's last record; the flow is gone afterwards
+FINAL_REASONS = ('fin', 'rst', 'idle_timeout', 'capacity')
+
+def load_allowlist(path):
+    """
+    Reads allowlist entries, one per line: an IP ("10.0.0.5") or an endpoint
+    ("10.0.0.5:443"). Blank lines and # comments are ignored; a missing file
+    gives an empty allowlist.
+    """
+    try:
+        with open(path) as f:
+            lines = [line.split('#', 1)[0].strip() for line in f]
+    except FileNotFoundError:
+        return set()
+    return {line for line in lines if line}
+
+def flow_endpoints(flow_key):
+    """Splits an agent flow_key ("a.b.c.d:port-e.f.g.h:port") into its two "ip:port" endpoints."""
+    first, _, second = flow_key.partition('-')
+    return first, second
+
+class DetectionCascade:
+    def __init__(self, rules, score_models=None, allowlist=(), aggregates=None, cache=None, features=()):
+        """
+        :param rules: Cheap per-record check, returns a list of alerts (DetectionEngine.simple_rules).
+        :param score_models: Model stages, called as score_models(records, flagged) and returning one
+                             alert list and one anomaly score per record (DetectionEngine.score_models_batch
+                             or the pool's). None runs the cheap stages only.
+        :param allowlist: IPs and "ip:port" endpoints whose flows are never inspected.
+        :param aggregates: StreamAggregates fed with every inspected record (scan and flood rules),
+                           or None.
+        :param cache: A ScoreCache for model verdicts, or None to score every surviving record.
+        :param features: Record fields compared against the cached vector (the model features).
+        """
+        self.rules = rules
+        self.score_models = score_models
+        self.allowlist = set(allowlist)
+        self.aggregates = aggregates
+        self.cache = cache
+        self.features = list(features)
+        # Pulls the features out of a record as a tuple in one C call
+        self._features_of = itemgetter(*self.features) if len(self.features) > 1 else None
+        self._lock = threading.Lock()
+        # Per stage: records that reached it and records it decided on. Allowlist and cache hits
+        # stop a record; rule, aggregate and model hits are alerts raised.
+        self.counters = {stage: {'seen': 0, 'hits': 0} for stage in STAGES}
+        self.model_errors = 0 # batches the model stage failed on
+
+    def allowlisted(self, flow_key):
+        if not self.allowlist or not flow_key:
+            return False
+        for endpoint in flow_endpoints(flow_key):
+            if endpoint in self.allowlist or endpoint.rpartition(':')[0] in self.allowlist:
+                return True
+        return False
+
+    def detect_threats_batch(self, records):
+        """Same contract as DetectionEngine.detect_threats_batch: one list of alerts per record, in order."""
+        now = time.monotonic()
+        all_alerts = [[] for _ in records]
+        seen = dict.fromkeys(STAGES, 0)
+        hits = dict.fromkeys(STAGES, 0)
+        survivors = []
+        vectors = {} # record index -> feature vector, for records that may go into the cache
+        for i, record in enumerate(records):
+            flow_key = record.get('flow_key')
+            seen['allowlist'] += 1
+            if self.allowlisted(flow_key):
+                hits['allowlist'] += 1
+                continue
+
+            seen['rules'] += 1
+            alerts = all_alerts[i] = self.rules(record)
+            if alerts:
+                hits['rules'] += 1
+            if self.aggregates is not None:
+                seen['aggregates'] += 1
+                aggregate_alerts = self.aggregates.observe(record, now)
+                if aggregate_alerts:
+                    hits['aggregates'] += 1
+                    alerts.extend(aggregate_alerts)
+            if not alerts and self.cache is not None and record.get('emit_reason') not in FINAL_REASONS:
+                vector = self.vector(record)
+                if vector is not None:
+                    seen['cache'] += 1
+                    cached = self.cache.lookup(self.cache_key(record), vector, record.get('packet_count', 0), now)
+                    if cached is not None:
+                        hits['cache'] += 1
+                        all_alerts[i] = list(cached[1])
+                        continue
+                    vectors[i] = vector
+            survivors.append(i)
+
+        if survivors and self.score_models is not None:
+            seen['models'] = len(survivors)
+            batch = [records[i] for i in survivors]
+            try:
+                results, scores = self.score_models(batch, [bool(all_alerts[i]) for i in survivors])
+            except Exception as e:
+                # Nothing is cached for these records, so their next reports are scored again
+                print(f"Model stage failed on {len(batch)} records ({type(e).__name__}: {e}); "
+                      f"returning rule and aggregate alerts only.")
+                with self._lock:
+                    self.model_errors += 1
+                results, scores = (), ()
+            for i, alerts, score in zip(survivors, results, scores):
+                if alerts:
+                    hits['models'] += 1
+                    all_alerts[i].extend(alerts)
+                record = records[i]
+                if self.cache is None:
+                    continue
+                if record.get('emit_reason') in FINAL_REASONS:
+                    self.cache.evict(self.cache_key(record))
+                elif i in vectors:
+                    self.cache.store(self.cache_key(record), vectors[i], record.get('packet_count', 0),
+                                     score, alerts, now)
+
+        with self._lock:
+            for stage in STAGES:
+                self.counters[stage]['seen'] += seen[stage]
+                self.counters[stage]['hits'] += hits[stage]
+        return all_alerts
+
+    @staticmethod
+    def cache_key(record):
+        return (str(record.get('host_id', DEFAULT_HOST)), record.get('flow_key'))
+
+    def vector(self, record):
+        """The record's model features as a tuple, or None if it lacks one."""
+        try:
+            if self._features_of is not None:
+                return self._features_of(record)
+            return tuple(record[f] for f in self.features)
+        except KeyError:
+            return None
+
+    def stats(self):
+        """
+        Per stage: records seen and hits, the fraction of records it decided (hit_rate)
+        and the fraction it passed on undecided (pass_rate), plus the aggregate and score cache counters.
+        The models stage also counts the batches it failed on (errors).
+        """
+        stats = {
+            'stream_aggregates': self.aggregates.stats() if self.aggregates is not None else None,
+            'score_cache': self.cache.stats() if self.cache is not None else None,
+        }
+        with self._lock:
+            for stage in STAGES:
+                seen, hits = self.counters[stage]['seen'], self.counters[stage]['hits']
+                stats[stage] = {
+                    'seen': seen,
+                    'hits': hits,
+                    'hit_rate': hits / seen if seen else 0.0,
+                    'pass_rate': (seen - hits) / seen if seen else 0.0,
+                }
+            stats['models']['errors'] = self.model_errors
+        return stats
@@ -1,15 +1,63 @@
 # detection_engine.py
 import joblib
-import pandas as pd
+import numpy as np
+from forest_compiler import compile_forest
+from flow_features import CIC_FEATURES
 
 class DetectionEngine:
-    def __init__(self, iso_forest_path, rf_path, label_encoder_path):
+    def __init__(self, iso_forest_path, rf_path, label_encoder_path, mmap_mode=None, signature_gating=True,
+                 signature_min_confidence=0.5, packet_rate_threshold=1000):
+        """
+        :param signature_gating: Only run the signature classifier on flows the rule or anomaly
+                                 stage already flagged, keeping it off the path of benign traffic.
+        :param signature_min_confidence: Class probability a non-benign label needs to raise an alert.
+        :param packet_rate_threshold: Per-flow packets per second above which the flood rule fires.
+        """
         print("Loading detection models...")
-        self.iso_forest_model = joblib.load(iso_forest_path)
-        self.rf_model = joblib.load(rf_path)
-        self.label_encoder = joblib.load(label_encoder_path)
+        # mmap_mode='r' maps the models' arrays read-only from the file instead of copying them into this process
+        self.iso_forest_model = joblib.load(iso_forest_path, mmap_mode=mmap_mode)
+        # Flat-array versions of the forests, scored with one vectorized traversal per batch
+        self.iso_forest = compile_forest(self.iso_forest_model)
+        # Column order the Isolation Forest was trained with; batch matrices are built in this order
+        self.iso_forest_features = list(self.iso_forest_model.feature_names_in_)
+        self.anomaly_threshold = -0.1 # Threshold can be tuned
+        self.packet_rate_threshold = packet_rate_threshold
+
+        # The signature model is optional; without it the rule and anomaly stages still run
+        self.signature_gating = signature_gating
+        self.signature_min_confidence = signature_min_confidence
+        self.rf = None
+        try:
+            self.rf_model = joblib.load(rf_path, mmap_mode=mmap_mode)
+            self.label_encoder = joblib.load(label_encoder_path)
+        except FileNotFoundError as e:
+            print(f"Signature model not available ({e.filename}); signature detection disabled.")
+            self.rf_model = None
+            self.label_encoder = None
+        if self.rf_model is not None:
+            self.load_signature_model()
         print("Models loaded successfully.")
 
+    def load_signature_model(self):
+        """Compiles the Random Forest and works out its columns and labels; disables it if they don't fit."""
+        rf = compile_forest(self.rf_model)
+        if not hasattr(rf, 'predict_proba'):
+            print("Signature model is not a RandomForestClassifier; signature detection disabled.")
+            return
+        # Positions of the model's training columns in the agent's cic_features list
+        names = list(getattr(self.rf_model, 'feature_names_in_', CIC_FEATURES[:self.rf_model.n_features_in_]))
+        missing = [name for name in names if name not in CIC_FEATURES]
+        if missing:
+            print(f"Signature model uses features the agents don't compute ({missing}); signature detection disabled.")
+            return
+        self.signature_columns = [CIC_FEATURES.index(name) for name in names]
+        # The model predicts label-encoded classes; decode them once here
+        labels = self.rf_model.classes_
+        if self.label_encoder is not None and np.issubdtype(labels.dtype, np.integer):
+            labels = self.label_encoder.inverse_transform(labels)
+        self.signature_labels = [str(label) for label in labels]
+        self.rf = rf
+
     def simple_rules(self, metrics):
         """A simple rule-based detection engine that handles the new flat structure."""
         alerts = []
@@ -17,7 +65,7 @@ class DetectionEngine:
         # This part of the engine now focuses only on network_flow.
         if metrics.get('type') == 'network_flow':
             # MODIFIED: Access 'packet_rate' directly from metrics, not metrics['data']
-            if metrics.get('packet_rate', 0) > 1000: # Packets per second
+            if metrics.get('packet_rate', 0) > self.packet_rate_threshold: # Packets per second
                  alerts.append({
                     "type": "Rule-Based Alert",
                     "severity": "Critical",
@@ -31,47 +79,88 @@ class DetectionEngine:
         """
         Runs the incoming data through all detection mechanisms.
         """
-        all_alerts = []
-        
-        # 1. Run through simple rules (now works with flat data)
-        all_alerts.extend(self.simple_rules(metrics_json))
-        
-        # This function should only process network data for ML models
-        if metrics_json.get('type') != 'network_flow':
-            return all_alerts
+        return self.detect_threats_batch([metrics_json])[0]
 
-        # MODIFIED: Prepare data directly from the flat metrics_json, not from a nested 'data' key
-        df = pd.DataFrame([metrics_json])
-        
-        # 2. Run through Anomaly Detection (Isolation Forest)
-        try:
-            iso_forest_features = self.iso_forest_model.feature_names_in_
-            
-            # Check if all required columns are present
-            if all(feature in df.columns for feature in iso_forest_features):
-                df_iso = df[iso_forest_features]
-                
-                anomaly_score = self.iso_forest_model.decision_function(df_iso)
-                if anomaly_score[0] < -0.1: # Threshold can be tuned
-                    all_alerts.append({
-                        "type": "Anomaly-Based Alert",
-                        "severity": "Medium",
-                        "description": "Anomalous Behavior Detected",
-                        # MODIFIED: Fixed the numpy array formatting bug
-                        "details": f"Anomaly score of {anomaly_score[0]:.2f}."
-                    })
-            else:
-                # This can happen if a packet is missing some features
-                missing_cols = [f for f in iso_forest_features if f not in df.columns]
-                # print(f"Warning: Missing columns for anomaly detection: {missing_cols}") # Optional debug message
-                pass
+    def detect_threats_batch(self, records):
+        """
+        Runs a list of records through all detection mechanisms at once.
+        Returns one list of alerts per input record, in the same order.
+        """
+        all_alerts = [self.simple_rules(record) for record in records]
+        model_alerts, _ = self.score_models_batch(records, [bool(alerts) for alerts in all_alerts])
+        for alerts, more in zip(all_alerts, model_alerts):
+            alerts.extend(more)
+        return all_alerts
 
-        except Exception as e:
-            print(f"Error during anomaly detection: {e}")
+    def score_models_batch(self, records, flagged):
+        """
+        Runs only the model stages (anomaly and signature detection) on a list of records.
+        flagged[i] tells whether a cheaper stage already raised an alert for records[i],
+        which lets the signature classifier through when gating is on.
+        Returns one list of alerts per input record, in the same order, and each record's
+        anomaly score (None for records the Isolation Forest did not score).
+        """
+        all_alerts = [[] for _ in records]
+        scores = [None] * len(records)
 
-        # 3. Placeholder for Signature Detection (Random Forest)
-        # ...
+        # Only network flows that carry every model feature go to the ML models
+        features = self.iso_forest_features
+        scored = [
+            i for i, record in enumerate(records)
+            if record.get('type') == 'network_flow' and all(f in record for f in features)
+        ]
 
-        return all_alerts
+        # 2. Run through Anomaly Detection (Isolation Forest) with one vectorized call
+        if scored:
+            try:
+                matrix = np.array([[records[i][f] for f in features] for i in scored], dtype=np.float64)
+                anomaly_scores = self.score_anomalies(matrix)
+                for i, score in zip(scored, anomaly_scores):
+                    scores[i] = float(score)
+                    if score < self.anomaly_threshold:
+                        all_alerts[i].append({
+                            "type": "Anomaly-Based Alert",
+                            "severity": "Medium",
+                            "description": "Anomalous Behavior Detected",
+                            "details": f"Anomaly score of {score:.2f}."
+                        })
+            except Exception as e:
+                print(f"Error during anomaly detection: {e}")
+
+        # 3. Signature Detection (Random Forest) on flows that carry the CIC features
+        if self.rf is not None:
+            candidates = [
+                i for i, record in enumerate(records)
+                if 'cic_features' in record and (flagged[i] or all_alerts[i] or not self.signature_gating)
+            ]
+            if candidates:
+                try:
+                    for i, label, confidence in self.classify(records, candidates):
+                        all_alerts[i].append({
+                            "type": "Signature-Based Alert",
+                            "severity": "High",
+                            "description": f"{label} Traffic Detected",
+                            "details": f"Classifier confidence {confidence:.2f} for flow {records[i].get('flow_key')}"
+                        })
+                except Exception as e:
+                    print(f"Error during signature detection: {e}")
+
+        return all_alerts, scores
+
+    def classify(self, records, candidates):
+        """
+        Runs the signature classifier on records[i] for each i in candidates with one batched
+        predict_proba, yielding (i, label, confidence) for every non-benign verdict.
+        """
+        matrix = np.array([records[i]['cic_features'] for i in candidates], dtype=np.float64)
+        proba = self.rf.predict_proba(matrix[:, self.signature_columns])
+        best = proba.argmax(axis=1)
+        confidence = proba[np.arange(len(best)), best]
+        for i, k, p in zip(candidates, best, confidence):
+            label = self.signature_labels[k]
+            if label != 'BENIGN' and p >= self.signature_min_confidence:
+                yield i, label, p
 
-# Example Usage part is removed for clarity as it's not needed for the main application
\ No newline at end of file
+    def score_anomalies(self, matrix):
+        """Returns Isolation Forest decision scores for a matrix in iso_forest_features order."""
+        return self.iso_forest.decision_function(matrix)
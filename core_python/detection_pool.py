@@ -0,0 +1,119 @@
+# detection_pool.py
+# Scores detection batches in worker processes, so scoring is not limited to
+# the one core the server's GIL allows. Workers are forked from a process
+# that already loaded the models and share them copy-on-write instead of
+# each loading its own copy (load the engine with mmap_mode='r' so the model
+# arrays are also backed by the page cache rather than private memory).
+#
+# Callers send a batch over a pipe and wait for the reply. Under eventlet the
+# wait yields to the hub, so a green thread can drive a worker without
+# blocking the server.
+#
+# A worker that dies is not replaced: forking the running server would copy
+# its event loop, green threads and listening sockets into the child. The
+# pool goes on with the workers it has left, and once none are left batches
+# are scored in the calling process.
+import multiprocessing as mp
+import threading
+from collections import deque
+
+def detection_worker(conn, engine):
+    """
+    Worker process: runs the engine calls it receives, as (method name, args) pairs,
+    with the inherited engine until told to stop.
+    """
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+        method, args = message
+        try:
+            conn.send(getattr(engine, method)(*args))
+        except Exception as e:
+            conn.send(e)
+
+class DetectionPool:
+    def __init__(self, engine, workers=None):
+        """
+        Forks the worker processes. Create the pool before starting any threads
+        (or green threads), since a forked child inherits them.
+        :param engine: A loaded DetectionEngine; workers use it through copy-on-write.
+        :param workers: Number of worker processes (default: one per CPU core).
+        """
+        self._ctx = mp.get_context('fork')
+        self.engine = engine
+        self.workers = workers or mp.cpu_count()
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._processes = {} # conn -> worker process
+        self.lost = 0 # workers that died
+        for _ in range(self.workers):
+            self._idle.append(self._spawn())
+
+    def _spawn(self):
+        """Forks one worker and returns the parent's end of its pipe."""
+        conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=detection_worker, args=(child_conn, self.engine), daemon=True)
+        process.start()
+        child_conn.close()
+        self._processes[conn] = process
+        return conn
+
+    def detect_threats_batch(self, records):
+        """Same contract as DetectionEngine.detect_threats_batch, scored by the next idle worker."""
+        return self._call('detect_threats_batch', records)
+
+    def score_models_batch(self, records, flagged):
+        """Same contract as DetectionEngine.score_models_batch, scored by the next idle worker."""
+        return self._call('score_models_batch', records, flagged)
+
+    def _call(self, method, *args):
+        with self._cond:
+            while self._processes and not self._idle:
+                self._cond.wait()
+            conn = self._idle.popleft() if self._idle else None
+        if conn is None:
+            # Every worker is gone
+            return getattr(self.engine, method)(*args)
+        try:
+            conn.send((method, args))
+            result = conn.recv()
+        except (EOFError, OSError):
+            # The batch it was scoring fails; it may be what killed the worker
+            self._drop(conn)
+            raise
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _drop(self, conn):
+        """Removes the dead worker behind conn from the pool."""
+        with self._cond:
+            process = self._processes.pop(conn)
+            self.lost += 1
+            left = len(self._processes)
+            # Waiters recheck: with no workers left they score in-process
+            self._cond.notify_all()
+        conn.close()
+        process.join(timeout=1)
+        print(f"Detection worker exited unexpectedly (exit code {process.exitcode}); "
+              + (f"{left} still running." if left else "scoring in the server process from now on."))
+
+    def pids(self):
+        return [process.pid for process in self._processes.values()]
+
+    def close(self):
+        """Stops the workers; one still scoring a batch exits once it is done."""
+        with self._cond:
+            for conn in self._idle:
+                conn.send(None)
+                conn.close()
+            self._idle.clear()
+        for process in self._processes.values():
+            process.join(timeout=5)
@@ -0,0 +1,77 @@
+# downsample.py
+# Picks which points of a long series to draw. A chart a few hundred pixels
+# wide gains nothing from thousands of points, but averaging them away hides
+# the spikes an analyst is looking for. Both methods here return indices of
+# points that are kept as they are, so several series sharing the time axis
+# (sent and received) can be cut down together.
+#
+# - lttb_indices: Largest-Triangle-Three-Buckets; keeps the points that best
+#   preserve the visual shape of the line.
+# - min_max_indices: the lowest and highest point of each bucket; every peak
+#   and trough survives.
+
+def lttb_indices(xs, ys, threshold):
+    """Indices of about threshold points of (xs, ys) chosen by Largest-Triangle-Three-Buckets, in order."""
+    n = len(xs)
+    threshold = max(threshold, 3)
+    if threshold >= n:
+        return list(range(n))
+    # First and last point are always kept; the rest are split into threshold - 2 buckets
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket, the third corner of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        count = next_end - next_start
+        avg_x = sum(xs[next_start:next_end]) / count
+        avg_y = sum(ys[next_start:next_end]) / count
+
+        # The point of this bucket making the largest triangle with the last kept point and that average
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+def min_max_indices(ys, buckets):
+    """Indices of the lowest and highest point of each of buckets equal slices of ys, in order."""
+    n = len(ys)
+    if 2 * buckets >= n:
+        return list(range(n))
+    size = n / buckets
+    selected = []
+    for b in range(buckets):
+        start, end = int(b * size), int((b + 1) * size)
+        low = high = start
+        for j in range(start + 1, end):
+            if ys[j] < ys[low]:
+                low = j
+            elif ys[j] > ys[high]:
+                high = j
+        selected.extend(sorted({low, high}))
+    return selected
+
+def downsample(xs, series, points, method='lttb'):
+    """
+    Cuts xs and every list in series (a dict of equally long lists) down to about points
+    points. The points are chosen on the sum of the series. Returns (xs, series).
+    """
+    if len(xs) <= points:
+        return xs, series
+    totals = [sum(values) for values in zip(*series.values())] if series else [0] * len(xs)
+    if method == 'minmax':
+        indices = min_max_indices(totals, max(points // 2, 1))
+    elif method == 'lttb':
+        indices = lttb_indices(xs, totals, points)
+    else:
+        raise ValueError(f"Unknown downsampling method {method}")
+    return [xs[i] for i in indices], {name: [values[i] for i in indices] for name, values in series.items()}
@@ -0,0 +1,155 @@
+# flow_features.py
+# CIC-IDS2017-style flow features, shared by the network agent (which computes
+# them per flow) and train_signature_detector.py (which selects the same
+# columns from the CIC-IDS2017 CSVs), so the signature model sees the features
+# it was trained on.
+#
+# Conventions follow CICFlowMeter: the forward direction is the one of the
+# flow's first packet, packet lengths are TCP payload bytes, header lengths
+# are TCP header bytes, durations and inter-arrival times are in microseconds,
+# and standard deviations are sample standard deviations (0 for one value).
+import math
+from flow_table import TCP_PSH, TCP_URG
+
+# The 40 columns the signature model is trained on, in model order
+CIC_FEATURES = [
+    'Destination Port', 'Flow Duration', 'Total Fwd Packets', 'Total Backward Packets',
+    'Total Length of Fwd Packets', 'Total Length of Bwd Packets',
+    'Fwd Packet Length Max', 'Fwd Packet Length Min', 'Fwd Packet Length Mean', 'Fwd Packet Length Std',
+    'Bwd Packet Length Max', 'Bwd Packet Length Min', 'Bwd Packet Length Mean', 'Bwd Packet Length Std',
+    'Flow Bytes/s', 'Flow Packets/s', 'Flow IAT Mean', 'Flow IAT Std', 'Flow IAT Max', 'Flow IAT Min',
+    'Fwd IAT Total', 'Fwd IAT Mean', 'Fwd IAT Std', 'Fwd IAT Max', 'Fwd IAT Min',
+    'Bwd IAT Total', 'Bwd IAT Mean', 'Bwd IAT Std', 'Bwd IAT Max', 'Bwd IAT Min',
+    'Fwd PSH Flags', 'Bwd PSH Flags', 'Fwd URG Flags', 'Bwd URG Flags',
+    'Fwd Header Length', 'Bwd Header Length', 'Fwd Packets/s', 'Bwd Packets/s',
+    'Min Packet Length', 'Max Packet Length',
+]
+
+def _mean(total, count):
+    return total / count if count else 0.0
+
+def _std(total, total_sq, count):
+    """Sample standard deviation from a running sum and sum of squares."""
+    if count < 2:
+        return 0.0
+    return math.sqrt(max(0.0, (total_sq - total * total / count) / (count - 1)))
+
+class CicFlowStats:
+    """
+    Per-flow state behind the CIC features, updated once per packet. Running sums,
+    sums of squares, minima and maxima are kept flat in slots, per direction, so a
+    packet costs one method call.
+    """
+    __slots__ = (
+        'initiator_from_src', 'destination_port', 'first_time', 'last_time',
+        'flow_iat_total', 'flow_iat_sq', 'flow_iat_min', 'flow_iat_max',
+        'fwd_count', 'fwd_total', 'fwd_sq', 'fwd_min', 'fwd_max', 'fwd_last',
+        'fwd_iat_total', 'fwd_iat_sq', 'fwd_iat_min', 'fwd_iat_max', 'fwd_header', 'fwd_psh', 'fwd_urg',
+        'bwd_count', 'bwd_total', 'bwd_sq', 'bwd_min', 'bwd_max', 'bwd_last',
+        'bwd_iat_total', 'bwd_iat_sq', 'bwd_iat_min', 'bwd_iat_max', 'bwd_header', 'bwd_psh', 'bwd_urg',
+    )
+
+    def __init__(self, initiator_from_src, destination_port):
+        """
+        :param initiator_from_src: The flow table's from_src value of the flow's first packet;
+                                   packets with the same value are forward.
+        :param destination_port: Destination port of the first packet.
+        """
+        self.initiator_from_src = initiator_from_src
+        self.destination_port = destination_port
+        self.first_time = self.last_time = None
+        self.flow_iat_total = self.flow_iat_sq = self.flow_iat_min = self.flow_iat_max = 0.0
+        self.fwd_count = self.bwd_count = 0
+        self.fwd_total = self.fwd_sq = self.fwd_min = self.fwd_max = 0
+        self.bwd_total = self.bwd_sq = self.bwd_min = self.bwd_max = 0
+        self.fwd_last = self.bwd_last = None
+        self.fwd_iat_total = self.fwd_iat_sq = self.fwd_iat_min = self.fwd_iat_max = 0.0
+        self.bwd_iat_total = self.bwd_iat_sq = self.bwd_iat_min = self.bwd_iat_max = 0.0
+        self.fwd_header = self.fwd_psh = self.fwd_urg = 0
+        self.bwd_header = self.bwd_psh = self.bwd_urg = 0
+
+    def add(self, payload_len, header_len, flags, timestamp, from_src):
+        # Flow inter-arrival time, in microseconds
+        if self.first_time is None:
+            self.first_time = timestamp
+        else:
+            iat = (timestamp - self.last_time) * 1e6
+            if self.fwd_count + self.bwd_count == 1 or iat < self.flow_iat_min:
+                self.flow_iat_min = iat
+            if iat > self.flow_iat_max:
+                self.flow_iat_max = iat
+            self.flow_iat_total += iat
+            self.flow_iat_sq += iat * iat
+        self.last_time = timestamp
+
+        if from_src == self.initiator_from_src:
+            if self.fwd_count == 0 or payload_len < self.fwd_min:
+                self.fwd_min = payload_len
+            if payload_len > self.fwd_max:
+                self.fwd_max = payload_len
+            self.fwd_count += 1
+            self.fwd_total += payload_len
+            self.fwd_sq += payload_len * payload_len
+            if self.fwd_last is not None:
+                iat = (timestamp - self.fwd_last) * 1e6
+                if self.fwd_count == 2 or iat < self.fwd_iat_min:
+                    self.fwd_iat_min = iat
+                if iat > self.fwd_iat_max:
+                    self.fwd_iat_max = iat
+                self.fwd_iat_total += iat
+                self.fwd_iat_sq += iat * iat
+            self.fwd_last = timestamp
+            self.fwd_header += header_len
+            if flags & TCP_PSH:
+                self.fwd_psh += 1
+            if flags & TCP_URG:
+                self.fwd_urg += 1
+        else:
+            if self.bwd_count == 0 or payload_len < self.bwd_min:
+                self.bwd_min = payload_len
+            if payload_len > self.bwd_max:
+                self.bwd_max = payload_len
+            self.bwd_count += 1
+            self.bwd_total += payload_len
+            self.bwd_sq += payload_len * payload_len
+            if self.bwd_last is not None:
+                iat = (timestamp - self.bwd_last) * 1e6
+                if self.bwd_count == 2 or iat < self.bwd_iat_min:
+                    self.bwd_iat_min = iat
+                if iat > self.bwd_iat_max:
+                    self.bwd_iat_max = iat
+                self.bwd_iat_total += iat
+                self.bwd_iat_sq += iat * iat
+            self.bwd_last = timestamp
+            self.bwd_header += header_len
+            if flags & TCP_PSH:
+                self.bwd_psh += 1
+            if flags & TCP_URG:
+                self.bwd_urg += 1
+
+    def features(self):
+        """The CIC_FEATURES values, in order."""
+        fwd_count, bwd_count = self.fwd_count, self.bwd_count
+        packets = fwd_count + bwd_count
+        duration = (self.last_time - self.first_time) * 1e6 if packets else 0.0
+        # Rates per second; a single-packet flow gets a 1 us duration instead of a division by zero
+        seconds = max(duration, 1.0) / 1e6
+        fwd_iats, bwd_iats = max(fwd_count - 1, 0), max(bwd_count - 1, 0)
+        # Shortest and longest packet over both directions, ignoring a direction without packets
+        lengths_min = [m for m, count in ((self.fwd_min, fwd_count), (self.bwd_min, bwd_count)) if count]
+        return [
+            self.destination_port, duration, fwd_count, bwd_count,
+            self.fwd_total, self.bwd_total,
+            self.fwd_max, self.fwd_min, _mean(self.fwd_total, fwd_count), _std(self.fwd_total, self.fwd_sq, fwd_count),
+            self.bwd_max, self.bwd_min, _mean(self.bwd_total, bwd_count), _std(self.bwd_total, self.bwd_sq, bwd_count),
+            (self.fwd_total + self.bwd_total) / seconds, packets / seconds,
+            _mean(self.flow_iat_total, packets - 1), _std(self.flow_iat_total, self.flow_iat_sq, packets - 1),
+            self.flow_iat_max, self.flow_iat_min,
+            self.fwd_iat_total, _mean(self.fwd_iat_total, fwd_iats), _std(self.fwd_iat_total, self.fwd_iat_sq, fwd_iats),
+            self.fwd_iat_max, self.fwd_iat_min,
+            self.bwd_iat_total, _mean(self.bwd_iat_total, bwd_iats), _std(self.bwd_iat_total, self.bwd_iat_sq, bwd_iats),
+            self.bwd_iat_max, self.bwd_iat_min,
+            self.fwd_psh, self.bwd_psh, self.fwd_urg, self.bwd_urg,
+            self.fwd_header, self.bwd_header, fwd_count / seconds, bwd_count / seconds,
+            min(lengths_min) if lengths_min else 0, max(self.fwd_max, self.bwd_max),
+        ]
@@ -0,0 +1,191 @@
+# flow_table.py
+# Bounded flow table used by the traffic analyzers. Flows are kept in LRU
+# order (least recently updated first), so idle flows are always at the
+# front and expiring them costs only the number of flows actually expired.
+from collections import OrderedDict
+
+# TCP flag bits as they appear in the header's flags byte
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_PSH = 0x08
+TCP_ACK = 0x10
+TCP_URG = 0x20
+
+class FlowRecord:
+    """
+    Per-flow counters. __slots__ keeps each flow to a fixed set of attributes
+    instead of a dict plus a nested flag dict, and the four TCP flags the
+    detectors use get their own counters.
+    """
+    __slots__ = (
+        'packet_count', 'byte_count', 'start_time', 'last_time', 'src_bytes', 'dst_bytes',
+        'syn_count', 'fin_count', 'rst_count', 'ack_count',
+        # Directions that sent a FIN: 1 for the flow key's first endpoint, 2 for the second
+        'fin_directions',
+        # from_src of the flow's first packet: whether the initiator is the flow key's first endpoint
+        'initiator_from_src',
+        # TCP flags of the flow's first packet (0 for other protocols)
+        'first_flags',
+        # State of the last emitted record, used for the timeouts and byte deltas
+        'last_emit_time', 'emitted_packets', 'emitted_src_bytes', 'emitted_dst_bytes',
+        # CicFlowStats for analyzers that compute the signature model's features, otherwise None
+        'cic'
+    )
+
+    def __init__(self):
+        self.packet_count = 0
+        self.byte_count = 0
+        self.start_time = 0.0
+        self.last_time = 0.0
+        self.src_bytes = 0
+        self.dst_bytes = 0
+        self.syn_count = 0
+        self.fin_count = 0
+        self.rst_count = 0
+        self.ack_count = 0
+        self.fin_directions = 0
+        self.initiator_from_src = True
+        self.first_flags = 0
+        self.last_emit_time = 0.0
+        self.emitted_packets = 0
+        self.emitted_src_bytes = 0
+        self.emitted_dst_bytes = 0
+        self.cic = None
+
+    def add_packet(self, length, flags, timestamp, from_src):
+        """Counts one packet; flags is the TCP flags byte."""
+        if self.packet_count == 0:
+            self.start_time = timestamp
+            self.last_emit_time = timestamp
+            self.initiator_from_src = from_src
+            self.first_flags = flags
+        self.last_time = timestamp
+        self.packet_count += 1
+        self.byte_count += length
+        if from_src:
+            self.src_bytes += length
+        else:
+            self.dst_bytes += length
+        if flags & TCP_SYN:
+            self.syn_count += 1
+        if flags & TCP_FIN:
+            self.fin_count += 1
+            self.fin_directions |= 1 if from_src else 2
+        if flags & TCP_RST:
+            self.rst_count += 1
+        if flags & TCP_ACK:
+            self.ack_count += 1
+
+    def opened_here(self):
+        """
+        Whether the capture saw the flow being opened: its first packet was not a TCP reply
+        (ACK or RST), e.g. a SYN, a scan probe or a UDP datagram. Otherwise the flow was
+        picked up mid-connection and initiator_from_src may name the server.
+        """
+        return not self.first_flags & (TCP_ACK | TCP_RST)
+
+class FlowTable:
+    def __init__(self, new_flow, on_expire=None, max_flows=100000, idle_timeout=15.0, linger=5.0):
+        """
+        :param new_flow: Factory returning the state for a new flow (a FlowRecord).
+        :param on_expire: Called as on_expire(flow_key, stats, reason) when a flow is
+                          evicted for 'idle_timeout' or 'capacity'.
+        :param max_flows: Hard cap on tracked flows; the least recently updated
+                          flow is evicted to make room for a new one.
+        :param linger: Seconds a closed flow's key absorbs trailing packets (late ACKs,
+                       retransmitted FINs) instead of letting them open a new flow.
+        """
+        self.new_flow = new_flow
+        self.on_expire = on_expire
+        self.max_flows = max_flows
+        self.idle_timeout = idle_timeout
+        self.linger = linger
+        self.flows = OrderedDict()
+        self.closed = OrderedDict() # flow_key -> time it was closed, oldest first
+        self.absorbed = 0
+        self.flows_created = 0
+        self.evictions = {'idle_timeout': 0, 'capacity': 0, 'closed': 0}
+
+    def __len__(self):
+        return len(self.flows)
+
+    def __contains__(self, flow_key):
+        return flow_key in self.flows
+
+    def touch(self, flow_key):
+        """Returns the flow's state, creating it if needed, and marks it most recently used."""
+        stats = self.flows.get(flow_key)
+        if stats is not None:
+            self.flows.move_to_end(flow_key)
+            return stats
+
+        if len(self.flows) >= self.max_flows:
+            old_key, old_stats = self.flows.popitem(last=False)
+            self._expire(old_key, old_stats, 'capacity')
+        stats = self.new_flow()
+        self.flows[flow_key] = stats
+        self.flows_created += 1
+        return stats
+
+    def close(self, flow_key, now):
+        """
+        Drops a flow that ended normally (FIN/RST); its final record was already emitted.
+        The key lingers, so packets still in flight for it are absorbed by absorbs().
+        """
+        if self.flows.pop(flow_key, None) is not None:
+            self.evictions['closed'] += 1
+            if self.linger > 0:
+                self.closed[flow_key] = now
+                self.closed.move_to_end(flow_key)
+                if len(self.closed) > self.max_flows:
+                    self.closed.popitem(last=False)
+
+    def absorbs(self, flow_key, flags, now):
+        """
+        True for a trailing packet of a flow closed less than linger seconds ago; the caller
+        drops it. A SYN without ACK is a new connection on the same ports and is not absorbed.
+        """
+        closed_at = self.closed.get(flow_key)
+        if closed_at is None:
+            return False
+        if now - closed_at >= self.linger or (flags & TCP_SYN and not flags & TCP_ACK):
+            del self.closed[flow_key]
+            return False
+        self.absorbed += 1
+        return True
+
+    def expire_idle(self, now):
+        """Evicts every flow whose last packet is older than idle_timeout."""
+        expired = 0
+        while self.flows:
+            flow_key, stats = next(iter(self.flows.items()))
+            if now - stats.last_time < self.idle_timeout:
+                break
+            del self.flows[flow_key]
+            self._expire(flow_key, stats, 'idle_timeout')
+            expired += 1
+        while self.closed:
+            flow_key, closed_at = next(iter(self.closed.items()))
+            if now - closed_at < self.linger:
+                break
+            del self.closed[flow_key]
+        return expired
+
+    def items(self):
+        return self.flows.items()
+
+    def metrics(self):
+        return {
+            'size': len(self.flows),
+            'capacity': self.max_flows,
+            'flows_created': self.flows_created,
+            'lingering': len(self.closed),
+            'absorbed': self.absorbed,
+            'evictions': dict(self.evictions),
+        }
+
+    def _expire(self, flow_key, stats, reason):
+        self.evictions[reason] += 1
+        if self.on_expire:
+            self.on_expire(flow_key, stats, reason)
@@ -0,0 +1,202 @@
+# forest_compiler.py
+# Compiles fitted scikit-learn tree ensembles (IsolationForest, RandomForestClassifier)
+# into flat NumPy arrays: one node table for all trees, holding each node's
+# feature, threshold, children and leaf value. A batch is scored by walking
+# every row down every tree at once, one vectorized step per tree level,
+# instead of calling 100 estimator objects one after another.
+#
+# Scores are identical to sklearn's: inputs are cast to float32 as sklearn does,
+# NaNs follow each node's missing-value direction, and per-tree results are
+# summed in estimator order.
+#
+# Only the fitted trees' public tree_ arrays and the estimators' public fitted
+# attributes are read. compile_forest still checks every compiled forest
+# against sklearn on a probe batch and falls back to the sklearn estimator if
+# compiling fails or the scores differ, e.g. after an sklearn upgrade.
+import numpy as np
+
+# sklearn versions the compiled scores have been checked against (also pinned in requirement.txt)
+SKLEARN_VERSIONS = ((1, 3), (1, 10))
+
+class CompiledForest:
+    """Flat node arrays for a list of sklearn trees, plus the vectorized traversal."""
+    def __init__(self, trees, features_per_tree=None):
+        """
+        :param trees: The fitted trees' tree_ objects.
+        :param features_per_tree: For bagged feature subsets, the input column of each tree's
+                                  local feature index (IsolationForest.estimators_features_).
+        """
+        offsets = np.cumsum([0] + [tree.node_count for tree in trees])
+        self.roots = offsets[:-1].astype(np.int32)
+        self.n_trees = len(trees)
+        self.max_depth = max(tree.max_depth for tree in trees)
+
+        feature, threshold, left, right, missing_left = [], [], [], [], []
+        for t, tree in enumerate(trees):
+            is_leaf = tree.children_left == -1
+            nodes = np.arange(tree.node_count) + offsets[t]
+            local = np.where(is_leaf, 0, tree.feature)
+            feature.append(local if features_per_tree is None else np.asarray(features_per_tree[t])[local])
+            threshold.append(np.where(is_leaf, 0.0, tree.threshold))
+            # Leaves point to themselves, so rows that reach one early just stay there
+            left.append(np.where(is_leaf, nodes, tree.children_left + offsets[t]))
+            right.append(np.where(is_leaf, nodes, tree.children_right + offsets[t]))
+            missing = getattr(tree, 'missing_go_to_left', None)
+            missing_left.append(np.zeros(tree.node_count, dtype=bool) if missing is None else missing.astype(bool))
+
+        self.feature = np.concatenate(feature).astype(np.int32)
+        # sklearn compares float32 inputs against float64 thresholds. Rounding each threshold down
+        # to the nearest float32 gives the same x <= threshold answers with float32 arithmetic.
+        threshold = np.concatenate(threshold)
+        with np.errstate(over='ignore'):
+            threshold32 = threshold.astype(np.float32)
+        self.threshold = np.where(threshold32.astype(np.float64) > threshold,
+                                  np.nextafter(threshold32, np.float32(-np.inf)), threshold32)
+        # children[2 * node] is the right child and children[2 * node + 1] the left one
+        self.children = np.stack([np.concatenate(right), np.concatenate(left)], axis=1).ravel().astype(np.int32)
+        self.missing_left = np.concatenate(missing_left)
+
+    def apply(self, X, chunk_rows=512):
+        """Returns the leaf each row reaches in each tree, as global node indices of shape (n_rows, n_trees)."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        has_nan = np.isnan(flat).any()
+        leaves = np.empty((n_rows, self.n_trees), dtype=np.int32)
+        # Row chunks keep the (rows x trees) working arrays in cache
+        for start in range(0, n_rows, chunk_rows):
+            stop = min(start + chunk_rows, n_rows)
+            row_offsets = (np.arange(start, stop, dtype=np.int32) * n_features)[:, None]
+            node = np.repeat(self.roots[None, :], stop - start, axis=0)
+            for _ in range(self.max_depth):
+                x = flat.take(row_offsets + self.feature.take(node))
+                go_left = x <= self.threshold.take(node)
+                if has_nan:
+                    go_left = np.where(np.isnan(x), self.missing_left.take(node), go_left)
+                node = self.children.take(2 * node + go_left)
+            leaves[start:stop] = node
+        return leaves
+
+def average_path_length(n_samples):
+    """Expected depth of an unsuccessful search in a binary tree of n_samples, as sklearn computes it."""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros_like(n_samples)
+    lengths[n_samples == 2] = 1.0
+    many = n_samples > 2
+    lengths[many] = 2.0 * (np.log(n_samples[many] - 1.0) + np.euler_gamma) - 2.0 * (n_samples[many] - 1.0) / n_samples[many]
+    return lengths
+
+def node_depths(tree):
+    """Depth of every node of a fitted tree_, counting the root as 1."""
+    depths = np.zeros(tree.node_count, dtype=np.float64)
+    depths[0] = 1.0
+    # Trees store a node before its children
+    for node in range(tree.node_count):
+        if tree.children_left[node] != -1:
+            depths[tree.children_left[node]] = depths[tree.children_right[node]] = depths[node] + 1.0
+    return depths
+
+class CompiledIsolationForest(CompiledForest):
+    """Drop-in replacement for IsolationForest.score_samples and decision_function."""
+    def __init__(self, model):
+        trees = [e.tree_ for e in model.estimators_]
+        # Like sklearn, only remap columns when the trees were fitted on a subset of the features
+        subsampled = len(model.estimators_features_[0]) != model.n_features_in_
+        super().__init__(trees, model.estimators_features_ if subsampled else None)
+        # What every leaf adds to a row's total depth: its own depth plus the expected
+        # depth of the samples it still holds
+        self.leaf_depth = np.concatenate([
+            node_depths(tree) + average_path_length(tree.n_node_samples) - 1.0 for tree in trees
+        ])
+        self.denominator = len(model.estimators_) * average_path_length([model.max_samples_])[0]
+        self.offset = model.offset_
+
+    def score_samples(self, X):
+        # Summed tree by tree in estimator order, like sklearn
+        depths = np.cumsum(self.leaf_depth.take(self.apply(X)), axis=1)[:, -1]
+        if self.denominator == 0:
+            return -np.ones_like(depths)
+        return -(2 ** -(depths / self.denominator))
+
+    def decision_function(self, X):
+        return self.score_samples(X) - self.offset
+
+class CompiledRandomForest(CompiledForest):
+    """Drop-in replacement for RandomForestClassifier.predict_proba and predict."""
+    def __init__(self, model):
+        trees = [e.tree_ for e in model.estimators_]
+        super().__init__(trees)
+        self.classes_ = model.classes_
+        # Class distribution of every node. Current sklearn already stores fractions and uses them
+        # as they are; trees from versions that stored counts are normalised the way those did.
+        values = []
+        for tree in trees:
+            value = tree.value[:, 0, :model.n_classes_].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            if not np.allclose(normalizer[normalizer > 0], 1.0):
+                normalizer[normalizer == 0.0] = 1.0
+                value = value / normalizer
+            values.append(value)
+        self.value = np.concatenate(values)
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        proba = np.zeros((leaves.shape[0], self.value.shape[1]))
+        for t in range(self.n_trees):
+            proba += self.value.take(leaves[:, t], axis=0)
+        return proba / self.n_trees
+
+    def predict(self, X):
+        return self.classes_.take(np.argmax(self.predict_proba(X), axis=1))
+
+def probe_rows(compiled, n_features, rows=256, seed=0):
+    """Rows that reach many different leaves: every value sits just above or below some split of its column."""
+    rng = np.random.default_rng(seed)
+    X = np.zeros((rows, n_features))
+    splits = compiled.children[0::2] != compiled.children[1::2] # not a leaf
+    for column in range(n_features):
+        thresholds = compiled.threshold[splits & (compiled.feature == column)].astype(np.float64)
+        # Splits that only separate missing values have an infinite threshold
+        thresholds = thresholds[np.isfinite(thresholds)]
+        if len(thresholds):
+            values = rng.choice(thresholds, rows)
+            X[:, column] = values + rng.choice([-1e-3, 1e-3], rows) * np.maximum(np.abs(values), 1.0)
+    return X
+
+def compile_forest(model):
+    """
+    Compiles a fitted IsolationForest or RandomForestClassifier; anything else is returned unchanged.
+    So is a forest that fails to compile or whose compiled scores differ from sklearn's.
+    """
+    import warnings
+    import sklearn
+    from sklearn.ensemble import IsolationForest, RandomForestClassifier
+
+    if isinstance(model, IsolationForest):
+        compiler, method = CompiledIsolationForest, 'score_samples'
+    elif isinstance(model, RandomForestClassifier) and model.n_outputs_ == 1:
+        compiler, method = CompiledRandomForest, 'predict_proba'
+    else:
+        return model
+
+    name = type(model).__name__
+    version = tuple(int(part) for part in sklearn.__version__.split('.')[:2] if part.isdigit())
+    if not SKLEARN_VERSIONS[0] <= version < SKLEARN_VERSIONS[1]:
+        print(f"scikit-learn {sklearn.__version__} is outside the versions the forest compiler supports; "
+              f"scoring the {name} with scikit-learn.")
+        return model
+    try:
+        compiled = compiler(model)
+        X = probe_rows(compiled, model.n_features_in_)
+        with warnings.catch_warnings():
+            # Fitted on a DataFrame; a plain matrix in the same column order is equivalent
+            warnings.simplefilter("ignore", UserWarning)
+            expected = getattr(model, method)(X)
+        matches = np.array_equal(getattr(compiled, method)(X), expected)
+    except Exception as e:
+        print(f"Could not compile the {name} ({type(e).__name__}: {e}); scoring it with scikit-learn.")
+        return model
+    if not matches:
+        print(f"Compiled {name} scores differ from scikit-learn's; scoring it with scikit-learn.")
+        return model
+    return compiled
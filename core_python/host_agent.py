@@ -96,63 +96,57 @@
 
 # host_agent.py (Corrected Version)
 import psutil
+import socket
 import time
 import json
 import requests
+from transport import BatchSender
+from process_collector import ProcessCollector
+from process_table import ProcessDeltaEncoder
 
 class HostAgent:
-    def __init__(self, backend_url, collection_interval=2): # Shortened interval for faster updates
+    def __init__(self, backend_url, collection_interval=2, host_id=None): # Shortened interval for faster updates
         self.backend_url = backend_url
+        # Sent with every snapshot so the dashboard can tell hosts apart
+        self.host_id = host_id or socket.gethostname()
         self.interval = collection_interval
+        # One snapshot per tick, so flush every record but reuse one keep-alive connection.
+        # No spool: the next snapshot supersedes one the server missed, and a missed process
+        # delta is made good by the next keyframe, while replaying old ones would overwrite newer state.
+        self.sender = BatchSender(backend_url, batch_size=1, flush_interval=collection_interval)
+        # Keeps a handle per process across ticks, so CPU usage is measured since the last tick without sleeping
+        self.collector = ProcessCollector(all_processes=True)
+        # Sends the process table as deltas (started, exited, moved by 1% CPU or 0.5% memory), whole every 30 ticks
+        self.process_encoder = ProcessDeltaEncoder(cpu_threshold=1.0, memory_threshold=0.5, keyframe_every=30)
 
     def get_system_metrics(self):
         """
         Collects system metrics in the exact structure expected by the backend.
         """
-        cpu_usage = psutil.cpu_percent(interval=1)
+        # System and per-process CPU usage since the previous tick
+        cpu_usage, processes = self.collector.collect()
         memory_info = psutil.virtual_memory()
         load_avg_1m = psutil.getloadavg()[0]
 
-        # Get top 5 processes by CPU usage
-        processes = []
-        # The cpu_percent call for processes needs a non-zero interval on the first run
-        for proc in psutil.process_iter(['pid', 'name', 'cpu_percent', 'memory_percent']):
-            try:
-                proc.cpu_percent(interval=0.01) 
-                pinfo = proc.as_dict(attrs=['pid', 'name', 'cpu_percent', 'memory_percent'])
-                processes.append(pinfo)
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
-        
-        # Sort by cpu_percent and take the top 15
-        top_processes = sorted(processes, key=lambda p: p['cpu_percent'], reverse=True)[:15]
-
         # Build the payload with the correct type, keys, and structure
         metrics_payload = {
             "type": "system_metrics",          
+            "host_id": self.host_id,
+            # When the snapshot was taken; the server ignores snapshots older than the one it holds
+            "timestamp": time.time(),
             "metrics": {                        
                 "cpu_usage": cpu_usage,         
                 "memory_usage": memory_info.percent, 
                 "cpu_load": load_avg_1m,        
-                "top_processes": top_processes
+                # The server rebuilds the table and picks the top processes for the dashboard
+                "processes": self.process_encoder.encode(processes)
             }
         }
         return metrics_payload
 
     def send_data(self, data):
         """Sends collected data to the backend server."""
-        try:
-            response = requests.post(self.backend_url, json=data)
-            response.raise_for_status()
-            # More informative print statement
-            print(f"Data sent successfully (Type: {data.get('type')}).")
-             # this line is to show the result on the terminal window
-            # print("--- Collected Host Metrics ---")
-            # print(json.dumps(data, indent=4))
-            # print("----------------------------\n")
-
-        except requests.exceptions.RequestException as e:
-            print(f"Error sending host data to backend: {e}")
+        self.sender.send(data)
 
     def run(self):
         """Runs the agent in a continuous loop."""
@@ -168,6 +162,8 @@ class HostAgent:
             except Exception as e:
                 print(f"An error occurred: {e}")
                 time.sleep(self.interval)
+        self.sender.close()
+        print("Sender: " + ", ".join(f"{name}={count}" for name, count in self.sender.stats().items()))
         print("Host Agent stopped.")
 
 if __name__ == '__main__':
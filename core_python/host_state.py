@@ -0,0 +1,210 @@
+# host_state.py
+# Per-agent state on the server, keyed by the host_id the agents send. Hosts
+# are spread over shards by a hash of their ID, each shard with its own lock,
+# so agents posting at the same time rarely wait on each other. A rates
+# thread turns each host's byte counters into per-second rates once an
+# interval and hands them, with the total over all hosts, to a callback
+# (the broadcast scheduler).
+import threading
+import time
+from process_table import ProcessTable
+
+DEFAULT_HOST = 'default' # host_id of records from agents that don't send one
+
+class HostState:
+    __slots__ = (
+        'host_id', 'first_seen', 'last_seen', 'metrics', 'metrics_time', 'metrics_stamp', 'records', 'flow_records',
+        'bytes_sent', 'bytes_received', 'pending_sent', 'pending_received', 'sent_rate', 'received_rate',
+        'processes',
+    )
+
+    def __init__(self, host_id, now):
+        self.host_id = host_id
+        self.first_seen = self.last_seen = now
+        self.metrics = None # the last system_metrics payload
+        self.metrics_time = None
+        self.metrics_stamp = None # the agent's timestamp of that payload, if it sent one
+        self.records = 0
+        self.flow_records = 0
+        self.bytes_sent = self.bytes_received = 0 # totals since first seen
+        self.pending_sent = self.pending_received = 0 # since the last rate computation
+        self.sent_rate = self.received_rate = 0.0
+        self.processes = None # ProcessTable, for agents that send process deltas
+
+    def summary(self, now, online_after):
+        return {
+            'host_id': self.host_id,
+            'online': now - self.last_seen < online_after,
+            'last_seen': self.last_seen,
+            'records': self.records,
+            'sent_rate': self.sent_rate,
+            'received_rate': self.received_rate,
+            'cpu_usage': self.metrics.get('cpu_usage') if self.metrics else None,
+            'memory_usage': self.metrics.get('memory_usage') if self.metrics else None,
+        }
+
+class HostShard:
+    __slots__ = ('lock', 'hosts')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+class HostRegistry:
+    def __init__(self, shards=16, rate_interval=1.0, on_rates=None, online_after=10.0, expire_after=3600.0,
+                 on_expire=None):
+        """
+        :param shards: Number of independently locked host tables.
+        :param rate_interval: Seconds between rate computations.
+        :param on_rates: Called after each computation as on_rates(rates, total), where rates maps
+                         host_id to {'sent': B/s, 'received': B/s} for hosts that sent traffic.
+        :param online_after: A host counts as online if it was heard from within this many seconds.
+        :param expire_after: Hosts silent for this long are forgotten.
+        :param on_expire: Called with the list of host_ids a computation forgot, if any.
+        """
+        self._shards = [HostShard() for _ in range(shards)]
+        self.rate_interval = rate_interval
+        self.on_rates = on_rates
+        self.online_after = online_after
+        self.expire_after = expire_after
+        self.on_expire = on_expire
+        self._last_rates = time.time()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _shard(self, host_id):
+        return self._shards[hash(host_id) % len(self._shards)]
+
+    def _host(self, shard, host_id, now):
+        """The host's state, created on first contact; call with the shard's lock held."""
+        state = shard.hosts.get(host_id)
+        if state is None:
+            state = shard.hosts[host_id] = HostState(host_id, now)
+        state.last_seen = now
+        state.records += 1
+        return state
+
+    def update_metrics(self, host_id, metrics, now=None, top_k=15, timestamp=None):
+        """
+        Stores a host's latest system_metrics payload and returns it. A payload carrying a process
+        delta ('processes') is applied to the host's process table and returned with the table's
+        top_k processes as 'top_processes' instead, the shape agents used to send.
+        timestamp is when the agent took the snapshot; a snapshot no newer than the one held
+        (a late or replayed one) is ignored and None returned.
+        """
+        now = time.time() if now is None else now
+        shard = self._shard(host_id)
+        with shard.lock:
+            state = self._host(shard, host_id, now)
+            if timestamp is not None:
+                if state.metrics_stamp is not None and timestamp <= state.metrics_stamp:
+                    return None
+                state.metrics_stamp = timestamp
+            if 'processes' in metrics:
+                if state.processes is None:
+                    state.processes = ProcessTable()
+                state.processes.apply(metrics['processes'])
+                metrics = {key: value for key, value in metrics.items() if key != 'processes'}
+                metrics['top_processes'] = state.processes.top(top_k)
+            state.metrics = metrics
+            state.metrics_time = now
+        return metrics
+
+    def add_traffic(self, host_id, sent, received, now=None):
+        """Counts the bytes of one network_flow record from a host."""
+        now = time.time() if now is None else now
+        shard = self._shard(host_id)
+        with shard.lock:
+            state = self._host(shard, host_id, now)
+            state.flow_records += 1
+            state.bytes_sent += sent
+            state.bytes_received += received
+            state.pending_sent += sent
+            state.pending_received += received
+
+    def compute_rates(self, now=None):
+        """
+        Turns the bytes counted since the last call into per-second rates, one shard at a
+        time, and drops hosts silent for expire_after. Returns (rates by host, total).
+        """
+        now = time.time() if now is None else now
+        elapsed = max(now - self._last_rates, 1e-6)
+        self._last_rates = now
+        rates = {}
+        total = {'sent': 0.0, 'received': 0.0}
+        expired = []
+        for shard in self._shards:
+            with shard.lock:
+                for host_id, state in list(shard.hosts.items()):
+                    if now - state.last_seen >= self.expire_after:
+                        del shard.hosts[host_id]
+                        expired.append(host_id)
+                        continue
+                    state.sent_rate = state.pending_sent / elapsed
+                    state.received_rate = state.pending_received / elapsed
+                    state.pending_sent = state.pending_received = 0
+                    if state.flow_records:
+                        rates[host_id] = {'sent': state.sent_rate, 'received': state.received_rate}
+                        total['sent'] += state.sent_rate
+                        total['received'] += state.received_rate
+        if expired and self.on_expire is not None:
+            self.on_expire(expired)
+        return rates, total
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.rate_interval):
+            try:
+                rates, total = self.compute_rates()
+                if self.on_rates is not None:
+                    self.on_rates(rates, total)
+            except Exception as e:
+                print(f"Error computing host rates: {e}")
+
+    def hosts(self, now=None):
+        """Summary of every known host, sorted by host_id."""
+        now = time.time() if now is None else now
+        summaries = []
+        for shard in self._shards:
+            with shard.lock:
+                summaries.extend(state.summary(now, self.online_after) for state in shard.hosts.values())
+        return sorted(summaries, key=lambda summary: summary['host_id'])
+
+    def host(self, host_id, now=None):
+        """Everything known about one host, or None if it is unknown."""
+        now = time.time() if now is None else now
+        shard = self._shard(host_id)
+        with shard.lock:
+            state = shard.hosts.get(host_id)
+            if state is None:
+                return None
+            snapshot = state.summary(now, self.online_after)
+            snapshot.update({
+                'first_seen': state.first_seen,
+                'flow_records': state.flow_records,
+                'bytes_sent': state.bytes_sent,
+                'bytes_received': state.bytes_received,
+                'metrics': state.metrics,
+                'metrics_time': state.metrics_time,
+            })
+        return snapshot
+
+    def processes(self, host_id):
+        """The host's rebuilt process table, or None if the host is unknown or doesn't send one."""
+        shard = self._shard(host_id)
+        with shard.lock:
+            state = shard.hosts.get(host_id)
+            if state is None or state.processes is None:
+                return None
+            return state.processes.snapshot()
+
+    def __len__(self):
+        return sum(len(shard.hosts) for shard in self._shards)
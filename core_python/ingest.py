@@ -0,0 +1,132 @@
+# ingest.py
+# Server-side ingest path. The HTTP handlers only validate records and put
+# them on a bounded queue; consumer threads take them off in micro-batches,
+# update the dashboard and run threat detection through an offload callable,
+# so model inference never runs inside a request handler.
+#
+# Under eventlet the consumers are green threads and the offload callable is
+# eventlet.tpool.execute, which runs detection on a native thread while the
+# hub keeps serving requests and Socket.IO clients.
+import threading
+import time
+from collections import deque
+
+class IngestPipeline:
+    def __init__(self, on_record, detect_batch=None, on_alerts=None, offload=None, workers=2, max_queue=100000,
+                 max_batch_size=256, max_delay=0.005):
+        """
+        :param on_record: Called with every record (dashboard updates); must be cheap.
+        :param detect_batch: Takes a list of network_flow records, returns a list of alert lists.
+                             None disables detection.
+        :param on_alerts: Called as on_alerts(record, alerts) for each record that raised alerts.
+        :param offload: Runs detect_batch, as offload(detect_batch, records); by default it is called directly.
+        :param workers: Consumer threads; each can have one detection batch in flight.
+        :param max_queue: Records waiting for a consumer before submit() starts refusing batches.
+        :param max_batch_size: Records taken off the queue per batch.
+        :param max_delay: How long a partial batch waits for more records (seconds).
+        """
+        self.on_record = on_record
+        self.detect_batch = detect_batch
+        self.on_alerts = on_alerts
+        self.offload = offload or (lambda fn, *args: fn(*args))
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.counters = {'received': 0, 'rejected': 0, 'processed': 0, 'detected': 0, 'alerts': 0, 'batches': 0}
+        self._queue = deque()
+        self._oldest = 0.0
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._threads = []
+
+    def start(self):
+        for _ in range(self.workers):
+            thread = threading.Thread(target=self._run, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        """Processes what is still queued, then stops the consumers."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def submit(self, records):
+        """
+        Queues a list of validated records. Returns False, queuing nothing, when the
+        queue has no room for them, so the caller can tell the agent to back off.
+        """
+        with self._cond:
+            if len(self._queue) + len(records) > self.max_queue:
+                self.counters['rejected'] += len(records)
+                return False
+            if not self._queue:
+                self._oldest = time.monotonic()
+            self._queue.extend(records)
+            self.counters['received'] += len(records)
+            self._cond.notify()
+        return True
+
+    def stats(self):
+        """Counters for records received, rejected, processed and scored, plus the queue depth."""
+        with self._cond:
+            stats = dict(self.counters)
+            stats['queue_depth'] = len(self._queue)
+        return stats
+
+    def _next_batch(self):
+        """Blocks until a batch is due; returns None once stopped and drained."""
+        with self._cond:
+            while not self._queue and not self._stopped:
+                self._cond.wait()
+            deadline = self._oldest + self.max_delay
+            while len(self._queue) < self.max_batch_size and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if not self._queue:
+                return None
+            count = min(self.max_batch_size, len(self._queue))
+            batch = [self._queue.popleft() for _ in range(count)]
+            if self._queue:
+                # The rest already waited; let the next consumer take it right away
+                self._oldest = time.monotonic() - self.max_delay
+                self._cond.notify()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            flows = []
+            for record in batch:
+                try:
+                    self.on_record(record)
+                except Exception as e:
+                    print(f"Error handling record: {e}")
+                    continue
+                if record.get('type') == 'network_flow':
+                    flows.append(record)
+
+            alerted = 0
+            if flows and self.detect_batch is not None:
+                try:
+                    results = self.offload(self.detect_batch, flows)
+                except Exception as e:
+                    print(f"Error during batch detection: {e}")
+                    results = []
+                for record, alerts in zip(flows, results):
+                    if alerts:
+                        alerted += len(alerts)
+                        self.on_alerts(record, alerts)
+
+            with self._cond:
+                self.counters['processed'] += len(batch)
+                self.counters['detected'] += len(flows) if self.detect_batch is not None else 0
+                self.counters['alerts'] += alerted
+                self.counters['batches'] += 1
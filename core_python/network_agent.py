@@ -130,137 +130,375 @@
 #         print("Network Agent stopped.")
 
 import scapy.all as scapy
-from collections import defaultdict
 import time
 import json
 import requests
 import threading
+import argparse
+import socket
+from flow_table import FlowTable, FlowRecord, TCP_FIN, TCP_RST
+from packet_capture import parse_frame, replay_pcap, RawSocketCapture, LINKTYPE_ETHERNET
+from flow_features import CicFlowStats
+from capture_pipeline import CapturePipeline
+from transport import BatchSender
 
 class TrafficAnalyzer:
-    def __init__(self):
-        self.flow_stats = defaultdict(lambda: {
-            'packet_count': 0,
-            'byte_count': 0,
-            'start_time': 0,
-            'last_time': 0,
-            'src_bytes': 0,
-            'dst_bytes': 0,
-            'flags': defaultdict(int)
-        })
+    def __init__(self, idle_timeout=15.0, active_timeout=60.0, emit_every=1000, max_flows=100000, on_expire=None,
+                 cic_features=True, linger=5.0):
+        """
+        Flows are reported once per flow event instead of once per packet:
+        on RST or once both sides sent FIN and the last FIN was acknowledged
+        (closed flows absorb trailing packets for linger seconds), after
+        idle_timeout seconds without packets, every
+        active_timeout seconds for long-lived flows, or every emit_every packets.
+        At most max_flows flows are tracked; on_expire(features) receives the
+        final record of every flow evicted by a timeout or by the capacity cap.
+        With cic_features, records also carry the signature model's CIC-IDS2017 features.
+        """
+        self.cic_features = cic_features
+        self.active_timeout = active_timeout
+        self.emit_every = emit_every
+        self.on_expire = on_expire
+        self.flow_stats = FlowTable(
+            new_flow=FlowRecord,
+            on_expire=self.flow_expired,
+            max_flows=max_flows,
+            idle_timeout=idle_timeout,
+            linger=linger
+        )
+        # The sniff thread updates flows while the agent's timer thread expires them
+        self.lock = threading.Lock()
 
     def analyze_packet(self, packet):
+        """Updates the packet's flow and returns a feature dict only when the flow is due to be reported."""
         if not (packet.haslayer(scapy.IP) and packet.haslayer(scapy.TCP)):
             return None
 
         ip_layer = packet[scapy.IP]
         # CHANGE 1: Correctly extract the TCP layer
         tcp_layer = packet[scapy.TCP]
+        header_len = tcp_layer.dataofs * 4
+        payload_len = max(0, ip_layer.len - ip_layer.ihl * 4 - header_len)
+        return self.update(ip_layer.src, tcp_layer.sport, ip_layer.dst, tcp_layer.dport,
+                           len(packet), int(tcp_layer.flags), float(packet.time), payload_len, header_len)
 
-        # Define flow key (sorted to handle both directions)
-        flow_key_part1 = (ip_layer.src, tcp_layer.sport)
-        flow_key_part2 = (ip_layer.dst, tcp_layer.dport)
-        flow_key = tuple(sorted((flow_key_part1, flow_key_part2)))
+    def analyze_frame(self, frame, timestamp, linktype=LINKTYPE_ETHERNET):
+        """Same as analyze_packet for a raw frame, parsing only the headers the flow table needs."""
+        fields = parse_frame(frame, linktype)
+        if fields is None:
+            return None
+        src, sport, dst, dport, length, flags, payload_len, header_len = fields
+        return self.update(src, sport, dst, dport, length, flags, timestamp, payload_len, header_len)
 
-        stats = self.flow_stats[flow_key]
+    def update(self, src, sport, dst, dport, length, flags, timestamp, payload_len=0, header_len=0):
+        """
+        Flow update for one already-parsed TCP/IPv4 packet; flags is the TCP flags byte,
+        payload_len and header_len the TCP payload and header sizes (CIC features only).
+        Returns a feature dict when the flow is due to be reported, otherwise None.
+        """
+        # Define flow key (sorted to handle both directions); a flat tuple hashes faster than nested pairs
+        from_src = src < dst or (src == dst and sport <= dport)
+        flow_key = (src, sport, dst, dport) if from_src else (dst, dport, src, sport)
 
-        # Update flow statistics
-        if stats['packet_count'] == 0:
-            stats['start_time'] = packet.time
-        stats['last_time'] = packet.time
-        stats['packet_count'] += 1
-        stats['byte_count'] += len(packet)
+        with self.lock:
+            # Late packets of a teardown must not open a one-packet flow of their own
+            if self.flow_stats.closed and self.flow_stats.absorbs(flow_key, flags, timestamp):
+                return None
+            stats = self.flow_stats.touch(flow_key)
+            # CHANGE 2: Correct the logic for directional byte counts
+            stats.add_packet(length, flags, timestamp, from_src)
+            if self.cic_features:
+                if stats.cic is None:
+                    # The first packet seen decides which direction is forward
+                    stats.cic = CicFlowStats(from_src, dport)
+                stats.cic.add(payload_len, header_len, flags, timestamp, from_src)
 
-        # CHANGE 2: Correct the logic for directional byte counts
-        if (ip_layer.src, tcp_layer.sport) == flow_key[0]:
-            stats['src_bytes'] += len(packet)
-        else:
-            stats['dst_bytes'] += len(packet)
-        
-        # TCP Flags
-        for flag in tcp_layer.flags.flagrepr():
-            stats['flags'][flag] += 1
-            
-        return self.extract_features(packet, stats, flow_key)
+            # Emission policy: closed flows are final, long-lived flows report periodically
+            if flags & TCP_RST:
+                reason = 'rst'
+            elif stats.fin_directions == 3 and not flags & TCP_FIN:
+                # Both sides sent FIN and this is the ACK after the last one: the teardown is complete
+                reason = 'fin'
+            elif stats.packet_count % self.emit_every == 0:
+                reason = 'packets'
+            elif timestamp - stats.last_emit_time >= self.active_timeout:
+                reason = 'active_timeout'
+            else:
+                return None
+
+            features = self.extract_features(length, stats, flow_key, reason)
+            if reason in ('rst', 'fin'):
+                self.flow_stats.close(flow_key, timestamp)
+            return features
+
+    def expire_flows(self, now=None):
+        """
+        Evicts flows that have been idle for idle_timeout; each one's final record
+        goes to on_expire. Busy flows hit their active timeout in analyze_packet.
+        """
+        now = time.time() if now is None else now
+        with self.lock:
+            return self.flow_stats.expire_idle(now)
+
+    def flow_expired(self, flow_key, stats, reason):
+        # Flows whose packets were all reported already have nothing new to say
+        if self.on_expire and stats.packet_count > stats.emitted_packets:
+            self.on_expire(self.extract_features(0, stats, flow_key, reason))
 
-    def extract_features(self, packet, stats, flow_key):
-        flow_duration = stats['last_time'] - stats['start_time']
+    def metrics(self):
+        """Flow table size and eviction counters."""
+        with self.lock:
+            return self.flow_stats.metrics()
+
+    def extract_features(self, length, stats, flow_key, reason):
+        flow_duration = stats.last_time - stats.start_time
         if flow_duration == 0:
             flow_duration = 1e-6 # Avoid division by zero
+        initiator, responder = (flow_key[:2], flow_key[2:]) if stats.initiator_from_src else (flow_key[2:], flow_key[:2])
 
         features = {
             # CHANGE 3: Make the flow_key readable
-            "flow_key": f"{flow_key[0][0]}:{flow_key[0][1]}-{flow_key[1][0]}:{flow_key[1][1]}",
+            "flow_key": f"{flow_key[0]}:{flow_key[1]}-{flow_key[2]}:{flow_key[3]}",
             
             # CHANGE 4: Add the packet length ('len') for the server to use
-            "len": len(packet),
+            "len": length,
             
             "flow_duration": flow_duration,
-            "packet_count": stats['packet_count'],
-            "byte_count": stats['byte_count'],
-            "packet_rate": stats['packet_count'] / flow_duration,
-            "byte_rate": stats['byte_count'] / flow_duration,
-            "src_bytes": stats['src_bytes'],
-            "dst_bytes": stats['dst_bytes'],
-            "syn_flag_count": stats['flags'].get('S', 0),
-            "fin_flag_count": stats['flags'].get('F', 0),
-            "rst_flag_count": stats['flags'].get('R', 0),
-            "ack_flag_count": stats['flags'].get('A', 0),
+            "packet_count": stats.packet_count,
+            "byte_count": stats.byte_count,
+            "packet_rate": stats.packet_count / flow_duration,
+            "byte_rate": stats.byte_count / flow_duration,
+            "src_bytes": stats.src_bytes,
+            "dst_bytes": stats.dst_bytes,
+            "syn_flag_count": stats.syn_count,
+            "fin_flag_count": stats.fin_count,
+            "rst_flag_count": stats.rst_count,
+            "ack_flag_count": stats.ack_count,
+
+            # Who opened the flow (sender of its first packet) and who it was opened to
+            "src_ip": initiator[0],
+            "src_port": initiator[1],
+            "dst_ip": responder[0],
+            "dst_port": responder[1],
+
+            # The flow's first record, for a flow whose opening packet was captured
+            "new_flow": stats.emitted_packets == 0 and stats.opened_here(),
+
+            # Why this record was emitted, and the bytes seen since the flow's previous record
+            "emit_reason": reason,
+            "src_bytes_delta": stats.src_bytes - stats.emitted_src_bytes,
+            "dst_bytes_delta": stats.dst_bytes - stats.emitted_dst_bytes,
         }
+        if stats.cic is not None:
+            # In flow_features.CIC_FEATURES order, for the signature model
+            features["cic_features"] = stats.cic.features()
+
+        stats.last_emit_time = stats.last_time
+        stats.emitted_packets = stats.packet_count
+        stats.emitted_src_bytes = stats.src_bytes
+        stats.emitted_dst_bytes = stats.dst_bytes
         return features
 
 class NetworkAgent:
-    def __init__(self, backend_url, interface=None):
+    def __init__(self, backend_url, interface=None, expire_interval=1.0, metrics_interval=60.0, capture_mode='scapy',
+                 pcap_path=None, replay_speed=0.0, workers=1, overflow_policy='drop_oldest', spool_dir='spool/network',
+                 host_id=None):
+        """
+        :param capture_mode: 'scapy' dissects every packet with scapy.sniff; 'raw' reads
+                             frames from an AF_PACKET socket and parses only the headers.
+        :param pcap_path: Replay this capture file instead of sniffing an interface.
+        :param replay_speed: 0 replays as fast as possible, 1.0 at the original timing.
+        :param workers: More than 1 shards the flow table over that many worker processes
+                        (raw capture or pcap replay only).
+        :param overflow_policy: What the sender does with records when its queue is full
+                                ('drop_oldest', 'sample' or 'spill'); capture never waits on the network.
+        :param spool_dir: Batches the server does not accept are kept here and replayed once it is back.
+        :param host_id: Name this agent's records carry, so the dashboard can tell hosts apart
+                        (default: the hostname).
+        """
+        self.host_id = host_id or socket.gethostname()
+        self.workers = workers
+        self.pipeline = None
         self.backend_url = backend_url
         self.interface = interface
-        self.analyzer = TrafficAnalyzer()
+        self.capture_mode = capture_mode
+        self.pcap_path = pcap_path
+        self.replay_speed = replay_speed
+        # Flows evicted by a timeout or the table's capacity cap are reported through send_features
+        self.analyzer = TrafficAnalyzer(on_expire=self.send_features)
         self.stop_sniffing = threading.Event()
+        # Set once start() has returned, i.e. the capture and (with workers) every shard has flushed
+        self.capture_done = threading.Event()
+        # Records are queued and posted in compressed batches by a background thread over a keep-alive session
+        self.sender = BatchSender(backend_url, batch_size=500, flush_interval=1.0, overflow_policy=overflow_policy,
+                                  spool_dir=spool_dir)
+        # Idle timeouts are checked on a timer, since quiet flows get no packet callback
+        self.expire_interval = expire_interval
+        self.metrics_interval = metrics_interval
+        self.expire_thread = threading.Thread(target=self.expire_loop, daemon=True)
 
     def packet_callback(self, packet):
         features = self.analyzer.analyze_packet(packet)
         if features:
-            # CHANGE 5: Send the data in the correct flat format that app.py expects
-            data_to_send = {
-                "timestamp": time.time(),
-                "type": "network_flow",
-                **features
-            }
-            self.send_data(data_to_send)
+            self.send_features(features)
+
+    def frame_callback(self, timestamp, frame, linktype):
+        features = self.analyzer.analyze_frame(frame, timestamp, linktype)
+        if features:
+            self.send_features(features)
+
+    def send_features(self, features):
+        # CHANGE 5: Send the data in the correct flat format that app.py expects
+        data_to_send = {
+            "timestamp": time.time(),
+            "type": "network_flow",
+            "host_id": self.host_id,
+            **features
+        }
+        self.send_data(data_to_send)
+
+    def expire_loop(self):
+        last_report = time.time()
+        while not self.stop_sniffing.wait(self.expire_interval):
+            self.analyzer.expire_flows()
+            if time.time() - last_report >= self.metrics_interval:
+                self.print_metrics()
+                last_report = time.time()
+
+    def print_metrics(self):
+        if self.pipeline is not None:
+            shards = sorted(self.pipeline.shard_metrics, key=lambda m: m['shard'])
+        else:
+            shards = [self.analyzer.metrics()]
+        for metrics in shards:
+            evictions = ", ".join(f"{reason}={count}" for reason, count in metrics['evictions'].items())
+            label = f"Flow table shard {metrics['shard']}" if 'shard' in metrics else "Flow table"
+            print(f"{label}: {metrics['size']}/{metrics['capacity']} flows, "
+                  f"{metrics['flows_created']} created, evictions: {evictions}")
+        print("Sender: " + ", ".join(f"{name}={count}" for name, count in self.sender.stats().items()))
     
     def send_data(self, data):
-        try:
-            response = requests.post(self.backend_url, json=data)
-            response.raise_for_status()
-            print(f"Data sent successfully (Type: {data['type']}).")
-            # # For development, we print the JSON data
-            # print("--- Extracted Network Features ---")
-            # print(json.dumps(data, indent=4))
-#           # print("--------------------------------\n")
-        except requests.exceptions.RequestException as e:
-            print(f"Error sending network data to backend: {e}")
+        # Never blocks: the sender's background thread does the HTTP work
+        self.sender.send(data)
+
+    def replay(self):
+        """Feeds a pcap file through the analyzer and sender, expiring flows on the capture's own clock."""
+        print(f"Network Agent replaying '{self.pcap_path}' at {'full speed' if self.replay_speed <= 0 else f'{self.replay_speed}x'}.")
+        packets = 0
+        last_expiry = None
+        started = time.perf_counter()
+        for timestamp, frame, linktype in replay_pcap(self.pcap_path, self.replay_speed, self.stop_sniffing):
+            self.frame_callback(timestamp, frame, linktype)
+            packets += 1
+            if last_expiry is None:
+                last_expiry = timestamp
+            elif timestamp - last_expiry >= self.expire_interval:
+                self.analyzer.expire_flows(now=timestamp)
+                last_expiry = timestamp
+        elapsed = time.perf_counter() - started
+        print(f"Replayed {packets} packets in {elapsed:.2f}s ({packets / max(elapsed, 1e-9):,.0f} packets/s).")
+
+    def run_pipeline(self):
+        """Capture in this process and analyze in self.workers sharded worker processes."""
+        self.pipeline = CapturePipeline(on_record=self.send_features, workers=self.workers)
+        if self.pcap_path:
+            print(f"Network Agent replaying '{self.pcap_path}' across {self.workers} worker processes.")
+            frames, live = replay_pcap(self.pcap_path, self.replay_speed, self.stop_sniffing), False
+        else:
+            print(f"Network Agent started sniffing on interface {self.interface or 'default'} "
+                  f"across {self.workers} worker processes. Press Ctrl+C to stop.")
+            # Wakes up as often as the pipeline hands over partial batches, even on a quiet link
+            capture = RawSocketCapture(self.interface, poll_timeout=self.pipeline.max_delay)
+            frames, live = capture.frames(self.stop_sniffing, idle_ticks=True), True
+        elapsed = self.pipeline.run(frames, live=live)
+        packets = self.pipeline.captured
+        print(f"Processed {packets} packets in {elapsed:.2f}s ({packets / max(elapsed, 1e-9):,.0f} packets/s).")
 
     def start(self):
-        print(f"Network Agent started sniffing on interface {self.interface or 'default'}. Press Ctrl+C to stop.")
         try:
-            scapy.sniff(iface=self.interface, prn=self.packet_callback, store=False, stop_filter=lambda p: self.stop_sniffing.is_set())
+            self.capture()
+        finally:
+            self.capture_done.set()
+
+    def capture(self):
+        if self.workers > 1 and self.capture_mode == 'scapy' and not self.pcap_path:
+            print("Multi-process capture reads raw frames; switching to --capture raw.")
+            self.capture_mode = 'raw'
+        if self.workers > 1:
+            try:
+                self.run_pipeline()
+            except (OSError, ValueError, RuntimeError) as e:
+                print(f"An error occurred during capture: {e}")
+            return
+
+        if self.pcap_path:
+            # Replays keep the capture's timestamps, so expiry is driven by replay() instead of the wall-clock timer
+            try:
+                self.replay()
+            except (OSError, ValueError) as e:
+                print(f"An error occurred during replay: {e}")
+            return
+
+        print(f"Network Agent started sniffing on interface {self.interface or 'default'} ({self.capture_mode} capture). Press Ctrl+C to stop.")
+        self.expire_thread.start()
+        try:
+            if self.capture_mode == 'raw':
+                capture = RawSocketCapture(self.interface)
+                try:
+                    for timestamp, frame, linktype in capture.frames(self.stop_sniffing):
+                        self.frame_callback(timestamp, frame, linktype)
+                finally:
+                    capture.close()
+            else:
+                scapy.sniff(iface=self.interface, prn=self.packet_callback, store=False, stop_filter=lambda p: self.stop_sniffing.is_set())
         except Exception as e:
             print(f"An error occurred during sniffing: {e}")
 
-    def stop(self):
+    def stop(self, wait=False):
+        """Stops the capture and flushes every flow still open; with wait, first waits for start() to return."""
         print("\nStopping Network Agent...")
         self.stop_sniffing.set()
+        # With worker processes, the shards' final records arrive while the pipeline winds down
+        if wait:
+            self.capture_done.wait()
+        # Report whatever is still in the flow table before closing the sender
+        self.analyzer.expire_flows(now=float('inf'))
+        self.sender.close()
+        self.print_metrics()
 
 if __name__ == '__main__':
-    BACKEND_API_URL = "http://127.0.0.1:5000/api/data"
-    agent = NetworkAgent(backend_url=BACKEND_API_URL)
+    parser = argparse.ArgumentParser(description="SMARTSEC network agent")
+    parser.add_argument('--url', default="http://127.0.0.1:5000/api/data", help="Server's /api/data endpoint")
+    parser.add_argument('--iface', default=None, help="Interface to sniff (default: scapy's default)")
+    parser.add_argument('--capture', choices=['scapy', 'raw'], default='scapy',
+                        help="'raw' parses headers from an AF_PACKET socket instead of full Scapy dissection")
+    parser.add_argument('--pcap', default=None, help="Replay a pcap file instead of sniffing a live interface")
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help="Replay speed: 0 = as fast as possible (default), 1.0 = original timing")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Shard flows over this many worker processes (needs --capture raw or --pcap)")
+    parser.add_argument('--overflow', choices=['drop_oldest', 'sample', 'spill'], default='drop_oldest',
+                        help="What to do with records when the send queue is full")
+    parser.add_argument('--spool-dir', default='spool/network',
+                        help="Where batches are kept while the server is unreachable")
+    parser.add_argument('--host-id', default=None, help="Host name sent with every record (default: the hostname)")
+    args = parser.parse_args()
+
+    agent = NetworkAgent(backend_url=args.url, interface=args.iface, capture_mode=args.capture,
+                         pcap_path=args.pcap, replay_speed=args.speed, workers=args.workers,
+                         overflow_policy=args.overflow, spool_dir=args.spool_dir, host_id=args.host_id)
     
     # Run sniffing in a separate thread to allow for graceful shutdown
     sniff_thread = threading.Thread(target=agent.start)
     sniff_thread.start()
 
     try:
-        while sniff_thread.is_alive():
-            sniff_thread.join(1)
+        # Not sniff_thread.join(): a join interrupted by Ctrl+C can report a running thread as finished
+        while not agent.capture_done.wait(1):
+            pass
     except KeyboardInterrupt:
-        agent.stop()
-        sniff_thread.join()
-        print("Network Agent stopped.")
+        pass
+    # A finished replay also ends up here, so the remaining flows get flushed either way
+    agent.stop(wait=True)
+    sniff_thread.join()
+    print("Network Agent stopped.")
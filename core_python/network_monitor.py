@@ -7,13 +7,10 @@
 import psutil
 import time
 import os
+from binlog import BinaryLogWriter
 
-# Make sure 'logs' folder exists
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-# Open a log file to write
-log_file = open('logs/network_log.txt', 'a')
+# One fixed-size binary record per reading in logs/network (read with: python binlog.py dump logs/network)
+log = BinaryLogWriter(os.path.join('logs', 'network'), 'network', flush_records=12, flush_interval=60.0)
 
 print("Network monitoring started... (Press Ctrl+C to stop)")
 
@@ -22,25 +19,21 @@ try:
         # Get network IO statistics
         net_io = psutil.net_io_counters()
 
-        # Format the log entry
-        log_entry = (
+        # Print to console
+        #network load over time
+        print(
             f"Bytes Sent: {net_io.bytes_sent} | "
             f"Bytes Received: {net_io.bytes_recv} | "
             f"Packets Sent: {net_io.packets_sent} | "
-            f"Packets Received: {net_io.packets_recv}\n"
+            f"Packets Received: {net_io.packets_recv}"
         )
 
-        # Print to console
-        #network load over time
-        print(log_entry.strip())
-
-        # Write to log file
-        log_file.write(log_entry)
-        log_file.flush()
+        # Buffered; written every 12 readings (one minute)
+        log.append((time.time(), net_io.bytes_sent, net_io.bytes_recv, net_io.packets_sent, net_io.packets_recv))
 
         # Wait for 5 seconds before next snapshot
         time.sleep(5)
 
 except KeyboardInterrupt:
     print("\nMonitoring stopped by user.")
-    log_file.close()
+    log.close()
@@ -0,0 +1,174 @@
+# packet_capture.py
+# Fast capture path for the traffic analyzers. Frames are read raw, from an
+# AF_PACKET socket or a pcap file, and only the Ethernet/IPv4/TCP header
+# fields the flow table needs are unpacked with struct. This skips Scapy's
+# full dissection of every packet.
+import socket
+import struct
+import time
+
+# Link-layer types (pcap LINKTYPE_* values)
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+
+ETH_P_ALL = 0x0003
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_VLAN = (0x8100, 0x88A8)
+IPPROTO_TCP = 6
+
+_ETHERTYPE = struct.Struct('!H')
+_TCP_PORTS = struct.Struct('!HH')
+
+def ipv4_offset(frame, linktype=LINKTYPE_ETHERNET):
+    """Returns where the IPv4 header of a TCP/IPv4 frame starts, or None for anything else."""
+    if linktype == LINKTYPE_ETHERNET:
+        offset = 14
+        if len(frame) < offset:
+            return None
+        ethertype = _ETHERTYPE.unpack_from(frame, 12)[0]
+        # Skip 802.1Q / 802.1ad VLAN tags
+        while ethertype in ETHERTYPE_VLAN:
+            if len(frame) < offset + 4:
+                return None
+            ethertype = _ETHERTYPE.unpack_from(frame, offset + 2)[0]
+            offset += 4
+        if ethertype != ETHERTYPE_IPV4:
+            return None
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset = 16
+        if len(frame) < offset or _ETHERTYPE.unpack_from(frame, 14)[0] != ETHERTYPE_IPV4:
+            return None
+    elif linktype == LINKTYPE_RAW:
+        offset = 0
+    else:
+        return None
+
+    # IPv4 header, with room for the TCP ports and flags that follow it
+    if len(frame) < offset + 20:
+        return None
+    version_ihl = frame[offset]
+    if version_ihl >> 4 != 4 or frame[offset + 9] != IPPROTO_TCP:
+        return None
+    # Only the first fragment carries the TCP header
+    if _ETHERTYPE.unpack_from(frame, offset + 6)[0] & 0x1FFF:
+        return None
+    if len(frame) < offset + (version_ihl & 0x0F) * 4 + 14:
+        return None
+    return offset
+
+def parse_frame(frame, linktype=LINKTYPE_ETHERNET):
+    """
+    Extracts (src, sport, dst, dport, length, flags, payload_len, header_len) from a raw
+    TCP/IPv4 frame. Returns None for anything else (non-IPv4, non-TCP, fragments, truncated frames).
+    length is the whole frame, the same value len(packet) gives for a Scapy packet;
+    payload_len and header_len are the TCP payload and TCP header sizes.
+    """
+    offset = ipv4_offset(frame, linktype)
+    if offset is None:
+        return None
+    src = socket.inet_ntoa(frame[offset + 12:offset + 16])
+    dst = socket.inet_ntoa(frame[offset + 16:offset + 20])
+    ip_header_len = (frame[offset] & 0x0F) * 4
+    ip_total_len = _ETHERTYPE.unpack_from(frame, offset + 2)[0]
+
+    # TCP header: ports, the data offset at byte 12, then the flags byte at offset 13
+    offset += ip_header_len
+    sport, dport = _TCP_PORTS.unpack_from(frame, offset)
+    header_len = (frame[offset + 12] >> 4) * 4
+    flags = frame[offset + 13]
+    payload_len = max(0, ip_total_len - ip_header_len - header_len)
+    return src, sport, dst, dport, len(frame), flags, payload_len, header_len
+
+def flow_hash(frame, linktype=LINKTYPE_ETHERNET):
+    """
+    Direction-independent hash of a TCP/IPv4 frame's address/port 4-tuple, or None
+    for frames the analyzers ignore. Both directions of a flow hash the same.
+    """
+    offset = ipv4_offset(frame, linktype)
+    if offset is None:
+        return None
+    tcp = offset + (frame[offset] & 0x0F) * 4
+    a = frame[offset + 12:offset + 16] + frame[tcp:tcp + 2]
+    b = frame[offset + 16:offset + 20] + frame[tcp + 2:tcp + 4]
+    return hash((a, b) if a <= b else (b, a))
+
+def read_pcap(path):
+    """
+    Streams (timestamp, frame, linktype) from a classic libpcap file without loading it into memory.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            raise ValueError(f"'{path}' is not a pcap file (truncated header)")
+        magic = header[:4]
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            endian = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            endian = '>'
+        elif magic == b'\x0a\x0d\x0d\x0a':
+            raise ValueError(f"'{path}' is pcapng; convert it with 'editcap -F libpcap' first")
+        else:
+            raise ValueError(f"'{path}' is not a pcap file")
+        # Nanosecond-resolution files use a different magic number
+        fraction = 1e-9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1e-6
+        linktype = struct.unpack(endian + 'I', header[20:24])[0] & 0x0FFFFFFF
+
+        record = struct.Struct(endian + 'IIII')
+        while True:
+            record_header = f.read(16)
+            if len(record_header) < 16:
+                return
+            ts_sec, ts_frac, incl_len, _ = record.unpack(record_header)
+            frame = f.read(incl_len)
+            if len(frame) < incl_len:
+                return
+            yield ts_sec + ts_frac * fraction, frame, linktype
+
+def replay_pcap(path, speed=0.0, stop_event=None):
+    """
+    Streams (timestamp, frame, linktype) from a pcap file for replay.
+    speed=0 replays as fast as possible; speed=1.0 keeps the original inter-packet
+    timing, 2.0 plays twice as fast, and so on. Timestamps are the captured ones.
+    """
+    first_ts = None
+    started = time.monotonic()
+    for timestamp, frame, linktype in read_pcap(path):
+        if stop_event is not None and stop_event.is_set():
+            return
+        if speed > 0:
+            if first_ts is None:
+                first_ts = timestamp
+            delay = (timestamp - first_ts) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+        yield timestamp, frame, linktype
+
+class RawSocketCapture:
+    """Reads frames straight from an AF_PACKET socket (Linux only, needs CAP_NET_RAW)."""
+    def __init__(self, interface=None, buffer_size=65535, poll_timeout=0.5):
+        self.interface = interface
+        self.buffer = bytearray(buffer_size)
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        if interface:
+            self.sock.bind((interface, 0))
+        # recv wakes up periodically so the caller can notice a stop request
+        self.sock.settimeout(poll_timeout)
+
+    def frames(self, stop_event, idle_ticks=False):
+        """
+        Yields (timestamp, frame, linktype) until stop_event is set. With idle_ticks, also
+        yields None every poll_timeout seconds without traffic, so the caller gets to run timers.
+        """
+        view = memoryview(self.buffer)
+        while not stop_event.is_set():
+            try:
+                size = self.sock.recv_into(self.buffer)
+            except socket.timeout:
+                if idle_ticks:
+                    yield None
+                continue
+            yield time.time(), bytes(view[:size]), LINKTYPE_ETHERNET
+
+    def close(self):
+        self.sock.close()
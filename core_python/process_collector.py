@@ -0,0 +1,106 @@
+# process_collector.py
+# Host metrics without sleeping. psutil reports CPU usage as the change in CPU
+# time between two readings; instead of taking both readings inside one call
+# (cpu_percent(interval=...) sleeps in between), the collector keeps a
+# psutil.Process handle per PID across ticks and lets each tick's reading be
+# measured against the previous tick's.
+#
+# A tick reads each process's CPU times once, keeps the top K in a heap and
+# only looks up memory for those K (or, for an agent that sends its whole
+# process table, for every process). Names are read once, when a process is
+# first seen, and processes the agent may not read are skipped from then on.
+# A handle whose PID now belongs to a different process (psutil compares
+# creation times) is dropped and reopened, name and CPU baseline included.
+import heapq
+import time
+import psutil
+
+class ProcessCollector:
+    def __init__(self, top_k=15, all_processes=False):
+        """
+        :param top_k: Processes reported per tick, busiest first.
+        :param all_processes: Report every readable process instead of the top_k.
+        """
+        self.top_k = top_k
+        self.all_processes = all_processes
+        # pid -> (psutil.Process, name); name is None for a process the agent may not read
+        self._handles = {}
+        self.counters = {'ticks': 0, 'started': 0, 'exited': 0, 'denied': 0, 'reused': 0}
+        self.last_collect_ms = 0.0
+        # The first readings only set the baselines the next tick is measured against
+        psutil.cpu_percent(interval=None)
+        self.collect()
+
+    def _open(self, pid):
+        """A handle for a newly seen process, with its CPU baseline taken; no name if it may not be read."""
+        process = psutil.Process(pid)
+        try:
+            name = process.name()
+            process.cpu_percent(interval=None)
+            return (process, name)
+        except psutil.AccessDenied:
+            self.counters['denied'] += 1
+            return (process, None)
+
+    def collect(self):
+        """
+        Returns (system CPU %, top processes) for the time since the previous call; with all_processes,
+        every process. Each process is {'pid', 'name', 'cpu_percent', 'memory_percent'}, as psutil reports them.
+        """
+        start = time.perf_counter()
+        cpu_usage = psutil.cpu_percent(interval=None)
+        handles = self._handles
+        pids = set(psutil.pids())
+        for pid in handles.keys() - pids:
+            del handles[pid]
+            self.counters['exited'] += 1
+        for pid in pids - handles.keys():
+            try:
+                handles[pid] = self._open(pid)
+                self.counters['started'] += 1
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                pass
+
+        samples = []
+        gone = []
+        for pid, (process, name) in handles.items():
+            try:
+                if not process.is_running():
+                    # Exited, or the PID now belongs to a process with another creation time
+                    gone.append(pid)
+                    continue
+                if name is None:
+                    continue
+                cpu = process.cpu_percent(interval=None)
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                gone.append(pid)
+                continue
+            except psutil.AccessDenied:
+                handles[pid] = (process, None)
+                self.counters['denied'] += 1
+                continue
+            samples.append((cpu, pid))
+        for pid in gone:
+            # Reopened next tick, with a fresh name and CPU baseline, if the PID is still (or again) in use
+            del handles[pid]
+            self.counters['reused' if pid in pids else 'exited'] += 1
+
+        top_processes = []
+        for cpu, pid in samples if self.all_processes else heapq.nlargest(self.top_k, samples):
+            process, name = handles[pid]
+            try:
+                memory = process.memory_percent()
+            except psutil.Error:
+                continue
+            top_processes.append({'pid': pid, 'name': name, 'cpu_percent': cpu, 'memory_percent': memory})
+
+        self.counters['ticks'] += 1
+        self.last_collect_ms = (time.perf_counter() - start) * 1000
+        return cpu_usage, top_processes
+
+    def stats(self):
+        """Processes tracked, started, exited, unreadable and reused PIDs, and the last tick's cost."""
+        stats = dict(self.counters)
+        stats['tracked'] = len(self._handles)
+        stats['last_collect_ms'] = self.last_collect_ms
+        return stats
@@ -5,14 +5,15 @@
 import psutil
 import time
 import os
+from binlog import BinaryLogWriter, EVENT_SNAPSHOT, EVENT_STARTED, EVENT_CHANGED, EVENT_EXITED
+from process_table import ProcessDeltaEncoder
 
-# Make sure 'logs' folder exists
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-
-# Open log file
-log_file = open('logs/process_log.txt', 'a')
+# Binary records in logs/process: the whole table every 30 snapshots (5 minutes), and in
+# between only the processes that started, exited, or moved by 1% CPU or 0.5% memory
+# (read with: python binlog.py table logs/process)
+log = BinaryLogWriter(os.path.join('logs', 'process'), 'process', flush_records=4096, flush_interval=0)
+encoder = ProcessDeltaEncoder(cpu_threshold=1.0, memory_threshold=0.5, keyframe_every=30)
+users = {} # pid -> username, for the records of processes that exited
 
 print("Process monitoring started... (Press Ctrl+C to stop)")
 
@@ -21,34 +22,46 @@ try:
         # Get all running processes
         processes = psutil.process_iter(['pid', 'name', 'username', 'cpu_percent', 'memory_percent'])
 
-        log_file.write("---- Process Snapshot (one process monitor is complete again it shows after 10 sec----\n")
-
+        table = []
+        current_users = {}
         for proc in processes:
             try:
                 info = proc.info
-                log_entry = (
-                    f"PID: {info['pid']} | "
-                    f"Name: {info['name']} | "
-                    f"User: {info['username']} | "
-                    f"CPU: {info['cpu_percent']}% | "
-                    f"Memory: {info['memory_percent']:.2f}%\n"
-                )
-
-                # Print to console
-                print(log_entry.strip())
-
-                # Write to file
-                log_file.write(log_entry)
-
+                table.append({
+                    'pid': info['pid'],
+                    'name': info['name'] or '',
+                    'cpu_percent': info['cpu_percent'] or 0.0,
+                    'memory_percent': info['memory_percent'] or 0.0,
+                })
+                current_users[info['pid']] = (info['username'] or '').encode()[:32]
             except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
                 # Some processes may terminate or deny access during monitoring
                 continue
 
-        log_file.flush()#ensures that all data is written imediately
+        # Every record of a snapshot gets the same time
+        now = time.time()
+        delta = encoder.encode(table)
+        names = {process['pid']: process['name'] for process in table}
+        if delta.get('keyframe'):
+            rows = [(now, EVENT_SNAPSHOT, pid, cpu, memory, name.encode()[:32], current_users[pid])
+                    for pid, name, cpu, memory in delta['processes']]
+        else:
+            rows = [(now, EVENT_STARTED, pid, cpu, memory, name.encode()[:32], current_users[pid])
+                    for pid, name, cpu, memory in delta['started']]
+            rows += [(now, EVENT_CHANGED, pid, cpu, memory, names[pid].encode()[:32], current_users[pid])
+                     for pid, cpu, memory in delta['changed']]
+            rows += [(now, EVENT_EXITED, pid, 0.0, 0.0, b'', users.get(pid, b'')) for pid in delta['exited']]
+        users = current_users
+
+        # One write per snapshot, and one console line instead of one per process
+        log.extend(rows)
+        busiest = max(table, key=lambda process: process['cpu_percent'], default=None)
+        print(f"{time.strftime('%H:%M:%S')} {len(table)} processes, {len(rows)} records logged"
+              + (f" | busiest: {busiest['name']} ({busiest['cpu_percent']:.1f}% CPU)" if busiest else ""))
 
         # Wait for 10 seconds before next snapshot
         time.sleep(10)
 
 except KeyboardInterrupt:
     print("\nMonitoring stopped by user.")
-    log_file.close()
+    log.close()
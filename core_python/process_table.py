@@ -0,0 +1,112 @@
+# process_table.py
+# Delta encoding of a host's process table. The agent keeps the values it
+# last sent for every process and each tick sends only what moved:
+#
+#   {"seq": 42, "started": [[pid, name, cpu, mem], ...], "exited": [pid, ...],
+#    "changed": [[pid, cpu, mem], ...]}
+#
+# A process is only resent when its CPU or memory moved past a threshold
+# from the value last sent, so small drifts add up until they matter. Every
+# keyframe_every ticks the whole table is sent instead
+# ({"seq": 43, "keyframe": true, "processes": [[pid, name, cpu, mem], ...]}),
+# so a server that missed a delta (or restarted) is back in sync within one
+# keyframe interval. A delta older than the table (a sequence number already
+# applied) arrived late and is ignored.
+#
+# The server rebuilds each host's table with ProcessTable.
+import heapq
+
+def _entry(process):
+    return [process['pid'], process['name'], round(process['cpu_percent'], 1), round(process['memory_percent'], 2)]
+
+class ProcessDeltaEncoder:
+    def __init__(self, cpu_threshold=1.0, memory_threshold=0.5, keyframe_every=30):
+        """
+        :param cpu_threshold: Change in CPU % (from the last sent value) that makes a process resent.
+        :param memory_threshold: Change in memory % that makes a process resent.
+        :param keyframe_every: Ticks between full tables.
+        """
+        self.cpu_threshold = cpu_threshold
+        self.memory_threshold = memory_threshold
+        self.keyframe_every = keyframe_every
+        self._sent = {} # pid -> [pid, name, cpu, mem] as last sent
+        self.seq = 0
+
+    def encode(self, processes):
+        """Takes the current table (dicts with pid, name, cpu_percent, memory_percent) and returns the message."""
+        self.seq += 1
+        if self.seq % self.keyframe_every == 1 or self.keyframe_every == 1:
+            self._sent = {process['pid']: _entry(process) for process in processes}
+            # Copies, so later ticks updating _sent don't change a message that is still queued
+            return {'seq': self.seq, 'keyframe': True, 'processes': [list(entry) for entry in self._sent.values()]}
+
+        started, changed = [], []
+        current = set()
+        for process in processes:
+            pid = process['pid']
+            current.add(pid)
+            sent = self._sent.get(pid)
+            if sent is None or sent[1] != process['name']:
+                sent = self._sent[pid] = _entry(process)
+                started.append(list(sent))
+            elif abs(process['cpu_percent'] - sent[2]) >= self.cpu_threshold or \
+                    abs(process['memory_percent'] - sent[3]) >= self.memory_threshold:
+                entry = _entry(process)
+                sent[2], sent[3] = entry[2], entry[3]
+                changed.append([pid, entry[2], entry[3]])
+        exited = [pid for pid in self._sent if pid not in current]
+        for pid in exited:
+            del self._sent[pid]
+        return {'seq': self.seq, 'started': started, 'exited': exited, 'changed': changed}
+
+class ProcessTable:
+    """A host's process table rebuilt from keyframes and deltas."""
+    __slots__ = ('processes', 'seq', 'stale', 'keyframes', 'deltas', 'gaps', 'late')
+
+    def __init__(self):
+        self.processes = {} # pid -> [pid, name, cpu, mem]
+        self.seq = None
+        self.stale = True # until the first keyframe
+        self.keyframes = self.deltas = self.gaps = self.late = 0
+
+    def apply(self, message):
+        """Applies a keyframe or delta. Returns whether the table is in sync; after a missed delta it is stale until the next keyframe."""
+        seq = message.get('seq')
+        if message.get('keyframe'):
+            self.processes = {entry[0]: list(entry) for entry in message.get('processes', [])}
+            self.stale = False
+            self.keyframes += 1
+        else:
+            if self.seq is not None and seq is not None and seq <= self.seq:
+                # Applying it would bring back processes that exited since
+                self.late += 1
+                return not self.stale
+            if self.seq is None or seq != self.seq + 1:
+                # Applied anyway: a missed delta only makes some entries out of date until the keyframe
+                self.stale = True
+                self.gaps += 1
+            for pid in message.get('exited', []):
+                self.processes.pop(pid, None)
+            for entry in message.get('started', []):
+                self.processes[entry[0]] = list(entry)
+            for pid, cpu, memory in message.get('changed', []):
+                entry = self.processes.get(pid)
+                if entry is not None:
+                    entry[2], entry[3] = cpu, memory
+            self.deltas += 1
+        self.seq = seq
+        return not self.stale
+
+    def top(self, k=15):
+        """The k busiest processes, in the shape the dashboard's top_processes has always had."""
+        entries = heapq.nlargest(k, self.processes.values(), key=lambda entry: entry[2])
+        return [{'pid': pid, 'name': name, 'cpu_percent': cpu, 'memory_percent': memory}
+                for pid, name, cpu, memory in entries]
+
+    def snapshot(self):
+        return {
+            'seq': self.seq,
+            'stale': self.stale,
+            'processes': [{'pid': pid, 'name': name, 'cpu_percent': cpu, 'memory_percent': memory}
+                          for pid, name, cpu, memory in sorted(self.processes.values())],
+        }
@@ -0,0 +1,78 @@
+# score_cache.py
+# Remembers the last model verdict for each flow, keyed by (host_id, flow_key).
+# Agents resend a long-lived flow's record every few hundred packets with
+# counters that barely moved, so the verdict for the previous vector almost
+# always still holds. An entry is reused until the flow's features drift past
+# a tolerance, its packet count reaches the next power of two, or the entry is
+# older than the TTL.
+import threading
+import time
+from collections import OrderedDict
+
+class ScoreCache:
+    def __init__(self, max_entries=100000, ttl=300.0, tolerance=0.1):
+        """
+        :param max_entries: Flows cached at most; the least recently used are evicted first.
+        :param ttl: Seconds an entry is trusted after the flow was last scored.
+        :param tolerance: Relative change of any feature (against max(|old|, 1)) that forces a rescore.
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.tolerance = tolerance
+        # (host_id, flow_key) -> (scored_at, packet bucket, vector, per-feature allowed change, score, alerts)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = {'hits': 0, 'new': 0, 'expired': 0, 'bucket': 0, 'changed': 0,
+                         'evicted_closed': 0, 'evicted_capacity': 0}
+
+    def lookup(self, key, vector, packet_count, now=None):
+        """Returns the cached (score, alerts) if they still hold for this vector, otherwise None."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters['new'] += 1
+                return None
+            scored_at, bucket, cached, limits, score, alerts = entry
+            if now - scored_at >= self.ttl:
+                self.counters['expired'] += 1
+                return None
+            if int(packet_count).bit_length() != bucket:
+                self.counters['bucket'] += 1
+                return None
+            for new, old, limit in zip(vector, cached, limits):
+                if abs(new - old) > limit:
+                    self.counters['changed'] += 1
+                    return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return score, alerts
+
+    def store(self, key, vector, packet_count, score, alerts, now=None):
+        """Caches a flow's freshly computed score and model alerts for the vector they were computed from."""
+        now = time.monotonic() if now is None else now
+        limits = [self.tolerance * max(abs(value), 1.0) for value in vector]
+        with self._lock:
+            self._entries[key] = (now, int(packet_count).bit_length(), vector, limits, score, alerts)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.counters['evicted_capacity'] += 1
+
+    def evict(self, key):
+        """Drops a closed flow's entry."""
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self.counters['evicted_closed'] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hits, misses by cause (new flow, expired, packet bucket, features changed), evictions and the hit ratio."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['size'] = len(self._entries)
+        lookups = stats['hits'] + stats['new'] + stats['expired'] + stats['bucket'] + stats['changed']
+        stats['hit_ratio'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
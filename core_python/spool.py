@@ -0,0 +1,156 @@
+# spool.py
+# Durable on-disk spool for the agents' sender. Batches that cannot reach the
+# server are appended to length-prefixed segment files and replayed oldest
+# first once the server is back, so a server restart does not lose records
+# and does not grow the agent's memory.
+#
+# Each entry is a 9-byte header (payload length, encoding, record count)
+# followed by the encoded batch exactly as it would be posted. Segments rotate
+# at segment_bytes, and the oldest ones are deleted once the spool exceeds
+# max_bytes. A '<segment>.offset' file remembers how far a partly replayed
+# segment got, so entries are not resent after a failed replay.
+import os
+import struct
+import threading
+
+ENTRY_HEADER = struct.Struct('>IBI')
+SEGMENT_SUFFIX = '.spool'
+
+class Spool:
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Segments left by a previous run are replayed first
+        self.segments = sorted(
+            os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX)
+        )
+        self.total_bytes = sum(os.path.getsize(path) for path in self.segments)
+        self.next_sequence = int(os.path.basename(self.segments[-1])[:-len(SEGMENT_SUFFIX)]) + 1 if self.segments else 1
+        self.active = None
+        self.active_size = 0
+        self.evicted_segments = 0
+        self.evicted_bytes = 0
+
+    def __bool__(self):
+        with self.lock:
+            return bool(self.segments)
+
+    def append(self, payload, encoding, count):
+        """Stores one encoded batch of count records."""
+        entry_size = ENTRY_HEADER.size + len(payload)
+        with self.lock:
+            if self.active is None or self.active_size + entry_size > self.segment_bytes:
+                self._rotate()
+            self.active.write(ENTRY_HEADER.pack(len(payload), encoding, count))
+            self.active.write(payload)
+            self.active.flush()
+            self.active_size += entry_size
+            self.total_bytes += entry_size
+            self._enforce_cap()
+
+    def replay(self, deliver):
+        """
+        Calls deliver(payload, encoding, count) for stored batches, oldest first,
+        until it returns False. Fully delivered segments are deleted.
+        Returns True when the spool was emptied.
+        """
+        while True:
+            with self.lock:
+                if not self.segments:
+                    return True
+                path = self.segments[0]
+                # Seal the active segment before reading it, so new batches go to a fresh one
+                if self.active is not None and self.active.name == path:
+                    self._seal()
+
+            offset = self._read_offset(path)
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    while True:
+                        header = f.read(ENTRY_HEADER.size)
+                        if len(header) < ENTRY_HEADER.size:
+                            break
+                        length, encoding, count = ENTRY_HEADER.unpack(header)
+                        payload = f.read(length)
+                        if len(payload) < length:
+                            # Torn write from a crash; nothing after it is readable
+                            break
+                        if not deliver(payload, encoding, count):
+                            self._write_offset(path, offset)
+                            return False
+                        offset += ENTRY_HEADER.size + length
+            except FileNotFoundError:
+                # Evicted by the size cap while we were replaying it
+                pass
+            self._remove(path)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'segments': len(self.segments),
+                'bytes': self.total_bytes,
+                'evicted_segments': self.evicted_segments,
+                'evicted_bytes': self.evicted_bytes,
+            }
+
+    def close(self):
+        with self.lock:
+            self._seal()
+
+    def _rotate(self):
+        self._seal()
+        path = os.path.join(self.directory, f"{self.next_sequence:012d}{SEGMENT_SUFFIX}")
+        self.next_sequence += 1
+        self.active = open(path, 'ab')
+        self.active_size = 0
+        self.segments.append(path)
+
+    def _seal(self):
+        if self.active is not None:
+            self.active.close()
+            self.active = None
+
+    def _enforce_cap(self):
+        """Deletes the oldest sealed segments until the spool fits in max_bytes."""
+        while self.total_bytes > self.max_bytes and len(self.segments) > 1:
+            path = self.segments.pop(0)
+            size = self._delete(path)
+            self.total_bytes -= size
+            self.evicted_segments += 1
+            self.evicted_bytes += size
+
+    def _remove(self, path):
+        with self.lock:
+            if path in self.segments:
+                self.segments.remove(path)
+                self.total_bytes -= self._delete(path)
+            else:
+                self._delete(path)
+
+    def _delete(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except FileNotFoundError:
+            size = 0
+        try:
+            os.remove(path + '.offset')
+        except FileNotFoundError:
+            pass
+        return size
+
+    def _read_offset(self, path):
+        try:
+            with open(path + '.offset') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_offset(self, path, offset):
+        with open(path + '.offset', 'w') as f:
+            f.write(str(offset))
@@ -3,7 +3,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // --- Chart Initialization (No changes here) ---
     const netTrafficLayout = {
-        xaxis: { title: 'Time' },
+        xaxis: { title: 'Time', type: 'date' },
         yaxis: { title: 'Bytes/sec' },
         margin: { t: 30, l: 50, r: 30, b: 40 },
         paper_bgcolor: '#16213e',
@@ -33,23 +33,66 @@ document.addEventListener('DOMContentLoaded', function() {
     // --- WebSocket Event Handlers ---
     socket.on('connect', () => {
         console.log('Connected to server');
+        // A new or reconnecting dashboard starts from the stored history instead of an empty chart
+        loadTrafficHistory();
     });
 
-    // --- MODIFIED: Listen for the new 'system_metrics_update' event ---
-    socket.on('system_metrics_update', (metrics) => {
-        // This event now only carries system data
-        updateHostMetrics(metrics); 
-    });
+    // --- Dashboard frames ---
+    // The server sends a few frames per second, each with only the fields that changed:
+    // { seq, time, keyframe?, updates: { channel: { key: fields } } }. A keyframe carries
+    // the full state. Frames are JSON text, or msgpack bytes when the server enables it.
+    const dashboardState = {};
+    function decodeFrame(payload) {
+        if (typeof payload === 'string') {
+            return JSON.parse(payload);
+        }
+        return MessagePack.decode(new Uint8Array(payload));
+    }
 
-    // --- NEW: Listen for the pre-calculated network rate from the server ---
-    socket.on('network_traffic_update', (rateData) => {
-        // rateData is an object like { sent: 1234.5, received: 0 }
-        updateNetworkChart(rateData.sent, rateData.received);
+    socket.on('frame', (payload) => {
+        const frame = decodeFrame(payload);
+        for (const [channel, items] of Object.entries(frame.updates)) {
+            dashboardState[channel] = dashboardState[channel] || {};
+            for (const [key, fields] of Object.entries(items)) {
+                const state = frame.keyframe ? {} : (dashboardState[channel][key] || {});
+                Object.assign(state, fields);
+                dashboardState[channel][key] = state;
+                renderUpdate(channel, key, state);
+            }
+        }
     });
 
-    socket.on('new_alert', (alert) => {
-        addAlertToLog(alert);
-        updateAlertPieChart(alert.type);
+    function renderUpdate(channel, key, state) {
+        if (channel === 'system_metrics') {
+            updateHostMetrics(state);
+        } else if (channel === 'network_traffic' && followedHosts.length !== 1) {
+            // Total over all hosts, like { sent: 1234.5, received: 0, time: ... }
+            updateNetworkChart(state.sent, state.received, state.time);
+        } else if (channel === 'host_traffic' && followedHosts.length === 1 && key === followedHosts[0]) {
+            // Following a single host charts that host's own rates
+            updateNetworkChart(state.sent, state.received, state.time);
+        }
+    }
+
+    // Follow only some hosts: subscribeHosts(['web-1']); subscribeHosts([]) follows all again
+    let followedHosts = [];
+    function subscribeHosts(hosts) {
+        followedHosts = hosts || [];
+        socket.emit('subscribe', { hosts: hosts });
+        loadTrafficHistory();
+    }
+    window.subscribeHosts = subscribeHosts;
+
+    // Alerts arrive once a second, deduplicated: each entry is a new alert or a repeat
+    // of one already shown, with its total count and the repeats since the last batch
+    socket.on('alert_batch', (batch) => {
+        batch.alerts.forEach(alert => {
+            addAlertToLog(alert);
+            updateAlertPieChart(alert.type, alert.new);
+        });
+        if (batch.suppressed > 0) {
+            console.log(`${batch.suppressed} alerts not shown (rate limited)`);
+        }
     });
 
     // --- UI Update Functions ---
@@ -69,29 +112,63 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
 
+    // The chart holds the downsampled last hour plus live points, never more than this
+    const MAX_CHART_POINTS = 600;
+    const HISTORY_SECONDS = 3600;
+
+    // Replaces the chart with the last hour of the followed host (or all hosts), already
+    // downsampled by the server to a few hundred points
+    function loadTrafficHistory() {
+        const params = new URLSearchParams({
+            from: Date.now() / 1000 - HISTORY_SECONDS,
+            points: MAX_CHART_POINTS / 2
+        });
+        if (followedHosts.length === 1) {
+            params.set('host', followedHosts[0]);
+        }
+        fetch(`/api/traffic?${params}`)
+            .then(response => response.json())
+            .then(series => {
+                const times = series.time.map(t => new Date(t * 1000));
+                Plotly.react('net-traffic-chart', [
+                    { y: series.sent, x: times, type: 'scatter', mode: 'lines', name: 'Sent' },
+                    { y: series.received, x: times, type: 'scatter', mode: 'lines', name: 'Received' }
+                ], netTrafficLayout);
+            })
+            .catch(error => console.log('Could not load traffic history', error));
+    }
+
     // This function now receives the final rate directly
-    function updateNetworkChart(sentRate, recvRate) {
-        const currentTime = new Date().toLocaleTimeString();
+    function updateNetworkChart(sentRate, recvRate, time) {
+        const pointTime = new Date(time * 1000);
         Plotly.extendTraces('net-traffic-chart', {
-            x: [[currentTime], [currentTime]],
+            x: [[pointTime], [pointTime]],
             y: [[sentRate], [recvRate]]
-        }, [0, 1], 20); // Keep 20 data points on the graph
+        }, [0, 1], MAX_CHART_POINTS);
     }
     
-    // Unchanged functions below
     function addAlertToLog(alert) {
         const alertTable = document.getElementById('alert-log').getElementsByTagName('tbody')[0];
+        const description = alert.count > 1 ? `${alert.description} (x${alert.count})` : alert.description;
+        // A repeat updates the row of the alert it repeats, if that row is still shown
+        let row = alertTable.querySelector(`tr[data-alert-id="${alert.id}"]`);
+        if (row) {
+            row.cells[0].textContent = new Date(alert.last_seen * 1000).toLocaleTimeString();
+            row.cells[3].textContent = description;
+            return;
+        }
         let newRow = alertTable.insertRow(0);
+        newRow.dataset.alertId = alert.id;
         newRow.className = `severity-${alert.severity.toLowerCase()}`;
-        newRow.innerHTML = `<td>${new Date().toLocaleTimeString()}</td><td>${alert.severity}</td><td>${alert.type}</td><td>${alert.description}</td>`;
+        newRow.innerHTML = `<td>${new Date(alert.last_seen * 1000).toLocaleTimeString()}</td><td>${alert.severity}</td><td>${alert.type}</td><td>${description}</td>`;
         if (alertTable.rows.length > 10) {
             alertTable.deleteRow(10);
         }
     }
 
     let alertCounts = {};
-    function updateAlertPieChart(alertType) {
-        alertCounts[alertType] = (alertCounts[alertType] || 0) + 1;
+    function updateAlertPieChart(alertType, count) {
+        alertCounts[alertType] = (alertCounts[alertType] || 0) + count;
         const data = [{
             values: Object.values(alertCounts),
             labels: Object.keys(alertCounts),
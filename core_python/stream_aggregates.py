@@ -0,0 +1,269 @@
+# stream_aggregates.py
+# Sliding-window aggregates over the flow records of all agents, for attacks
+# that no single flow gives away: a port scan is many tiny flows from one
+# source, a SYN flood many half-open flows to one port. Every structure has
+# a fixed size, and a record costs a handful of hash and list operations
+# however many sources there are.
+#
+# - WindowedCountMin: a count-min sketch split into time slots; the oldest
+#   slot is subtracted from the running total as the window slides.
+# - HyperLogLog: distinct-count estimate in 2**precision one-byte registers,
+#   with a running harmonic sum so an estimate costs O(1).
+# - StreamAggregates: the counters and rules the detection cascade runs.
+import math
+import threading
+import time
+from collections import OrderedDict
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+class WindowedCountMin:
+    def __init__(self, window=60.0, slots=12, width=2048, depth=4):
+        """
+        :param window: Seconds of history counted.
+        :param slots: Time slots the window is split into; counts expire one slot at a time.
+        :param width: Counters per row; overestimates are within ~e/width of the window's total.
+        :param depth: Rows (hash functions); more rows make a bad overestimate less likely.
+        """
+        self.slot_seconds = window / slots
+        self.width = width
+        self.depth = depth
+        self._slots = [[[0] * width for _ in range(depth)] for _ in range(slots)]
+        self._total = [[0] * width for _ in range(depth)]
+        self._current = 0
+        self._slot_id = None
+
+    def _advance(self, now):
+        """Moves to the slot for now, expiring the slots that fell out of the window."""
+        slot_id = int(now // self.slot_seconds)
+        if self._slot_id is None:
+            self._slot_id = slot_id
+            return
+        steps = min(slot_id - self._slot_id, len(self._slots))
+        for _ in range(max(steps, 0)):
+            self._current = (self._current + 1) % len(self._slots)
+            expired = self._slots[self._current]
+            for d in range(self.depth):
+                self._total[d] = [total - count for total, count in zip(self._total[d], expired[d])]
+                expired[d] = [0] * self.width
+        if slot_id > self._slot_id:
+            self._slot_id = slot_id
+
+    def _cells(self, key):
+        # Double hashing: row d uses h1 + d * h2
+        h = hash(key) & MASK64
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + d * h2) % self.width for d in range(self.depth)]
+
+    def add(self, key, count=1, now=None):
+        """Counts key and returns its estimated count over the window before and after, as (before, after)."""
+        self._advance(time.monotonic() if now is None else now)
+        slot = self._slots[self._current]
+        before = after = None
+        for d, cell in enumerate(self._cells(key)):
+            slot[d][cell] += count
+            value = self._total[d][cell]
+            self._total[d][cell] = value + count
+            if after is None or value + count < after:
+                before, after = value, value + count
+        return before, after
+
+    def slot(self):
+        """Id of the current time slot; a window spans this many slots."""
+        return self._slot_id, len(self._slots)
+
+    def estimate(self, key, now=None):
+        self._advance(time.monotonic() if now is None else now)
+        return min(self._total[d][cell] for d, cell in enumerate(self._cells(key)))
+
+class HyperLogLog:
+    __slots__ = ('precision', 'registers', 'inverse_sum', 'zeros')
+
+    def __init__(self, precision=8):
+        """2**precision registers; the standard error is about 1.04 / sqrt(2**precision) (6.5% at 8)."""
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+        self.inverse_sum = float(1 << precision) # sum of 2**-register over all registers
+        self.zeros = 1 << precision
+
+    def add(self, item):
+        """Adds item; returns True if that changed the estimate."""
+        h = hash(item) & MASK64
+        index = h >> (64 - self.precision)
+        # Rank of the first set bit in the remaining bits
+        rank = (64 - self.precision) - (h & ((1 << (64 - self.precision)) - 1)).bit_length() + 1
+        old = self.registers[index]
+        if rank <= old:
+            return False
+        self.registers[index] = rank
+        self.inverse_sum += 2.0 ** -rank - 2.0 ** -old
+        if old == 0:
+            self.zeros -= 1
+        return True
+
+    def estimate(self):
+        m = len(self.registers)
+        raw = 0.7213 / (1 + 1.079 / m) * m * m / self.inverse_sum
+        if raw <= 2.5 * m and self.zeros:
+            # Small cardinalities: linear counting is more accurate
+            return m * math.log(m / self.zeros)
+        return raw
+
+def flow_endpoints(record):
+    """
+    (src_ip, dst_ip, dst_port) of a flow record, oriented from the side that opened the flow.
+    Records from agents that don't send the direction fall back to the flow_key, taking
+    the endpoint with the higher port as the client.
+    """
+    if 'src_ip' in record:
+        return record['src_ip'], record['dst_ip'], record['dst_port']
+    first, _, second = record.get('flow_key', '').partition('-')
+    a_ip, _, a_port = first.rpartition(':')
+    b_ip, _, b_port = second.rpartition(':')
+    try:
+        a_port, b_port = int(a_port), int(b_port)
+    except ValueError:
+        return None
+    return (a_ip, b_ip, b_port) if a_port >= b_port else (b_ip, a_ip, a_port)
+
+def opened_flow(record):
+    """
+    Whether record is the first record of a flow its agent saw being opened, so counting it
+    counts one new flow from its initiator. Agents send this as new_flow; for older agents,
+    a first record (byte deltas covering the whole flow) of a flow that carried a SYN.
+    """
+    if 'new_flow' in record:
+        return bool(record['new_flow'])
+    return record.get('syn_flag_count', 0) > 0 and \
+        record.get('src_bytes_delta', record.get('src_bytes')) == record.get('src_bytes') and \
+        record.get('dst_bytes_delta', record.get('dst_bytes')) == record.get('dst_bytes')
+
+class StreamAggregates:
+    def __init__(self, window=60.0, scan_threshold=100, syn_flood_threshold=1000, source_flow_threshold=2000,
+                 max_sources=10000, hll_precision=8, sketch_width=2048, sketch_depth=4):
+        """
+        :param window: Seconds each aggregate looks back.
+        :param scan_threshold: Distinct destinations (ip:port) one source may contact per window.
+        :param syn_flood_threshold: Half-open flows one destination port may receive per window.
+        :param source_flow_threshold: New flows one source may open per window.
+        :param max_sources: Sources whose distinct destinations are tracked; the least recently
+                            active are dropped first (bounds the HyperLogLogs to this many).
+        """
+        self.window = window
+        self.scan_threshold = scan_threshold
+        self.syn_flood_threshold = syn_flood_threshold
+        self.source_flow_threshold = source_flow_threshold
+        self.max_sources = max_sources
+        self.hll_precision = hll_precision
+        self.source_flows = WindowedCountMin(window, width=sketch_width, depth=sketch_depth)
+        self.half_open = WindowedCountMin(window, width=sketch_width, depth=sketch_depth)
+        # src_ip -> [window start, HyperLogLog, previous window's estimate, alerted in this window]
+        self._destinations = OrderedDict()
+        # (rule, key) -> slot id of its last alert, oldest first; a key alerts at most once per window
+        self._alerted = OrderedDict()
+        self.counters = {'observed': 0, 'port_scan': 0, 'syn_flood': 0, 'connection_flood': 0}
+        self._lock = threading.Lock()
+
+    def observe(self, record, now=None):
+        """Adds one network_flow record to the aggregates; returns the alerts it pushed over a threshold."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            return self._observe(record, now)
+
+    def _observe(self, record, now):
+        self.counters['observed'] += 1
+        if not opened_flow(record):
+            return []
+        endpoints = flow_endpoints(record)
+        if endpoints is None:
+            return []
+        src, dst, dport = endpoints
+        alerts = []
+
+        # Each threshold alerts when an estimate crosses it, at most once per key and window
+        count = self.crossed(self.source_flows, 'connection_flood', src, self.source_flow_threshold, now)
+        if count is not None:
+            self.counters['connection_flood'] += 1
+            alerts.append({
+                "type": "Aggregate-Based Alert",
+                "severity": "High",
+                "description": "Connection Flood Detected",
+                "details": f"{src} opened about {count} flows in the last {self.window:.0f}s"
+            })
+
+        # Half-open: every packet but RSTs carried SYN, so the handshake never completed
+        syn = record.get('syn_flag_count', 0)
+        if syn and syn >= record.get('packet_count', 0) - record.get('rst_flag_count', 0):
+            count = self.crossed(self.half_open, 'syn_flood', dport, self.syn_flood_threshold, now)
+            if count is not None:
+                self.counters['syn_flood'] += 1
+                alerts.append({
+                    "type": "Aggregate-Based Alert",
+                    "severity": "Critical",
+                    "description": "SYN Flood Detected",
+                    "details": f"About {count} half-open flows to port {dport} in the last {self.window:.0f}s"
+                })
+
+        distinct = self.distinct_destinations(src, (dst, dport), now)
+        if distinct is not None:
+            self.counters['port_scan'] += 1
+            alerts.append({
+                "type": "Aggregate-Based Alert",
+                "severity": "High",
+                "description": "Port Scan Detected",
+                "details": f"{src} contacted about {distinct:.0f} distinct destinations in the last {self.window:.0f}s"
+            })
+        return alerts
+
+    def crossed(self, sketch, rule, key, threshold, now):
+        """
+        Counts key in sketch. Returns the new estimate if this count took it from at or below
+        threshold to above it and key has not alerted for rule within the window, otherwise None.
+        """
+        before, after = sketch.add(key, 1, now)
+        if not before <= threshold < after:
+            return None
+        slot_id, slots = sketch.slot()
+        alerted = self._alerted
+        # Forget alerts older than the window
+        while alerted:
+            oldest = next(iter(alerted))
+            if alerted[oldest] > slot_id - slots:
+                break
+            del alerted[oldest]
+        if (rule, key) in alerted:
+            return None
+        alerted[(rule, key)] = slot_id
+        return after
+
+    def distinct_destinations(self, src, destination, now):
+        """
+        Adds destination to src's HyperLogLog. Returns the sliding-window estimate the first
+        time in a window it exceeds scan_threshold, otherwise None.
+        """
+        entry = self._destinations.get(src)
+        if entry is None:
+            entry = self._destinations[src] = [now, HyperLogLog(self.hll_precision), 0.0, False]
+            if len(self._destinations) > self.max_sources:
+                self._destinations.popitem(last=False)
+        else:
+            self._destinations.move_to_end(src)
+        elapsed = now - entry[0]
+        if elapsed >= self.window:
+            # Start a new window; the last one's count carries over, fading out as this one fills
+            entry[2] = entry[1].estimate() if elapsed < 2 * self.window else 0.0
+            entry[0], entry[1], entry[3] = now, HyperLogLog(self.hll_precision), False
+            elapsed = 0.0
+        if not entry[1].add(destination) or entry[3]:
+            return None
+        estimate = entry[1].estimate() + entry[2] * (1.0 - elapsed / self.window)
+        if estimate <= self.scan_threshold:
+            return None
+        entry[3] = True
+        return estimate
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            stats['tracked_sources'] = len(self._destinations)
+        return stats
@@ -4,13 +4,10 @@
 import psutil
 import time
 import os
+from binlog import BinaryLogWriter
 
-# Make sure 'logs' folder exists
-if not os.path.exists('logs'):
-    os.makedirs('logs')
-
-# Open a log file to write
-log_file = open('logs/system_log.txt', 'a')
+# One fixed-size binary record per reading in logs/system (read with: python binlog.py dump logs/system)
+log = BinaryLogWriter(os.path.join('logs', 'system'), 'system', flush_records=12, flush_interval=60.0)
 
 print("System monitoring started... (Press Ctrl+C to stop)")
 
@@ -22,26 +19,22 @@ try:
         disk = psutil.disk_usage('/')
         swap_memory=psutil.swap_memory()
         
-        # Format the log entry
-        log_entry = (
+        # Print to console
+        print(
             f"CPU Usage: {cpu_percent}% | "
             f"Memory Usage: {memory.percent}% | "
-            f"Disk Usage: {disk.percent}%\n |" 
-            f"swap memory: {swap_memory}"
+            f"Disk Usage: {disk.percent}% | "
+            f"Swap Usage: {swap_memory.percent}%"
         )
-        
-        # Print to console
-        print(log_entry.strip())
 
-        # Write to log file
-        log_file.write(log_entry)
-        log_file.flush()
+        # Buffered; written every 12 readings (one minute)
+        log.append((time.time(), cpu_percent, memory.percent, disk.percent, swap_memory.percent))
 
         # Wait 5 seconds before next reading
         time.sleep(5)
 
 except KeyboardInterrupt:
     print("\nMonitoring stopped by user.")
-    log_file.close()
+    log.close()
 
 
@@ -0,0 +1,54 @@
+# test_binlog.py
+# process_table_at must rebuild the same table as replaying the whole log,
+# including when a full table is split across segments.
+# Run with: python -m pytest -q (from core_python)
+import random
+import numpy as np
+from binlog import (BinaryLogReader, BinaryLogWriter, EVENT_CHANGED, EVENT_EXITED, EVENT_SNAPSHOT,
+                    EVENT_STARTED, process_table_at)
+
+def write_log(directory):
+    """Ten seconds of a process log: a full table every 3 s, events every second in between."""
+    rng = random.Random(7)
+    writer = BinaryLogWriter(str(directory), 'process', segment_records=7, flush_records=1)
+    table = {pid: 1.0 for pid in range(1, 6)}
+    next_pid = 6
+    for second in range(10):
+        t = 1000.0 + second
+        if second % 3 == 0:
+            writer.extend((t, EVENT_SNAPSHOT, pid, cpu, 1.0, b'p', b'u') for pid, cpu in sorted(table.items()))
+            continue
+        exited = rng.choice(sorted(table))
+        del table[exited]
+        table[next_pid] = 0.0
+        changed = rng.choice(sorted(table))
+        table[changed] = float(second)
+        writer.extend([(t, EVENT_EXITED, exited, 0.0, 0.0, b'p', b'u'),
+                       (t, EVENT_STARTED, next_pid, 0.0, 1.0, b'p', b'u'),
+                       (t, EVENT_CHANGED, changed, float(second), 1.0, b'p', b'u')])
+        next_pid += 1
+    writer.close()
+
+def replayed_table(directory, at):
+    """The table at time at, replaying every record from the start of the log."""
+    table = {}
+    for record in BinaryLogReader(str(directory)).read(end=np.nextafter(at, np.inf)):
+        if record['event'] == EVENT_EXITED:
+            table.pop(int(record['pid']), None)
+        else:
+            table[int(record['pid'])] = record
+    return table
+
+def test_table_matches_a_full_replay(tmp_path):
+    write_log(tmp_path)
+    assert len(BinaryLogReader(str(tmp_path)).segments()) > 3
+    for at in np.arange(999.0, 1010.0, 0.5):
+        expected = replayed_table(tmp_path, at)
+        table = process_table_at(str(tmp_path), at)
+        assert sorted(table) == sorted(expected), at
+        assert all(table[pid]['cpu_percent'] == expected[pid]['cpu_percent'] for pid in table)
+
+def test_no_snapshot_yet_gives_an_empty_table(tmp_path):
+    write_log(tmp_path)
+    assert process_table_at(str(tmp_path), 999.0) == {}
+    assert process_table_at(str(tmp_path / 'missing'), 1005.0) == {}
@@ -0,0 +1,38 @@
+# test_broadcast.py
+# Dashboard frames must carry only changed fields, and a host that expired and
+# came back must be sent in full, replacing what clients still hold for it.
+# Run with: python -m pytest -q (from core_python)
+import json
+from broadcast import BroadcastScheduler
+from host_state import HostRegistry
+
+def scheduler():
+    sent = []
+    broadcast = BroadcastScheduler(lambda event, payload, to: sent.append((to, json.loads(payload))))
+    return broadcast, sent
+
+def test_first_frame_is_a_keyframe_and_later_ones_are_deltas():
+    broadcast, sent = scheduler()
+    broadcast.publish('system_metrics', 'web-1', {'cpu': 10, 'memory': 40}, host_id='web-1')
+    broadcast.tick()
+    broadcast.publish('system_metrics', 'web-1', {'cpu': 12, 'memory': 40}, host_id='web-1')
+    broadcast.tick()
+    assert [frame.get('keyframe', False) for _, frame in sent] == [True, False]
+    assert sent[1][1]['updates'] == {'system_metrics': {'web-1': {'cpu': 12}}}
+
+def test_expired_host_is_forgotten_and_sent_in_full_when_it_returns():
+    broadcast, sent = scheduler()
+    registry = HostRegistry(expire_after=60.0, on_expire=broadcast.forget_hosts)
+    registry.add_traffic('web-1', 100, 100)
+    broadcast.publish('system_metrics', 'web-1', {'cpu': 10, 'memory': 40}, host_id='web-1')
+    broadcast.publish('network_traffic', 'all', {'sent': 1.0})
+    broadcast.tick()
+
+    registry.compute_rates(now=registry._last_rates + 3600.0)
+    assert [item for item in broadcast._state] == [('network_traffic', 'all')]
+
+    sent.clear()
+    broadcast.publish('system_metrics', 'web-1', {'cpu': 10}, host_id='web-1')
+    broadcast.tick()
+    assert sent == [('all', {'seq': sent[0][1]['seq'], 'time': sent[0][1]['time'], 'keyframe': True,
+                             'updates': {'system_metrics': {'web-1': {'cpu': 10}}}})]
@@ -0,0 +1,73 @@
+# test_detection_cascade.py
+# The cascade must skip allowlisted flows, run the stages in order, reuse a
+# flow's cached verdict per (host, flow) and keep rule alerts when the models fail.
+# Run with: python -m pytest -q (from core_python)
+from detection_cascade import DetectionCascade
+from score_cache import ScoreCache
+from stream_aggregates import StreamAggregates
+
+FLOW = '10.0.0.5:51000-192.168.1.10:443'
+
+def record(flow_key=FLOW, host_id='host-a', packets=10, **fields):
+    data = {'flow_key': flow_key, 'host_id': host_id, 'packet_count': packets, 'total_bytes': packets * 100,
+            'src_ip': '10.0.0.5', 'dst_ip': '192.168.1.10', 'dst_port': 443}
+    data.update(fields)
+    return data
+
+class Models:
+    """Scores every record 0.5 and counts the records it saw."""
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.scored = []
+
+    def __call__(self, records, flagged):
+        if self.fail:
+            raise RuntimeError("worker died")
+        self.scored.extend(records)
+        return [[] for _ in records], [0.5] * len(records)
+
+def rules(record):
+    return [{"description": "Large Flow"}] if record['packet_count'] > 1000 else []
+
+def cascade(models, **options):
+    return DetectionCascade(rules, models, cache=ScoreCache(), features=('packet_count', 'total_bytes'), **options)
+
+def test_allowlisted_flows_stop_before_every_other_stage():
+    models = Models()
+    engine = cascade(models, allowlist={'192.168.1.10:443'})
+    assert engine.detect_threats_batch([record(packets=5000)]) == [[]]
+    assert models.scored == []
+    stats = engine.stats()
+    assert stats['allowlist']['hits'] == 1 and stats['rules']['seen'] == 0
+
+def test_stages_run_in_order_and_rule_hits_skip_the_cache():
+    models = Models()
+    engine = cascade(models, aggregates=StreamAggregates())
+    alerts = engine.detect_threats_batch([record(packets=5000), record(flow_key='10.0.0.6:1-192.168.1.10:443')])
+    assert alerts == [[{"description": "Large Flow"}], []]
+    stats = engine.stats()
+    assert [stats[stage]['seen'] for stage in ('allowlist', 'rules', 'aggregates', 'cache', 'models')] == [2, 2, 2, 1, 2]
+
+def test_cached_verdict_is_keyed_by_host_and_flow():
+    models = Models()
+    engine = cascade(models)
+    engine.detect_threats_batch([record()])
+    engine.detect_threats_batch([record(), record(host_id='host-b')])
+    # The same flow_key on another host is a different flow and is scored
+    assert [r['host_id'] for r in models.scored] == ['host-a', 'host-b']
+    assert engine.stats()['cache']['hits'] == 1
+
+def test_final_record_is_scored_and_evicts_its_cache_entry():
+    models = Models()
+    engine = cascade(models)
+    engine.detect_threats_batch([record()])
+    engine.detect_threats_batch([record(emit_reason='fin')])
+    assert len(models.scored) == 2
+    assert len(engine.cache) == 0
+
+def test_model_failure_keeps_rule_alerts_and_caches_nothing():
+    engine = cascade(Models(fail=True))
+    alerts = engine.detect_threats_batch([record(packets=5000), record(flow_key='10.0.0.6:1-192.168.1.10:443')])
+    assert alerts == [[{"description": "Large Flow"}], []]
+    assert engine.stats()['models']['errors'] == 1
+    assert len(engine.cache) == 0
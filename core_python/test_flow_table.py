@@ -0,0 +1,48 @@
+# test_flow_table.py
+# The flow table must evict the least recently updated flow when full, expire
+# idle flows and let a closed flow's key swallow its trailing packets.
+# Run with: python -m pytest -q (from core_python)
+from flow_table import FlowRecord, FlowTable, TCP_ACK, TCP_FIN, TCP_SYN
+
+def table(**options):
+    expired = []
+    flows = FlowTable(FlowRecord, lambda key, stats, reason: expired.append((key, reason)), **options)
+    return flows, expired
+
+def test_full_table_evicts_the_least_recently_updated_flow():
+    flows, expired = table(max_flows=3)
+    for key in ('a', 'b', 'c'):
+        flows.touch(key)
+    flows.touch('a') # 'b' is now the oldest
+    flows.touch('d')
+    assert expired == [('b', 'capacity')]
+    assert sorted(key for key, _ in flows.items()) == ['a', 'c', 'd']
+    assert flows.metrics()['evictions']['capacity'] == 1
+
+def test_idle_flows_expire_in_order_of_last_packet():
+    flows, expired = table(idle_timeout=15.0)
+    for key, at in (('a', 0.0), ('b', 10.0), ('c', 20.0)):
+        flows.touch(key).add_packet(60, TCP_ACK, at, True)
+    assert flows.expire_idle(now=26.0) == 2
+    assert expired == [('a', 'idle_timeout'), ('b', 'idle_timeout')]
+    assert 'c' in flows
+
+def test_closed_flow_absorbs_trailing_packets_until_linger_ends():
+    flows, expired = table(linger=5.0)
+    flows.touch('a').add_packet(60, TCP_SYN, 0.0, True)
+    flows.close('a', now=1.0)
+    assert 'a' not in flows
+    assert flows.absorbs('a', TCP_ACK, now=2.0)
+    assert flows.absorbs('a', TCP_FIN | TCP_ACK, now=3.0)
+    assert not flows.absorbs('a', TCP_ACK, now=6.5)
+    # A closed flow is not reported as expired; its final record was already emitted
+    assert expired == []
+    assert flows.metrics()['absorbed'] == 2
+
+def test_syn_on_a_closed_key_opens_a_new_connection():
+    flows, _ = table(linger=5.0)
+    flows.touch('a')
+    flows.close('a', now=1.0)
+    assert not flows.absorbs('a', TCP_SYN, now=1.5)
+    # The key stopped lingering, so the new connection's ACKs are not swallowed
+    assert not flows.absorbs('a', TCP_ACK, now=1.6)
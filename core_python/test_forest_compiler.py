@@ -0,0 +1,64 @@
+# test_forest_compiler.py
+# The compiled forests must score exactly like the sklearn estimators they replace.
+# Run with: python -m pytest -q (from core_python)
+import os
+import warnings
+import joblib
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest, RandomForestClassifier
+from forest_compiler import CompiledIsolationForest, CompiledRandomForest, compile_forest
+
+def make_data(rows=2000, features=6, seed=0):
+    rng = np.random.default_rng(seed)
+    X = rng.lognormal(mean=3.0, sigma=2.0, size=(rows, features))
+    y = (X[:, 0] > X[:, 1]).astype(int) + (X[:, 2] > 50)
+    return X, y
+
+@pytest.mark.parametrize('options', [{}, {'max_features': 0.5}, {'max_samples': 64}, {'bootstrap': True}])
+def test_isolation_forest_scores_match(options):
+    X, _ = make_data()
+    model = IsolationForest(n_estimators=50, random_state=1, **options).fit(X)
+    compiled = compile_forest(model)
+    assert isinstance(compiled, CompiledIsolationForest)
+    X_test, _ = make_data(rows=500, seed=2)
+    assert np.array_equal(compiled.score_samples(X_test), model.score_samples(X_test))
+    assert np.array_equal(compiled.decision_function(X_test), model.decision_function(X_test))
+
+def test_random_forest_probabilities_match():
+    X, y = make_data()
+    # Missing values are only supported by sklearn's trees without bootstrapping features
+    X[::17, 3] = np.nan
+    model = RandomForestClassifier(n_estimators=30, max_depth=12, random_state=1).fit(X, y)
+    compiled = compile_forest(model)
+    assert isinstance(compiled, CompiledRandomForest)
+    X_test, _ = make_data(rows=500, seed=2)
+    X_test[::5, 3] = np.nan
+    assert np.array_equal(compiled.predict_proba(X_test), model.predict_proba(X_test))
+    assert np.array_equal(compiled.predict(X_test), model.predict(X_test))
+
+def test_shipped_model_scores_match():
+    path = os.path.join(os.path.dirname(__file__), 'isolation_forest_model.joblib')
+    if not os.path.exists(path):
+        pytest.skip("isolation_forest_model.joblib not present")
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        model = joblib.load(path)
+        compiled = compile_forest(model)
+        assert isinstance(compiled, CompiledIsolationForest)
+        X = make_data(rows=1000, features=model.n_features_in_, seed=3)[0]
+        assert np.array_equal(compiled.decision_function(X), model.decision_function(X))
+
+def test_falls_back_to_sklearn_when_compiling_fails(monkeypatch):
+    X, _ = make_data()
+    model = IsolationForest(n_estimators=10, random_state=1).fit(X)
+    def broken(self, model):
+        raise AttributeError("estimators_features_")
+    monkeypatch.setattr(CompiledIsolationForest, '__init__', broken)
+    assert compile_forest(model) is model
+
+def test_falls_back_to_sklearn_when_scores_differ(monkeypatch):
+    X, _ = make_data()
+    model = IsolationForest(n_estimators=10, random_state=1).fit(X)
+    monkeypatch.setattr(CompiledIsolationForest, 'score_samples', lambda self, X: np.zeros(len(X)))
+    assert compile_forest(model) is model
@@ -0,0 +1,57 @@
+# test_process_table.py
+# Process tables sent as keyframes and deltas must rebuild the agent's table,
+# flag missed deltas until the next keyframe and ignore deltas that arrive late.
+# Run with: python -m pytest -q (from core_python)
+from process_table import ProcessDeltaEncoder, ProcessTable
+
+def process(pid, cpu=0.0, memory=1.0, name=None):
+    return {'pid': pid, 'name': name or f"proc{pid}", 'cpu_percent': cpu, 'memory_percent': memory}
+
+def test_deltas_rebuild_the_agent_table():
+    encoder, table = ProcessDeltaEncoder(keyframe_every=30), ProcessTable()
+    ticks = [
+        [process(1), process(2), process(3)],
+        [process(1, cpu=50.0), process(2), process(4)],     # 1 busier, 3 exited, 4 started
+        [process(1, cpu=50.4), process(4, memory=3.0)],     # 1 within the threshold, 2 exited, 4 grew
+    ]
+    for processes in ticks:
+        assert table.apply(encoder.encode(processes))
+    assert sorted(table.processes) == [1, 4]
+    assert table.processes[1][2] == 50.0 # the 0.4% drift was not worth resending
+    assert table.processes[4][3] == 3.0
+    assert (table.keyframes, table.deltas, table.gaps) == (1, 2, 0)
+
+def test_small_drifts_add_up_until_resent():
+    encoder = ProcessDeltaEncoder(cpu_threshold=1.0, keyframe_every=30)
+    encoder.encode([process(1, cpu=10.0)])
+    assert encoder.encode([process(1, cpu=10.6)])['changed'] == []
+    assert encoder.encode([process(1, cpu=11.2)])['changed'] == [[1, 11.2, 1.0]]
+
+def test_missed_delta_is_stale_until_the_next_keyframe():
+    encoder, table = ProcessDeltaEncoder(keyframe_every=4), ProcessTable()
+    messages = [encoder.encode([process(1), process(pid)]) for pid in range(2, 7)]
+    assert messages[0]['keyframe'] and messages[4]['keyframe']
+    assert table.apply(messages[0])
+    assert table.apply(messages[1])
+    # messages[2] is lost
+    assert not table.apply(messages[3])
+    assert table.stale and table.gaps == 1
+    assert table.apply(messages[4])
+    assert sorted(table.processes) == [1, 6]
+
+def test_late_delta_is_ignored():
+    encoder, table = ProcessDeltaEncoder(keyframe_every=30), ProcessTable()
+    first = encoder.encode([process(1), process(2)])
+    exited = encoder.encode([process(1)])
+    started = encoder.encode([process(1), process(3)])
+    for message in (first, exited, started):
+        table.apply(message)
+    # A delayed copy of an older delta must not change the table
+    assert table.apply(exited)
+    assert table.late == 1
+    assert sorted(table.processes) == [1, 3]
+
+def test_renamed_pid_is_sent_as_started():
+    encoder = ProcessDeltaEncoder(keyframe_every=30)
+    encoder.encode([process(1, name='old')])
+    assert encoder.encode([process(1, name='new')])['started'] == [[1, 'new', 0.0, 1.0]]
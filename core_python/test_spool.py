@@ -0,0 +1,72 @@
+# test_spool.py
+# The spool must hand back every stored batch exactly once, oldest first,
+# across failed replays, restarts, torn writes and the size cap.
+# Run with: python -m pytest -q (from core_python)
+import os
+from spool import Spool, ENTRY_HEADER, SEGMENT_SUFFIX
+
+def fill(spool, batches, size=100):
+    for i in range(batches):
+        spool.append(bytes([i]) * size, 0, i + 1)
+
+def replay_all(spool):
+    delivered = []
+    emptied = spool.replay(lambda payload, encoding, count: delivered.append(count) or True)
+    return delivered, emptied
+
+def segment_files(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(SEGMENT_SUFFIX))
+
+def test_replays_oldest_first_across_segments_and_deletes_them(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=350)
+    fill(spool, 10)
+    assert len(segment_files(tmp_path)) > 1
+    delivered, emptied = replay_all(spool)
+    assert delivered == list(range(1, 11))
+    assert emptied
+    assert segment_files(tmp_path) == []
+    assert spool.stats()['bytes'] == 0
+
+def test_failed_replay_resumes_after_the_last_delivered_entry(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=10000)
+    fill(spool, 5)
+    delivered = []
+    def deliver(payload, encoding, count):
+        if count == 3:
+            return False
+        delivered.append(count)
+        return True
+    assert spool.replay(deliver) is False
+    assert delivered == [1, 2]
+    spool.close()
+
+    # A restarted agent picks up where the failed replay stopped, without resending
+    restarted = Spool(str(tmp_path), segment_bytes=10000)
+    assert replay_all(restarted) == ([3, 4, 5], True)
+
+def test_restart_appends_after_the_existing_segments(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=250)
+    fill(spool, 3)
+    spool.close()
+    restarted = Spool(str(tmp_path), segment_bytes=250)
+    restarted.append(b'x' * 100, 0, 99)
+    assert replay_all(restarted)[0] == [1, 2, 3, 99]
+
+def test_torn_write_keeps_the_complete_entries(tmp_path):
+    spool = Spool(str(tmp_path))
+    fill(spool, 3)
+    spool.close()
+    # A crash in the middle of an append leaves a header without its whole payload
+    path = os.path.join(tmp_path, segment_files(tmp_path)[-1])
+    with open(path, 'ab') as f:
+        f.write(ENTRY_HEADER.pack(100, 0, 7) + b'y' * 10)
+    assert replay_all(Spool(str(tmp_path)))[0] == [1, 2, 3]
+
+def test_size_cap_evicts_the_oldest_segments(tmp_path):
+    entry = ENTRY_HEADER.size + 100
+    spool = Spool(str(tmp_path), segment_bytes=2 * entry, max_bytes=4 * entry)
+    fill(spool, 10)
+    stats = spool.stats()
+    assert stats['bytes'] <= 4 * entry
+    assert stats['evicted_segments'] == 3
+    assert replay_all(spool)[0] == [7, 8, 9, 10]
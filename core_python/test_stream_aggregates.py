@@ -0,0 +1,95 @@
+# test_stream_aggregates.py
+# The scan and flood rules must alert once when an estimate crosses its
+# threshold, only count flows an agent saw being opened, and forget counts
+# that slid out of the window.
+# Run with: python -m pytest -q (from core_python)
+from stream_aggregates import HyperLogLog, StreamAggregates, WindowedCountMin
+
+def flow(src='10.0.0.5', dst='192.168.1.10', dport=443, new_flow=True, **fields):
+    record = {'src_ip': src, 'dst_ip': dst, 'dst_port': dport, 'packet_count': 10, 'syn_flag_count': 1,
+              'ack_flag_count': 9, 'rst_flag_count': 0}
+    if new_flow is not None:
+        record['new_flow'] = new_flow
+    record.update(fields)
+    return record
+
+def descriptions(alerts):
+    return [alert['description'] for alert in alerts]
+
+def test_count_min_add_returns_the_estimate_before_and_after():
+    sketch = WindowedCountMin(window=60.0, slots=6)
+    assert sketch.add('a', 1, now=0.0) == (0, 1)
+    assert sketch.add('a', 3, now=1.0) == (1, 4)
+    assert sketch.estimate('a', now=2.0) == 4
+
+def test_count_min_forgets_counts_older_than_the_window():
+    sketch = WindowedCountMin(window=60.0, slots=6)
+    sketch.add('a', 5, now=0.0)
+    sketch.add('a', 1, now=30.0)
+    assert sketch.estimate('a', now=59.0) == 6
+    assert sketch.estimate('a', now=65.0) == 1
+    assert sketch.estimate('a', now=200.0) == 0
+
+def test_connection_flood_alerts_once_per_window():
+    aggregates = StreamAggregates(window=60.0, source_flow_threshold=20, scan_threshold=10**6)
+    alerts = []
+    for i in range(100):
+        alerts += aggregates.observe(flow(dport=80), now=i * 0.1)
+    assert descriptions(alerts) == ['Connection Flood Detected']
+
+    # The window slides past the burst; the next one alerts again
+    alerts = []
+    for i in range(30):
+        alerts += aggregates.observe(flow(dport=80), now=200.0 + i * 0.1)
+    assert descriptions(alerts) == ['Connection Flood Detected']
+
+def test_crossing_is_judged_on_the_shared_estimate():
+    # One counter for every key: another source's flows push this source's estimate past the threshold
+    aggregates = StreamAggregates(source_flow_threshold=20, scan_threshold=10**6, sketch_width=1, sketch_depth=1)
+    for i in range(15):
+        assert aggregates.observe(flow(src='10.0.0.9'), now=1.0) == []
+    alerts = []
+    for i in range(10):
+        alerts += aggregates.observe(flow(src='10.0.0.5'), now=1.0)
+    assert len(alerts) == 1 and alerts[0]['details'].startswith('10.0.0.5 ')
+    assert aggregates.stats()['connection_flood'] == 1
+
+def test_only_opened_flows_are_counted():
+    aggregates = StreamAggregates(source_flow_threshold=5, scan_threshold=10**6)
+    # Later records of long flows, and flows picked up mid-connection, are not new flows
+    for i in range(50):
+        assert aggregates.observe(flow(new_flow=False), now=1.0) == []
+    # Older agents: only a first record (deltas covering the whole flow) with a SYN counts
+    legacy = flow(new_flow=None, syn_flag_count=0, src_bytes=10, src_bytes_delta=10, dst_bytes=5, dst_bytes_delta=5)
+    for i in range(50):
+        assert aggregates.observe(legacy, now=1.0) == []
+    assert aggregates.source_flows.estimate('10.0.0.5', now=1.0) == 0
+
+def test_half_open_flows_raise_a_syn_flood():
+    aggregates = StreamAggregates(syn_flood_threshold=50, source_flow_threshold=10**6, scan_threshold=10**6)
+    alerts = []
+    for i in range(200):
+        alerts += aggregates.observe(flow(src=f"10.1.{i // 250}.{i % 250}", dport=8080, packet_count=1,
+                                          syn_flag_count=1, ack_flag_count=0), now=1.0)
+    assert descriptions(alerts) == ['SYN Flood Detected']
+    # Completed handshakes to the same port are not half-open
+    assert aggregates.half_open.estimate(443, now=1.0) == 0
+
+def test_port_scan_alerts_once_and_clients_of_one_server_do_not():
+    aggregates = StreamAggregates(scan_threshold=100, source_flow_threshold=10**6)
+    alerts = []
+    for port in range(1, 1001):
+        alerts += aggregates.observe(flow(src='172.16.6.6', dport=port), now=1.0)
+    assert descriptions(alerts) == ['Port Scan Detected']
+
+    # Many clients of one server: one destination each, no scan
+    alerts = []
+    for i in range(500):
+        alerts += aggregates.observe(flow(src=f"10.2.{i // 250}.{i % 250}", dst='10.0.0.1'), now=2.0)
+    assert alerts == []
+
+def test_hyperloglog_estimate_is_close():
+    hll = HyperLogLog(precision=8)
+    for i in range(5000):
+        hll.add(f"10.0.{i // 256}.{i % 256}:80")
+    assert abs(hll.estimate() - 5000) < 5000 * 0.2
@@ -0,0 +1,35 @@
+# test_timeseries_store.py
+# History must be bucketed by when the agent produced a record, so batches
+# delivered late (spooled, retried) do not pile into the arrival second.
+# Run with: python -m pytest -q (from core_python)
+from timeseries_store import TimeSeriesStore
+
+def flow(**fields):
+    record = {'type': 'network_flow', 'host_id': 'web-1', 'flow_key': '10.0.0.5:1-10.0.0.6:80',
+              'src_bytes_delta': 100, 'dst_bytes_delta': 50}
+    record.update(fields)
+    return record
+
+def test_records_are_bucketed_at_their_timestamp(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'history.db'))
+    arrival = 1_700_000_000.0
+    store.add_record({'type': 'system_metrics', 'host_id': 'web-1', 'timestamp': arrival - 600,
+                      'metrics': {'cpu_usage': 20.0}}, now=arrival)
+    store.add_record(flow(timestamp=arrival - 600), now=arrival)
+    store.add_alerts(flow(timestamp=arrival - 600), [{'description': 'Port Scan Detected'}], now=arrival)
+    store.flush()
+    start, end = arrival - 3600, arrival + 60
+    assert [row['time'] for row in store.metrics('web-1', start, end, resolution=60)] == [(arrival - 600) // 60 * 60]
+    assert [row['time'] for row in store.flows('web-1', start, end)] == [arrival - 600]
+    assert [row['time'] for row in store.alerts('web-1', start, end)] == [arrival - 600]
+    store.close()
+
+def test_missing_or_future_timestamps_fall_back_to_arrival(tmp_path):
+    store = TimeSeriesStore(str(tmp_path / 'history.db'))
+    arrival = 1_700_000_000.0
+    store.add_record(flow(), now=arrival)
+    store.add_record(flow(timestamp=arrival + 3600), now=arrival)
+    store.add_record(flow(timestamp='garbage'), now=arrival)
+    store.flush()
+    assert [row['time'] for row in store.flows('web-1', arrival - 60, arrival + 7200)] == [arrival] * 3
+    store.close()
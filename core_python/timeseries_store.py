@@ -0,0 +1,377 @@
+# timeseries_store.py
+# Embedded history of what the server receives, in one SQLite file in WAL
+# mode. Records are queued in memory and a writer thread inserts them in one
+# transaction per flush, so the ingest path never waits on the disk.
+#
+# - metrics, traffic: per-host rollups at 1s, 1m and 1h resolution (CPU and
+#   memory averages and peaks; flows and bytes). Each flush folds its records
+#   into buckets in memory and upserts one row per (resolution, host, bucket).
+# - flows, alerts: one row per flow record and per alert.
+#
+# Every table is indexed by host and time for range queries, and rows older
+# than their table's retention are deleted by a periodic compaction. Readers
+# use their own connections; in WAL mode they never block the writer.
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from host_state import DEFAULT_HOST
+from downsample import downsample
+
+RESOLUTIONS = (1, 60, 3600) # rollup bucket sizes in seconds
+
+# Seconds each kind of row is kept
+DEFAULT_RETENTION = {
+    1: 6 * 3600,
+    60: 7 * 86400,
+    3600: 365 * 86400,
+    'flows': 86400,
+    'alerts': 30 * 86400,
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    resolution INTEGER, host_id TEXT, bucket INTEGER, samples INTEGER,
+    cpu_sum REAL, cpu_max REAL, memory_sum REAL, memory_max REAL, load_sum REAL,
+    PRIMARY KEY (resolution, host_id, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS metrics_bucket ON metrics (resolution, bucket);
+
+CREATE TABLE IF NOT EXISTS traffic (
+    resolution INTEGER, host_id TEXT, bucket INTEGER, flows INTEGER, bytes_sent INTEGER, bytes_received INTEGER,
+    PRIMARY KEY (resolution, host_id, bucket)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS traffic_bucket ON traffic (resolution, bucket, bytes_sent, bytes_received, flows);
+
+CREATE TABLE IF NOT EXISTS flows (
+    time REAL, host_id TEXT, flow_key TEXT, src_ip TEXT, src_port INTEGER, dst_ip TEXT, dst_port INTEGER,
+    packet_count INTEGER, src_bytes INTEGER, dst_bytes INTEGER, flow_duration REAL, emit_reason TEXT
+);
+CREATE INDEX IF NOT EXISTS flows_host_time ON flows (host_id, time);
+CREATE INDEX IF NOT EXISTS flows_time ON flows (time);
+
+CREATE TABLE IF NOT EXISTS alerts (
+    time REAL, host_id TEXT, flow_key TEXT, type TEXT, severity TEXT, description TEXT, details TEXT
+);
+CREATE INDEX IF NOT EXISTS alerts_host_time ON alerts (host_id, time);
+CREATE INDEX IF NOT EXISTS alerts_time ON alerts (time);
+"""
+
+UPSERT_METRICS = """
+INSERT INTO metrics VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, host_id, bucket) DO UPDATE SET
+    samples = samples + excluded.samples,
+    cpu_sum = cpu_sum + excluded.cpu_sum, cpu_max = MAX(cpu_max, excluded.cpu_max),
+    memory_sum = memory_sum + excluded.memory_sum, memory_max = MAX(memory_max, excluded.memory_max),
+    load_sum = load_sum + excluded.load_sum
+"""
+
+UPSERT_TRAFFIC = """
+INSERT INTO traffic VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (resolution, host_id, bucket) DO UPDATE SET
+    flows = flows + excluded.flows,
+    bytes_sent = bytes_sent + excluded.bytes_sent, bytes_received = bytes_received + excluded.bytes_received
+"""
+
+FLOW_COLUMNS = ('flow_key', 'src_ip', 'src_port', 'dst_ip', 'dst_port', 'packet_count', 'src_bytes', 'dst_bytes',
+                'flow_duration', 'emit_reason')
+
+def record_time(record, now):
+    """
+    When the agent produced the record: its 'timestamp', so records delivered late (spooled,
+    retried, queued) land in the bucket they belong to. Records without one, or stamped in the
+    future by an agent whose clock runs ahead, fall back to the arrival time now.
+    """
+    try:
+        timestamp = float(record['timestamp'])
+    except (KeyError, TypeError, ValueError):
+        return now
+    return timestamp if timestamp <= now else now
+
+class TimeSeriesStore:
+    def __init__(self, path, flush_interval=1.0, max_queue=100000, retention=None, compact_interval=300.0,
+                 offload=None):
+        """
+        :param path: SQLite database file; created with its directory if missing.
+        :param flush_interval: Seconds between write transactions.
+        :param max_queue: Records waiting for the writer; further records are dropped and counted.
+        :param retention: Seconds rows are kept, keyed by resolution (1, 60, 3600), 'flows' and 'alerts';
+                          missing keys keep DEFAULT_RETENTION.
+        :param compact_interval: Seconds between deletions of expired rows.
+        :param offload: Runs a write transaction, as offload(fn, *args); by default it is called directly.
+                        Under eventlet, eventlet.tpool.execute keeps the hub serving during the commit.
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.retention = dict(DEFAULT_RETENTION, **(retention or {}))
+        self.compact_interval = compact_interval
+        self.offload = offload or (lambda fn, *args: fn(*args))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._db = self._connect(writer=True)
+        self._db.executescript(SCHEMA)
+        self._write_lock = threading.Lock()
+        self._readers = [] # idle read connections
+        self._readers_lock = threading.Lock()
+
+        self._queue = deque() # ('metrics' | 'flow' | 'alert', time, host_id, payload)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._last_compaction = time.monotonic()
+        self.counters = {'queued': 0, 'dropped': 0, 'written': 0, 'flushes': 0, 'compactions': 0, 'expired_rows': 0}
+        self.last_flush_ms = 0.0
+
+    def _connect(self, writer=False):
+        db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        if writer:
+            # Lets compaction hand freed pages back; only takes effect on a new database, before WAL is enabled
+            db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        db.execute("PRAGMA journal_mode = WAL")
+        # In WAL mode NORMAL only syncs at checkpoints; a crash can lose the last flushes, never corrupt the file
+        db.execute("PRAGMA synchronous = NORMAL")
+        return db
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Writes what is still queued and stops the writer."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def close(self):
+        self.stop()
+        with self._readers_lock:
+            for db in self._readers:
+                db.close()
+            self._readers = []
+        self._db.close()
+
+    # --- Producers (any thread) ---
+
+    def _put(self, item):
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                self.counters['dropped'] += 1
+                return
+            self._queue.append(item)
+            self.counters['queued'] += 1
+
+    def add_record(self, record, now=None):
+        """
+        Queues an agent record: system_metrics go to the metrics rollups, network_flow to traffic and flows.
+        Rows are placed at the record's timestamp; now (default: arrival time) is used without one.
+        """
+        now = record_time(record, time.time() if now is None else now)
+        data_type = record.get('type')
+        if data_type == 'system_metrics':
+            self._put(('metrics', now, str(record.get('host_id', DEFAULT_HOST)), record.get('metrics') or {}))
+        elif data_type == 'network_flow':
+            self._put(('flow', now, str(record.get('host_id', DEFAULT_HOST)), record))
+
+    def add_alerts(self, record, alerts, now=None):
+        """Queues the alerts raised for one record (fits the ingest pipeline's on_alerts), at the record's timestamp."""
+        now = record_time(record, time.time() if now is None else now)
+        host_id = str(record.get('host_id', DEFAULT_HOST))
+        for alert in alerts:
+            self._put(('alert', now, host_id, (record.get('flow_key'), alert)))
+
+    # --- Writer ---
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() - self._last_compaction >= self.compact_interval:
+                    self.offload(self.compact)
+            except Exception as e:
+                print(f"Error writing history: {e}")
+
+    def flush(self):
+        """Writes everything queued in one transaction; returns the number of records written."""
+        with self._lock:
+            items, self._queue = self._queue, deque()
+        if not items:
+            return 0
+        self.offload(self._write, items)
+        return len(items)
+
+    def _write(self, items):
+        start = time.perf_counter()
+        metrics = {} # (resolution, host_id, bucket) -> [samples, cpu_sum, cpu_max, memory_sum, memory_max, load_sum]
+        traffic = {} # (resolution, host_id, bucket) -> [flows, bytes_sent, bytes_received]
+        flows = []
+        alerts = []
+        for kind, at, host_id, payload in items:
+            if kind == 'metrics':
+                cpu = float(payload.get('cpu_usage') or 0.0)
+                memory = float(payload.get('memory_usage') or 0.0)
+                load = float(payload.get('cpu_load') or 0.0)
+                for resolution in RESOLUTIONS:
+                    row = metrics.get((resolution, host_id, int(at // resolution)))
+                    if row is None:
+                        metrics[(resolution, host_id, int(at // resolution))] = [1, cpu, cpu, memory, memory, load]
+                    else:
+                        row[0] += 1
+                        row[1] += cpu
+                        row[2] = max(row[2], cpu)
+                        row[3] += memory
+                        row[4] = max(row[4], memory)
+                        row[5] += load
+            elif kind == 'flow':
+                # Byte deltas, so a flow reported several times is not counted several times
+                sent = payload.get('src_bytes_delta', payload.get('src_bytes', 0)) or 0
+                received = payload.get('dst_bytes_delta', payload.get('dst_bytes', 0)) or 0
+                for resolution in RESOLUTIONS:
+                    row = traffic.setdefault((resolution, host_id, int(at // resolution)), [0, 0, 0])
+                    row[0] += 1
+                    row[1] += sent
+                    row[2] += received
+                flows.append((at, host_id) + tuple(payload.get(column) for column in FLOW_COLUMNS))
+            else:
+                flow_key, alert = payload
+                alerts.append((at, host_id, flow_key, alert.get('type'), alert.get('severity'),
+                               alert.get('description'), str(alert.get('details', ''))))
+
+        with self._write_lock:
+            db = self._db
+            db.execute("BEGIN")
+            try:
+                db.executemany(UPSERT_METRICS, [key + tuple(row) for key, row in metrics.items()])
+                db.executemany(UPSERT_TRAFFIC, [key + tuple(row) for key, row in traffic.items()])
+                db.executemany("INSERT INTO flows VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", flows)
+                db.executemany("INSERT INTO alerts VALUES (?, ?, ?, ?, ?, ?, ?)", alerts)
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        with self._lock:
+            self.counters['written'] += len(items)
+            self.counters['flushes'] += 1
+            self.last_flush_ms = (time.perf_counter() - start) * 1000
+
+    def compact(self, now=None):
+        """Deletes rows past their retention, returns the freed pages and truncates the WAL."""
+        now = time.time() if now is None else now
+        self._last_compaction = time.monotonic()
+        with self._write_lock:
+            db = self._db
+            expired = 0
+            db.execute("BEGIN")
+            for resolution in RESOLUTIONS:
+                cutoff = int((now - self.retention[resolution]) // resolution)
+                for table in ('metrics', 'traffic'):
+                    expired += db.execute(f"DELETE FROM {table} WHERE resolution = ? AND bucket < ?",
+                                          (resolution, cutoff)).rowcount
+            expired += db.execute("DELETE FROM flows WHERE time < ?", (now - self.retention['flows'],)).rowcount
+            expired += db.execute("DELETE FROM alerts WHERE time < ?", (now - self.retention['alerts'],)).rowcount
+            db.execute("COMMIT")
+            db.execute("PRAGMA incremental_vacuum")
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        with self._lock:
+            self.counters['compactions'] += 1
+            self.counters['expired_rows'] += expired
+        return expired
+
+    # --- Queries (any thread) ---
+
+    def _query(self, sql, params):
+        with self._readers_lock:
+            db = self._readers.pop() if self._readers else None
+        if db is None:
+            db = self._connect()
+            db.row_factory = sqlite3.Row
+        try:
+            return [dict(row) for row in db.execute(sql, params)]
+        finally:
+            with self._readers_lock:
+                self._readers.append(db)
+
+    def metrics(self, host_id, start, end, resolution=60):
+        """A host's CPU, memory and load per bucket between start and end (epoch seconds), oldest first."""
+        return self._query(
+            "SELECT bucket * :resolution AS time, samples, cpu_sum / samples AS cpu_usage, cpu_max, "
+            "memory_sum / samples AS memory_usage, memory_max, load_sum / samples AS cpu_load FROM metrics "
+            "WHERE resolution = :resolution AND host_id = :host AND bucket BETWEEN :first AND :last ORDER BY bucket",
+            {'resolution': resolution, 'host': host_id, 'first': int(start // resolution), 'last': int(end // resolution)})
+
+    def traffic(self, host_id, start, end, resolution=1):
+        """
+        Flows and bytes per bucket between start and end, oldest first, with rates in bytes/s.
+        host_id None sums over all hosts.
+        """
+        params = {'resolution': resolution, 'host': host_id, 'first': int(start // resolution),
+                  'last': int(end // resolution)}
+        columns = ("bucket * :resolution AS time, SUM(flows) AS flows, SUM(bytes_sent) AS bytes_sent, "
+                   "SUM(bytes_received) AS bytes_received, SUM(bytes_sent) * 1.0 / :resolution AS sent, "
+                   "SUM(bytes_received) * 1.0 / :resolution AS received")
+        if host_id is None:
+            return self._query(f"SELECT {columns} FROM traffic WHERE resolution = :resolution "
+                               "AND bucket BETWEEN :first AND :last GROUP BY bucket ORDER BY bucket", params)
+        return self._query(f"SELECT {columns} FROM traffic WHERE resolution = :resolution AND host_id = :host "
+                           "AND bucket BETWEEN :first AND :last GROUP BY bucket ORDER BY bucket", params)
+
+    def traffic_series(self, host_id, start, end, step=None, points=500, method='lttb', now=None):
+        """
+        Sent and received rates between start and end for a chart, as columns
+        {'time', 'sent', 'received', 'resolution'}. Reads the coarsest rollup finer than step
+        (by default (end - start) / points) that still covers start, fills seconds without
+        traffic with zeros, then downsamples to at most points points with method ('lttb' or
+        'minmax'), keeping the chosen points' values as they are. An empty range (or a step
+        that is not positive) gives empty columns.
+        """
+        now = time.time() if now is None else now
+        step = step or (end - start) / points
+        if step <= 0:
+            return {'sent': [], 'received': [], 'time': [], 'resolution': RESOLUTIONS[0]}
+        usable = [r for r in RESOLUTIONS if start >= now - self.retention[r]] or [RESOLUTIONS[-1]]
+        finer = [r for r in usable if r <= step]
+        resolution = finer[-1] if finer else usable[0]
+
+        # Nothing older than the retention or newer than now exists; this also bounds the zero filling
+        start, end = max(start, now - self.retention[resolution]), min(end, now)
+        rows = {row['time']: row for row in self.traffic(host_id, start, end, resolution)}
+        first, last = int(start // resolution), int(end // resolution)
+        times = [bucket * resolution for bucket in range(first, last + 1)]
+        empty = {'sent': 0.0, 'received': 0.0}
+        series = {
+            'sent': [rows.get(t, empty)['sent'] for t in times],
+            'received': [rows.get(t, empty)['received'] for t in times],
+        }
+        points = min(points, max(int((end - start) / step), 3))
+        times, series = downsample(times, series, points, method)
+        return dict(series, time=times, resolution=resolution)
+
+    def _events(self, table, host_id, start, end, limit):
+        params = {'host': host_id, 'start': start, 'end': end, 'limit': limit}
+        where = "time BETWEEN :start AND :end" if host_id is None else "host_id = :host AND time BETWEEN :start AND :end"
+        return self._query(f"SELECT * FROM {table} WHERE {where} ORDER BY time DESC LIMIT :limit", params)
+
+    def flows(self, host_id, start, end, limit=1000):
+        """Flow records between start and end, newest first; host_id None means all hosts."""
+        return self._events('flows', host_id, start, end, limit)
+
+    def alerts(self, host_id, start, end, limit=1000):
+        """Alerts between start and end, newest first; host_id None means all hosts."""
+        return self._events('alerts', host_id, start, end, limit)
+
+    def stats(self):
+        """Records queued, dropped and written, flushes, compactions, the last flush time and the file sizes."""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['pending'] = len(self._queue)
+            stats['last_flush_ms'] = self.last_flush_ms
+        for key, suffix in (('db_bytes', ''), ('wal_bytes', '-wal')):
+            try:
+                stats[key] = os.path.getsize(self.path + suffix)
+            except OSError:
+                stats[key] = 0
+        return stats
@@ -5,6 +5,7 @@ from sklearn.model_selection import train_test_split
 from sklearn.preprocessing import LabelEncoder
 import joblib
 import numpy as np
+from flow_features import CIC_FEATURES
 
 import pandas as pd
 import glob
@@ -43,8 +44,8 @@ y = df['Label']
 le = LabelEncoder()
 y_encoded = le.fit_transform(y)
 
-# For demonstration, we'll use a subset of features. A real implementation would involve feature selection.
-features_to_use = [col for col in X.columns if X[col].dtype!= 'object'][:40] # Use first 40 numeric features
+# The CIC-IDS2017 columns the network agent computes for every flow (see flow_features.py)
+features_to_use = CIC_FEATURES
 X_numeric = X[features_to_use]
 
 X_train, X_test, y_train, y_test = train_test_split(X_numeric, y_encoded, test_size=0.3, random_state=42)
@@ -0,0 +1,300 @@
+# transport.py
+# Client-side transport shared by the agents: records are buffered and posted
+# in compressed batches to the server's /api/data/batch endpoint over a pooled
+# keep-alive session, instead of one HTTP request per record.
+#
+# send() never touches the network. Records go into a bounded queue that a
+# background thread drains, so a slow or unreachable server cannot stall the
+# capture loop. When the queue is full the overflow policy decides what is lost.
+# With a spool directory, batches the server does not accept are written to a
+# durable on-disk spool and replayed once it is reachable again.
+#
+# A batch the server rejects outright (a 4xx other than 408/429) is never
+# retried or spooled. A rejected msgpack batch is resent once as JSON, which
+# every server reads; if that works, the sender keeps using JSON.
+import gzip
+import json
+import random
+import threading
+import time
+from collections import deque
+import requests
+from requests.adapters import HTTPAdapter
+from spool import Spool
+
+# msgpack is optional; gzip-compressed JSON is used when it is not installed
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+OVERFLOW_POLICIES = ('drop_oldest', 'sample', 'spill')
+# Content types by the encoding byte stored with each spooled batch
+ENCODING_JSON = 0
+ENCODING_MSGPACK = 1
+CONTENT_TYPES = {ENCODING_JSON: 'application/json', ENCODING_MSGPACK: 'application/msgpack'}
+# Outcomes of posting a batch
+SENT, FAILED, REJECTED = 'sent', 'failed', 'rejected'
+# Marks batches replayed from the spool; the server archives them without treating them as live traffic
+REPLAYED_HEADER = 'X-SmartSec-Replayed'
+
+class BatchSender:
+    def __init__(self, backend_url, batch_size=500, flush_interval=1.0, use_msgpack=True, pool_size=4, timeout=5,
+                 max_queue=50000, overflow_policy='drop_oldest', sample_rate=0.1, spool_dir=None,
+                 spool_max_bytes=256 * 1024 * 1024, max_retries=3, retry_backoff=0.5, offline_backoff=5.0):
+        """
+        :param backend_url: The agent's /api/data URL; batches go to <backend_url>/batch.
+        :param batch_size: Send as soon as this many records are queued.
+        :param flush_interval: Send whatever is queued at least this often (seconds).
+        :param use_msgpack: Encode batches with msgpack when the library is available; falls back
+                            to JSON for good if the server rejects a msgpack batch.
+        :param max_queue: Records held in memory before the overflow policy kicks in.
+        :param overflow_policy: What a full queue does with new records:
+                                'drop_oldest' evicts the oldest queued record,
+                                'sample' admits a sample_rate fraction of them (each evicting the oldest),
+                                'spill' writes them to the spool and sends them once the server keeps up.
+        :param spool_dir: Directory of the on-disk spool. Without one, batches the server
+                          does not accept are dropped and 'spill' is not available.
+        :param spool_max_bytes: Size cap of the spool; the oldest segments are evicted beyond it.
+        :param max_retries: Extra attempts for a failed batch, with exponential backoff.
+        :param offline_backoff: After a batch is spooled, new batches go straight to the
+                                spool for this many seconds before the server is tried again.
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"overflow_policy must be one of {OVERFLOW_POLICIES}")
+        if overflow_policy == 'spill' and spool_dir is None:
+            raise ValueError("overflow_policy 'spill' needs a spool_dir")
+        self.batch_url = backend_url.rstrip('/') + '/batch'
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.use_msgpack = use_msgpack and msgpack is not None
+        self.encoding = ENCODING_MSGPACK if self.use_msgpack else ENCODING_JSON
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.overflow_policy = overflow_policy
+        self.sample_rate = sample_rate
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.offline_backoff = offline_backoff
+
+        # One pooled session keeps TCP connections alive between batches
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        # Batches spooled by a previous run are replayed as soon as the server answers
+        self.spool = Spool(spool_dir, max_bytes=spool_max_bytes) if spool_dir else None
+        self.counters = {'queued': 0, 'sent': 0, 'dropped': 0, 'retried': 0, 'spilled': 0, 'spooled': 0, 'replayed': 0,
+                         'rejected': 0}
+        self._queue = deque()
+        self._spill_buffer = []
+        self._offline_until = 0.0
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def send(self, record):
+        """Queues one record without blocking on the network."""
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                self._overflow(record)
+                return
+            self._queue.append(record)
+            self.counters['queued'] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify()
+
+    def flush(self):
+        """Asks the sender thread to send what is queued now instead of at the next interval."""
+        with self._cond:
+            self._cond.notify()
+
+    def close(self):
+        """Sends everything still queued (spooling what the server does not take), then stops the sender thread."""
+        with self._cond:
+            self._stop = True
+            self._cond.notify()
+        self._thread.join()
+        if self.spool is not None:
+            self.spool.close()
+        self.session.close()
+
+    def stats(self):
+        """Counters for records queued, sent, dropped, retried, spilled, spooled, replayed and rejected, plus queue and spool size."""
+        with self._cond:
+            stats = dict(self.counters)
+            stats['queue_depth'] = len(self._queue)
+        if self.spool is not None:
+            stats['spool_bytes'] = self.spool.stats()['bytes']
+        return stats
+
+    def encode(self, records):
+        """Returns the request body for a batch of records and its encoding."""
+        encoding = self.encoding
+        if encoding == ENCODING_MSGPACK:
+            body = msgpack.packb(records, use_bin_type=True)
+        else:
+            body = json.dumps(records).encode('utf-8')
+        return gzip.compress(body, compresslevel=1), encoding
+
+    def _headers(self, encoding, replayed=False):
+        headers = {'Content-Type': CONTENT_TYPES[encoding], 'Content-Encoding': 'gzip'}
+        if replayed:
+            headers[REPLAYED_HEADER] = '1'
+        return headers
+
+    def _overflow(self, record):
+        """Applies the overflow policy to a record arriving at a full queue (called with the lock held)."""
+        if self.overflow_policy == 'drop_oldest':
+            self._queue.popleft()
+            self._queue.append(record)
+            self.counters['queued'] += 1
+            self.counters['dropped'] += 1
+        elif self.overflow_policy == 'sample':
+            self.counters['dropped'] += 1
+            if random.random() < self.sample_rate:
+                self._queue.popleft()
+                self._queue.append(record)
+                self.counters['queued'] += 1
+        else:
+            # Spilled records are spooled a batch at a time
+            self._spill_buffer.append(record)
+            self.counters['spilled'] += 1
+            if len(self._spill_buffer) >= self.batch_size:
+                self._flush_spill_buffer()
+
+    def _flush_spill_buffer(self):
+        """Writes the spilled records collected so far to the spool (called with the lock held)."""
+        if self._spill_buffer:
+            body, encoding = self.encode(self._spill_buffer)
+            self.spool.append(body, encoding, len(self._spill_buffer))
+            self._spill_buffer = []
+
+    def _next_batch(self):
+        """Waits for a full batch or the flush interval; returns None once stopped and drained."""
+        with self._cond:
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not self._stop:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            if not self._queue:
+                self._flush_spill_buffer()
+                return None if self._stop else []
+            count = min(self.batch_size, len(self._queue))
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            if batch:
+                self._deliver(batch)
+            if self.spool and time.monotonic() >= self._offline_until:
+                self._replay_spool()
+
+    def _deliver(self, batch):
+        """Posts a live batch, falling back to the spool when the server does not take it."""
+        body, encoding = self.encode(batch)
+        if self.spool is not None and time.monotonic() < self._offline_until:
+            # The server was just found down; don't spend retries on every batch
+            self._spool(body, encoding, len(batch))
+            return
+        attempts = 1 if self._stop else self.max_retries + 1
+        result = self._send(body, encoding, len(batch), attempts)
+        if result == SENT:
+            return
+        if result == REJECTED:
+            # Sending it again, now or from the spool, would be rejected the same way
+            with self._cond:
+                self.counters['rejected'] += len(batch)
+            return
+        if self.spool is not None:
+            print(f"Server unreachable, spooling to {self.spool.directory} for the next {self.offline_backoff}s.")
+            self._spool(body, encoding, len(batch))
+            self._offline_until = time.monotonic() + self.offline_backoff
+        else:
+            with self._cond:
+                self.counters['dropped'] += len(batch)
+
+    def _spool(self, body, encoding, count):
+        self.spool.append(body, encoding, count)
+        with self._cond:
+            self.counters['spooled'] += count
+
+    def _replay_spool(self):
+        """Sends spooled batches oldest first, yielding to live traffic as soon as a batch of it is waiting."""
+        replayed = [0]
+        def deliver(payload, encoding, count):
+            with self._cond:
+                if self._stop or len(self._queue) >= self.batch_size:
+                    return False
+            result = self._send(payload, encoding, count, 1, replayed=True)
+            if result == FAILED:
+                self._offline_until = time.monotonic() + self.offline_backoff
+                return False
+            with self._cond:
+                # A rejected batch is skipped, so it cannot hold up the rest of the spool
+                self.counters['rejected' if result == REJECTED else 'replayed'] += count
+            if result == REJECTED:
+                return True
+            replayed[0] += count
+            return True
+
+        emptied = self.spool.replay(deliver)
+        if replayed[0]:
+            print(f"Replayed {replayed[0]} spooled records{' (spool empty)' if emptied else ''}.")
+
+    def _send(self, body, encoding, count, attempts, replayed=False):
+        """
+        Posts one encoded batch; a rejected msgpack batch is resent as JSON. replayed marks a batch
+        from the spool. Returns SENT, FAILED or REJECTED.
+        """
+        result = self._post(body, self._headers(encoding, replayed), count, attempts)
+        if result != REJECTED or encoding != ENCODING_MSGPACK:
+            return result
+        try:
+            body = gzip.compress(json.dumps(msgpack.unpackb(gzip.decompress(body), raw=False)).encode('utf-8'),
+                                 compresslevel=1)
+        except Exception as e:
+            # A spooled msgpack batch on an agent that no longer has msgpack
+            print(f"Could not re-encode a rejected msgpack batch as JSON: {e}")
+            return REJECTED
+        result = self._post(body, self._headers(ENCODING_JSON, replayed), count, attempts)
+        if result == SENT and self.encoding == ENCODING_MSGPACK:
+            print("Server does not accept msgpack batches; sending JSON from now on.")
+            self.encoding = ENCODING_JSON
+            self.use_msgpack = False
+        return result
+
+    def _post(self, body, headers, count, attempts):
+        """
+        Sends one encoded batch, retrying with exponential backoff. Returns SENT once the server
+        accepted it, REJECTED if it refused the batch itself (a 4xx other than 408 or 429,
+        which no retry fixes), or FAILED.
+        """
+        for attempt in range(attempts):
+            if attempt:
+                with self._cond:
+                    self.counters['retried'] += 1
+                time.sleep(self.retry_backoff * 2 ** (attempt - 1))
+            try:
+                response = self.session.post(self.batch_url, data=body, headers=headers, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                error = e
+                continue
+            if response.ok:
+                with self._cond:
+                    self.counters['sent'] += count
+                print(f"Batch sent successfully ({count} records, {len(body)} bytes).")
+                return SENT
+            if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+                print(f"Server rejected a batch of {count} records: HTTP {response.status_code} {response.text[:200]}")
+                return REJECTED
+            error = f"HTTP {response.status_code} {response.reason}"
+        print(f"Error sending batch to backend: {error}")
+        return FAILED